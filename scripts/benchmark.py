@@ -0,0 +1,226 @@
+"""Benchmark storyworld tools over synthetic workspaces.
+
+Generates a workspace per scale (see `scripts.synthetic_workspace`), then
+times every tool/resource handler in `mcp_app`: one cold call right after the
+workspace is created, followed by warm iterations. Results are written as JSON
+so runs can be compared:
+
+    python -m scripts.benchmark --scales 100,1000,10000 --output bench.json
+    python -m scripts.benchmark --scales 100 --compare bench.json --threshold 0.25
+
+`--via-client` routes calls through an in-memory FastMCP client (middleware,
+validation and serialization included) instead of calling handlers directly.
+"""
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+class _Ctx:
+    async def report_progress(self, *_args, **_kwargs):
+        return None
+
+
+def percentile(samples: list[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def summarize(samples_ms: list[float], wall_s: float) -> dict:
+    return {
+        "n": len(samples_ms),
+        "mean_ms": round(statistics.fmean(samples_ms), 3) if samples_ms else 0.0,
+        "p50_ms": round(percentile(samples_ms, 0.50), 3),
+        "p90_ms": round(percentile(samples_ms, 0.90), 3),
+        "p99_ms": round(percentile(samples_ms, 0.99), 3),
+        "max_ms": round(max(samples_ms), 3) if samples_ms else 0.0,
+        "ops_per_s": round(len(samples_ms) / wall_s, 2) if wall_s > 0 else 0.0,
+    }
+
+
+def tool_cases(code: str, story_id: str) -> list[tuple[str, str, dict]]:
+    """(kind, name, arguments) for every benchmarked tool/resource."""
+    return [
+        ("tool", "list_characters", {}),
+        ("tool", "get_character_context", {"code": code}),
+        ("tool", "get_character_context_compact", {"code": code}),
+        ("tool", "get_character_media_manifest", {"code": code}),
+        ("tool", "list_character_images", {"code": code}),
+        ("tool", "get_character_profile_image", {"code": code}),
+        ("tool", "get_runtime_capabilities", {}),
+        ("tool", "list_stories", {}),
+        ("tool", "build_story_page", {"story_id": story_id}),
+        ("tool", "ingest_comfy_outputs", {"code": code, "story_id": story_id, "limit": 5}),
+        ("resource", f"character://{code}/profile", {}),
+        ("resource", f"character://{code}/profile_image", {}),
+        ("resource", f"character://{code}/images", {}),
+    ]
+
+
+async def _direct_call(mcp_app, kind: str, name: str, args: dict):
+    if kind == "resource":
+        code = name.split("://", 1)[1].split("/", 1)[0]
+        handler = {
+            "profile": mcp_app.character_profile_resource,
+            "profile_image": mcp_app.character_profile_image,
+            "images": mcp_app.character_images_resource,
+        }[name.rsplit("/", 1)[1]]
+        return handler(code)
+    fn = getattr(mcp_app, name)
+    if asyncio.iscoroutinefunction(fn):
+        return await fn(ctx=_Ctx(), **args)
+    return fn(**args)
+
+
+async def _client_call(client, kind: str, name: str, args: dict):
+    if kind == "resource":
+        return await client.read_resource(name)
+    return await client.call_tool(name, args)
+
+
+def run_scale(scale: int, args) -> list[dict]:
+    from scripts import synthetic_workspace
+    from mcp_server import mcp_app
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix=f"storyworld-bench-{scale}-") as tmp:
+        root = Path(tmp)
+        started = time.perf_counter()
+        ws = synthetic_workspace.build_workspace(
+            root,
+            characters=scale,
+            images=args.images,
+            comfy_outputs=args.comfy_outputs,
+            stories=max(1, min(args.stories, scale)),
+            assets_per_story=args.assets_per_story,
+        )
+        gen_s = time.perf_counter() - started
+        synthetic_workspace.point_config_at(root)
+        code = ws["codes"][len(ws["codes"]) // 2]
+        cases = tool_cases(code, "story-000")
+        if args.only:
+            wanted = set(args.only.split(","))
+            cases = [c for c in cases if c[1].replace(code, "{code}") in wanted]
+
+        async def _via_client():
+            from fastmcp import Client
+
+            out = []
+            async with Client(mcp_app.mcp) as client:
+                for kind, name, call_args in cases:
+                    out.append(await _time_case(lambda: _client_call(client, kind, name, call_args), kind, name))
+            return out
+
+        async def _time_case(call, kind, name):
+            t0 = time.perf_counter()
+            await call()
+            cold_ms = (time.perf_counter() - t0) * 1000
+            samples = []
+            wall0 = time.perf_counter()
+            while len(samples) < args.iterations and time.perf_counter() - wall0 < args.max_seconds:
+                t0 = time.perf_counter()
+                await call()
+                samples.append((time.perf_counter() - t0) * 1000)
+            wall = time.perf_counter() - wall0
+            return {
+                "scale": scale,
+                "kind": kind,
+                "name": name.replace(code, "{code}"),
+                "cold_ms": round(cold_ms, 3),
+                "warm": summarize(samples, wall),
+            }
+
+        if args.via_client:
+            results = asyncio.run(_via_client())
+        else:
+            for kind, name, call_args in cases:
+                results.append(
+                    asyncio.run(_time_case(lambda: _direct_call(mcp_app, kind, name, call_args), kind, name))
+                )
+        for row in results:
+            row["workspace_gen_s"] = round(gen_s, 3)
+    return results
+
+
+def _git_sha() -> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=False)
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list[str]:
+    """Return human-readable regressions where warm p50 grew by more than `threshold`."""
+    base = {(r["scale"], r["name"]): r for r in baseline.get("results", [])}
+    regressions = []
+    for row in current.get("results", []):
+        old = base.get((row["scale"], row["name"]))
+        if not old:
+            continue
+        before, after = old["warm"]["p50_ms"], row["warm"]["p50_ms"]
+        if before > 0 and (after - before) / before > threshold:
+            regressions.append(f"{row['name']} @ {row['scale']}: p50 {before:.2f}ms -> {after:.2f}ms")
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--scales", default="100,1000", help="Comma-separated character counts")
+    p.add_argument("--images", type=int, default=3, help="Images per character")
+    p.add_argument("--comfy-outputs", type=int, default=200)
+    p.add_argument("--stories", type=int, default=20)
+    p.add_argument("--assets-per-story", type=int, default=50)
+    p.add_argument("--iterations", type=int, default=20, help="Warm iterations per tool")
+    p.add_argument("--max-seconds", type=float, default=10.0, help="Warm time budget per tool")
+    p.add_argument("--only", default="", help="Comma-separated tool/resource names to run")
+    p.add_argument("--via-client", action="store_true", help="Call through an in-memory FastMCP client")
+    p.add_argument("--output", default="", help="Write JSON results here (default: stdout)")
+    p.add_argument("--compare", default="", help="Baseline JSON to compare against")
+    p.add_argument("--threshold", type=float, default=0.25, help="Allowed warm p50 growth for --compare")
+    args = p.parse_args(argv)
+
+    # Keep the server's default workspace out of the repo while benchmarking.
+    os.environ.setdefault("WORKSPACE_DIR", tempfile.mkdtemp(prefix="storyworld-bench-default-"))
+    results = []
+    for scale in [int(s) for s in args.scales.split(",") if s.strip()]:
+        results.extend(run_scale(scale, args))
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "git_sha": _git_sha(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "via_client": args.via_client,
+            "iterations": args.iterations,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text, encoding="utf-8")
+    else:
+        print(text)
+
+    if args.compare:
+        regressions = compare(report, json.loads(Path(args.compare).read_text(encoding="utf-8")), args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
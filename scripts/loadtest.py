@@ -0,0 +1,280 @@
+"""Load-test the HTTP transport with concurrent MCP clients, fully offline.
+
+Starts, in order:
+
+1. a synthetic workspace (`scripts.synthetic_workspace`);
+2. a local stand-in for the GitHub contents API (serving extra character YAMLs
+   that are *not* in the workspace, so on-demand fetches are exercised) and
+   for the Hugging Face endpoint (404 for everything, so image downloads fail
+   fast instead of touching the network);
+3. `python -m mcp_server.mcp_app --transport http` pointed at both;
+
+then runs N concurrent FastMCP clients issuing a weighted mix of tool and
+resource calls, samples the server's RSS, and prints a JSON report:
+
+    python -m scripts.loadtest --clients 32 --duration 30 --characters 500
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from scripts import synthetic_workspace
+from scripts.benchmark import summarize
+
+# (weight, kind, name, argument builder) -- `local` is a code present on disk,
+# `remote` one that only the GitHub stand-in knows about.
+MIX = [
+    (10, "tool", "list_characters", lambda local, remote, story: {}),
+    (15, "tool", "get_character_context", lambda local, remote, story: {"code": local}),
+    (20, "tool", "get_character_context_compact", lambda local, remote, story: {"code": local}),
+    (10, "tool", "get_character_media_manifest", lambda local, remote, story: {"code": local}),
+    (10, "tool", "list_stories", lambda local, remote, story: {}),
+    (5, "tool", "build_story_page", lambda local, remote, story: {"story_id": story}),
+    (5, "tool", "get_character_context_compact", lambda local, remote, story: {"code": remote}),
+    (15, "resource", "character://{code}/profile", lambda local, remote, story: {"code": local}),
+    (10, "resource", "character://{code}/profile_image", lambda local, remote, story: {"code": local}),
+]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_standins(remote_yamls: dict[str, str]) -> tuple[ThreadingHTTPServer, str]:
+    """Serve GitHub contents API + raw files for `remote_yamls`; 404 everything else."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *_args):
+            return None
+
+        def _send(self, status: int, body: bytes, ctype: str = "application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            name = self.path.rsplit("/", 1)[-1]
+            code = name[:-5] if name.endswith(".yaml") else ""
+            if self.path.startswith("/repos/") and code in remote_yamls:
+                meta = {"name": name, "type": "file", "download_url": f"{base}/raw/{name}"}
+                return self._send(200, json.dumps(meta).encode("utf-8"))
+            if self.path.startswith("/raw/") and code in remote_yamls:
+                return self._send(200, remote_yamls[code].encode("utf-8"), "text/plain")
+            return self._send(404, b'{"message": "Not Found"}')
+
+        do_HEAD = do_GET
+
+    server = ThreadingHTTPServer(("127.0.0.1", _free_port()), Handler)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, base
+
+
+def rss_bytes(pid: int) -> int:
+    """Resident memory of `pid` plus its child processes (HTTP workers)."""
+    total = 0
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as fh:
+            for line in fh:
+                if line.startswith("VmRSS:"):
+                    total = int(line.split()[1]) * 1024
+                    break
+        with open(f"/proc/{pid}/task/{pid}/children", encoding="utf-8") as fh:
+            children = [int(c) for c in fh.read().split()]
+    except OSError:
+        return total
+    return total + sum(rss_bytes(c) for c in children)
+
+
+def start_server(workspace: Path, standin: str, port: int, log_path: Path, workers: int = 1, admission: bool = False) -> subprocess.Popen:
+    src = Path(__file__).resolve().parents[1] / "src"
+    env = dict(os.environ)
+    env.update(
+        {
+            "PYTHONPATH": os.pathsep.join([str(src), env.get("PYTHONPATH", "")]),
+            "WORKSPACE_DIR": str(workspace),
+            "PUBLIC_IMAGES_DIR": str(workspace / "characters" / "public_images"),
+            "GITHUB_API_URL": standin,
+            "HF_ENDPOINT": f"{standin}/hf",
+            "HF_HUB_DISABLE_TELEMETRY": "1",
+            "HF_HUB_ETAG_TIMEOUT": "2",
+            "COMFY_PROXY_IN_HTTP": "0",
+            # All load clients share one IP; per-client rate limits would dominate the numbers.
+            "ADMISSION_CONTROL": "1" if admission else "0",
+            "FASTMCP_LOG_LEVEL": "WARNING",
+        }
+    )
+    log = log_path.open("wb")
+    return subprocess.Popen(
+        [sys.executable, "-m", "mcp_server.mcp_app", "--transport", "http", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)],
+        env=env,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+
+
+def wait_for_port(port: int, proc: subprocess.Popen, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited early with code {proc.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"server did not listen on {port} within {timeout}s")
+
+
+async def run_clients(url: str, clients: int, duration: float, local_codes: list[str], remote_codes: list[str], stories: list[str], seed: int) -> dict:
+    from fastmcp import Client
+
+    weights = [m[0] for m in MIX]
+    samples: dict[str, list[float]] = {}
+    errors: dict[str, int] = {}
+    deadline = time.monotonic() + duration
+
+    async def worker(idx: int):
+        rng = random.Random(seed + idx)
+        async with Client(url, timeout=60) as client:
+            while time.monotonic() < deadline:
+                _, kind, name, build = rng.choices(MIX, weights=weights)[0]
+                args = build(rng.choice(local_codes), rng.choice(remote_codes), rng.choice(stories))
+                t0 = time.perf_counter()
+                try:
+                    if kind == "resource":
+                        await client.read_resource(name.format(**args))
+                    else:
+                        await client.call_tool(name, args)
+                    samples.setdefault(name, []).append((time.perf_counter() - t0) * 1000)
+                except Exception:
+                    errors[name] = errors.get(name, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(clients)))
+    wall = time.perf_counter() - started
+    everything = [s for values in samples.values() for s in values]
+    return {
+        "wall_s": round(wall, 3),
+        "overall": summarize(everything, wall),
+        "errors_total": sum(errors.values()),
+        "operations": {name: {**summarize(values, wall), "errors": errors.get(name, 0)} for name, values in sorted(samples.items())},
+        "errors": errors,
+    }
+
+
+def run(args) -> dict:
+    with tempfile.TemporaryDirectory(prefix="storyworld-load-") as tmp:
+        root = Path(tmp)
+        workspace = root / "workspace"
+        ws = synthetic_workspace.build_workspace(
+            workspace,
+            characters=args.characters,
+            images=args.images,
+            comfy_outputs=0,
+            stories=args.stories,
+            assets_per_story=args.assets_per_story,
+        )
+        rng = random.Random(args.seed)
+        remote_yamls = {
+            synthetic_workspace.character_code(args.characters + i): synthetic_workspace.character_yaml(args.characters + i, rng)
+            for i in range(max(1, args.remote_characters))
+        }
+        standin, base = start_standins(remote_yamls)
+        port = args.port or _free_port()
+        proc = start_server(workspace, base, port, root / "server.log", workers=args.workers, admission=args.admission)
+        rss = []
+        stop = threading.Event()
+
+        def sample_rss():
+            while not stop.is_set():
+                rss.append(rss_bytes(proc.pid))
+                stop.wait(0.5)
+
+        try:
+            wait_for_port(port, proc)
+            rss_start = rss_bytes(proc.pid)
+            sampler = threading.Thread(target=sample_rss, daemon=True)
+            sampler.start()
+            result = asyncio.run(
+                run_clients(
+                    f"http://127.0.0.1:{port}/mcp",
+                    args.clients,
+                    args.duration,
+                    ws["codes"],
+                    list(remote_yamls),
+                    [f"story-{s:03d}" for s in range(args.stories)],
+                    args.seed,
+                )
+            )
+            stop.set()
+            sampler.join(timeout=2)
+            rss_end = rss_bytes(proc.pid)
+        finally:
+            stop.set()
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+            standin.shutdown()
+
+        result["memory"] = {
+            "rss_start_bytes": rss_start,
+            "rss_end_bytes": rss_end,
+            "rss_peak_bytes": max(rss or [rss_end]),
+            "rss_growth_bytes": rss_end - rss_start,
+        }
+        result["config"] = {
+            "clients": args.clients,
+            "duration_s": args.duration,
+            "characters": args.characters,
+            "images": args.images,
+            "remote_characters": args.remote_characters,
+            "workers": args.workers,
+            "admission": args.admission,
+        }
+        return result
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--clients", type=int, default=16)
+    p.add_argument("--duration", type=float, default=20.0, help="Seconds of load per run")
+    p.add_argument("--characters", type=int, default=200)
+    p.add_argument("--images", type=int, default=3)
+    p.add_argument("--remote-characters", type=int, default=20, help="Characters only served by the GitHub stand-in")
+    p.add_argument("--stories", type=int, default=4)
+    p.add_argument("--assets-per-story", type=int, default=30)
+    p.add_argument("--port", type=int, default=0)
+    p.add_argument("--workers", type=int, default=1, help="Server HTTP worker processes")
+    p.add_argument("--admission", action="store_true", help="Keep admission control on (rejections count as errors)")
+    p.add_argument("--seed", type=int, default=11)
+    p.add_argument("--output", default="")
+    args = p.parse_args(argv)
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text, encoding="utf-8")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+"""Generate synthetic storyworld workspaces for benchmarks and load tests.
+
+Writes real-shaped character YAMLs (including the malformed `key: Positive: ...`
+lines students produce), small valid PNG images, a Comfy output folder and
+story bundles, laid out exactly like a real WORKSPACE_DIR:
+
+    python -m scripts.synthetic_workspace /tmp/ws --characters 1000 --images 3
+"""
+from pathlib import Path
+import argparse
+import json
+import os
+import random
+import struct
+import zlib
+
+TRAITS = [
+    "kind", "curious", "cautious", "loyal", "stubborn", "witty", "impatient", "brave", "shy",
+    "ambitious", "generous", "moody", "patient", "reckless", "musical", "analytical", "dreamy",
+]
+PLACES = ["Hong Kong", "Kowloon", "a fishing village", "a night market", "the harbour", "a rooftop studio"]
+HOBBIES = ["plays the erhu", "collects vinyl", "paints murals", "trains for marathons", "writes poetry", "repairs radios"]
+
+
+def character_code(i: int) -> str:
+    return f"{i:04d}{chr(ord('a') + i % 26)}"
+
+
+def png_bytes(width: int, height: int, seed: int) -> bytes:
+    """Encode a small RGB gradient as a valid PNG (no Pillow needed)."""
+    rows = []
+    for y in range(height):
+        row = bytearray([0])
+        for x in range(width):
+            row += bytes(((x * 4 + seed) % 256, (y * 4 + seed * 7) % 256, (seed * 13) % 256))
+        rows.append(bytes(row))
+    raw = zlib.compress(b"".join(rows), 6)
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", ihdr) + chunk(b"IDAT", raw) + chunk(b"IEND", b"")
+
+
+def character_yaml(i: int, rng: random.Random, backstory_sentences: int = 12) -> str:
+    code = character_code(i)
+    positive = ", ".join(rng.sample(TRAITS, 3))
+    negative = ", ".join(rng.sample(TRAITS, 2))
+    backstory = " ".join(
+        f"Growing up near {rng.choice(PLACES)}, they {rng.choice(HOBBIES)} and learned to be {rng.choice(TRAITS)}."
+        for _ in range(backstory_sentences)
+    )
+    if i % 5 == 0:
+        # Unquoted colons inside values: strict YAML rejects these files.
+        return (
+            f"name: Character {i}\ncode: {code}\nage: {18 + i % 40}\n"
+            f"personality: Positive: {positive}; Negative: {negative}\n"
+            f"backstory: {backstory}\nprofile_image: 1.png\n"
+        )
+    return (
+        f"name: Character {i}\ncode: {code}\nage: {18 + i % 40}\n"
+        f"personality: |\n  Positive: {positive}\n  Negative: {negative}\n"
+        f"backstory: >\n  {backstory}\n"
+        f"likes:\n  - {rng.choice(HOBBIES)}\n  - {rng.choice(HOBBIES)}\n"
+        f"profile_image: 1.png\n"
+    )
+
+
+def build_workspace(
+    root: Path,
+    characters: int = 100,
+    images: int = 3,
+    comfy_outputs: int = 50,
+    stories: int = 5,
+    assets_per_story: int = 20,
+    image_size: int = 64,
+    seed: int = 7,
+) -> dict:
+    """Create a workspace under `root` and return a summary of what was written."""
+    rng = random.Random(seed)
+    desc_dir = root / "characters" / "descriptions"
+    img_dir = root / "characters" / "images"
+    comfy_dir = root / "comfy-output"
+    stories_dir = root / "stories"
+    for d in (desc_dir, img_dir, comfy_dir, stories_dir):
+        d.mkdir(parents=True, exist_ok=True)
+
+    # A handful of distinct images reused across characters keeps generation fast.
+    palette = [png_bytes(image_size, image_size, s) for s in range(8)]
+    codes = []
+    for i in range(characters):
+        code = character_code(i)
+        codes.append(code)
+        (desc_dir / f"{code}.yaml").write_text(character_yaml(i, rng), encoding="utf-8")
+        cdir = img_dir / code
+        cdir.mkdir(exist_ok=True)
+        for n in range(1, images + 1):
+            (cdir / f"{n}.png").write_bytes(palette[(i + n) % len(palette)])
+
+    for n in range(comfy_outputs):
+        (comfy_dir / f"ComfyUI_{n:05d}_.png").write_bytes(palette[n % len(palette)])
+
+    for s in range(stories):
+        sid = f"story-{s:03d}"
+        code = codes[s % len(codes)] if codes else "0000a"
+        adir = stories_dir / sid / "assets" / code
+        adir.mkdir(parents=True, exist_ok=True)
+        for n in range(assets_per_story):
+            (adir / f"frame_{n:04d}.png").write_bytes(palette[n % len(palette)])
+        (stories_dir / sid / "story.json").write_text(
+            json.dumps({"story_id": sid, "title": f"Story {s}", "characters": [code], "updated_at": None}),
+            encoding="utf-8",
+        )
+
+    return {
+        "root": str(root),
+        "characters": characters,
+        "images_per_character": images,
+        "comfy_outputs": comfy_outputs,
+        "stories": stories,
+        "assets_per_story": assets_per_story,
+        "codes": codes,
+    }
+
+
+def point_config_at(root: Path) -> None:
+    """Re-point `mcp_server.config` at a generated workspace (in-process)."""
+    from mcp_server import config
+
+    config.WORKSPACE_DIR = root
+    config.CHARACTERS_DIR = root / "characters"
+    config.CHARACTERS_DESC_DIR = root / "characters" / "descriptions"
+    config.CHARACTERS_IMAGE_DIR = root / "characters" / "images"
+    config.COMFY_OUTPUT_DIR = root / "comfy-output"
+    config.STORIES_DIR = root / "stories"
+    config.STORY_REPOS_DIR = root / "stories" / "repos"
+    config.DISABLE_AUTO_DOWNLOAD = True
+    os.environ["PUBLIC_IMAGES_DIR"] = str(root / "characters" / "public_images")
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("root")
+    p.add_argument("--characters", type=int, default=100)
+    p.add_argument("--images", type=int, default=3)
+    p.add_argument("--comfy-outputs", type=int, default=50)
+    p.add_argument("--stories", type=int, default=5)
+    p.add_argument("--assets-per-story", type=int, default=20)
+    p.add_argument("--image-size", type=int, default=64)
+    args = p.parse_args()
+    summary = build_workspace(
+        Path(args.root),
+        characters=args.characters,
+        images=args.images,
+        comfy_outputs=args.comfy_outputs,
+        stories=args.stories,
+        assets_per_story=args.assets_per_story,
+        image_size=args.image_size,
+    )
+    summary.pop("codes")
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
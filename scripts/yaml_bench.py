@@ -0,0 +1,98 @@
+"""Micro-benchmark of the character YAML parse path.
+
+Parses a corpus of real-shaped character files (`scripts.synthetic_workspace`,
+every fifth file has the unquoted-colon shape that strict YAML rejects) with:
+
+- `safe_load+fallback`: pure-Python `yaml.safe_load`, re-trying every
+  malformed file strictly before falling back (the old path);
+- `csafe+fallback`: libyaml's `CSafeLoader`, still re-trying malformed files;
+- `csafe+fallback_cache`: `mcp_app._parse_character_text` (CSafeLoader and the
+  content-hash cache of files that need the fallback parser).
+
+    python -m scripts.yaml_bench --files 2000 --rounds 3 --output yaml-bench.json
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+
+
+def _legacy_parse(text: str, loader) -> dict:
+    import yaml
+
+    try:
+        raw = yaml.load(text, Loader=loader) or {}
+        return raw if isinstance(raw, dict) else {"text": str(raw)}
+    except Exception:
+        pass
+    fallback = {}
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith("#") or ":" not in stripped:
+            continue
+        key, value = stripped.split(":", 1)
+        if key.strip():
+            fallback[key.strip()] = value.strip()
+    return fallback
+
+
+def run(files: int, rounds: int) -> dict:
+    import yaml
+    from scripts import synthetic_workspace
+    from mcp_server import mcp_app
+
+    rng = random.Random(7)
+    corpus = [synthetic_workspace.character_yaml(i, rng) for i in range(files)]
+    variants = {
+        "safe_load+fallback": lambda text: _legacy_parse(text, yaml.SafeLoader),
+        "csafe+fallback": lambda text: _legacy_parse(text, mcp_app._yaml_safe_loader()),
+        "csafe+fallback_cache": mcp_app._parse_character_text,
+    }
+    results = {}
+    for subset, texts in (("all", corpus), ("malformed", corpus[::5])):
+        mcp_app._yaml_fallback_digests.clear()
+        rows = results[subset] = {}
+        for name, parse in variants.items():
+            per_round = []
+            for _ in range(rounds):
+                start = time.perf_counter()
+                for text in texts:
+                    parse(text)
+                per_round.append(time.perf_counter() - start)
+            # Round 1 of the cached variant is the cold pass; later rounds are warm.
+            warm = per_round[1:] or per_round
+            rows[name] = {
+                "cold_us_per_file": round(per_round[0] / len(texts) * 1e6, 2),
+                "warm_us_per_file": round(statistics.median(warm) / len(texts) * 1e6, 2),
+            }
+        baseline = rows["safe_load+fallback"]["warm_us_per_file"]
+        for row in rows.values():
+            row["speedup"] = round(baseline / row["warm_us_per_file"], 2) if row["warm_us_per_file"] else None
+    return {
+        "files": files,
+        "rounds": rounds,
+        "malformed_files": sum(1 for i in range(files) if i % 5 == 0),
+        "libyaml": bool(getattr(yaml, "__with_libyaml__", False)),
+        "results": results,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--output", default="")
+    args = parser.parse_args(argv)
+    report = run(args.files, max(1, args.rounds))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            fh.write(text + "\n")
+    print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
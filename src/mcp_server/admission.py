@@ -0,0 +1,315 @@
+"""Admission control for expensive tools: per-client token buckets + class caps.
+
+Expensive tools are grouped into classes (`network`, `disk`, `image`). Each
+class has a token bucket per client (`rate` tokens/s, up to `burst`) and a
+global cap on concurrent calls. A call that finds no tokens or no free slot is
+rejected immediately with a `ToolError` that says when to retry; nothing is
+queued. Calls whose arguments scale the work (e.g. `ingest_comfy_outputs`'s
+`limit`) cost more than one token. Character reads (tools and
+`character://` resources) are `image` calls while the character is local;
+one that will first fetch its YAML from GitHub or its images from Hugging
+Face is admitted as `network` and pays for those fetches.
+
+Enabled for HTTP/SSE by default (`ADMISSION_CONTROL=auto`); `1`/`0` force it
+on or off. Limits can be overridden with `ADMISSION_LIMITS`, a JSON object
+such as `{"network": {"rate": 0.5, "burst": 5, "concurrency": 2}}`.
+
+Admin tools (profiler control, saved profiles, metrics reset) follow the same
+transport rule in reverse: `STORYWORLD_ADMIN_TOOLS=auto` allows them only for
+local stdio/daemon clients.
+
+Clients are keyed by peer address. `X-Forwarded-For` is only honoured when the
+peer is one of `TRUSTED_PROXIES`, and then the rightmost hop that is not a
+trusted proxy is used, since everything to its left is client-supplied.
+Buckets live in the process, so with several HTTP workers each worker keeps
+its own.
+"""
+import functools
+import glob
+import ipaddress
+import json
+import math
+import threading
+import time
+
+from fastmcp.exceptions import ToolError
+from fastmcp.server.middleware import Middleware
+
+from . import config, metrics
+
+DEFAULT_LIMITS = {
+    "network": {"rate": 0.2, "burst": 5, "concurrency": 2},
+    "disk": {"rate": 1.0, "burst": 10, "concurrency": 4},
+    "image": {"rate": 5.0, "burst": 20, "concurrency": 8},
+}
+TOOL_CLASSES = {
+    "refresh_character": "network",
+    "push_story_repo": "network",
+    "ingest_comfy_outputs": "disk",
+    "build_story_page": "disk",
+    "commit_story_repo": "disk",
+    "list_character_images": "image",
+    "get_character_context": "image",
+    "get_character_profile_image": "image",
+}
+# Resource reads, keyed by their `metrics.resource_op` label.
+RESOURCE_CLASSES = {
+    "resource:character://{id}/profile": "image",
+    "resource:character://{id}/profile_image": "image",
+    "resource:character://{id}/images": "image",
+}
+# Character reads that fetch on a miss -> whether they also pull the HF images.
+CHARACTER_READS = {
+    "get_character_context": True,
+    "get_character_profile_image": False,
+    "resource:character://{id}/profile": False,
+    "resource:character://{id}/profile_image": False,
+    "resource:character://{id}/images": False,
+}
+# Extra tokens for on-demand fetches: the GitHub YAML and the HF image folder.
+YAML_FETCH_COST = 1.0
+IMAGES_FETCH_COST = 2.0
+_IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".gif", ".webp", ".bmp")
+# Idle buckets are dropped once this many clients have been seen.
+MAX_BUCKETS = 10_000
+
+
+def _has_local_yaml(code: str) -> bool:
+    desc = config.CHARACTERS_DESC_DIR
+    return (desc / f"{code}.yaml").exists() or any(desc.glob(f"{glob.escape(code)}*.yaml"))
+
+
+def _has_local_images(code: str) -> bool:
+    folder = config.CHARACTERS_IMAGE_DIR / code
+    if not folder.is_dir():
+        return False
+    return any(p.suffix.lower() in _IMAGE_SUFFIXES and p.is_file() for p in folder.iterdir())
+
+
+def fetch_cost(op: str, arguments: dict | None) -> float:
+    """Extra tokens for the GitHub/HF fetches a character read will trigger."""
+    if op not in CHARACTER_READS:
+        return 0.0
+    code = (arguments or {}).get("code")
+    if not isinstance(code, str) or not code or "/" in code or code.startswith("."):
+        return 0.0
+    cost = 0.0
+    try:
+        if not _has_local_yaml(code):
+            cost += YAML_FETCH_COST
+        if CHARACTER_READS[op] and not _has_local_images(code):
+            cost += IMAGES_FETCH_COST
+    except OSError:
+        pass
+    return cost
+
+
+def call_cost(tool: str, arguments: dict | None) -> float:
+    """Tokens charged for one call.
+
+    Bulk ingests pay per 20 files requested; character reads pay extra for
+    each on-demand fetch (`fetch_cost`).
+    """
+    if tool == "ingest_comfy_outputs":
+        try:
+            limit = int((arguments or {}).get("limit", 20))
+        except (TypeError, ValueError):
+            limit = 20
+        return float(max(1, math.ceil(limit / 20)))
+    return 1.0 + fetch_cost(tool, arguments)
+
+
+def classify(op: str, arguments: dict | None) -> tuple[str | None, float]:
+    """(class, cost) for a tool name or resource label; class None is unlimited.
+
+    A character read that has to fetch first is a `network` call.
+    """
+    cls = TOOL_CLASSES.get(op) or RESOURCE_CLASSES.get(op)
+    if cls is None:
+        return None, 0.0
+    cost = call_cost(op, arguments)
+    if op in CHARACTER_READS and cost > 1.0:
+        cls = "network"
+    return cls, cost
+
+
+def _load_limits() -> dict:
+    limits = {name: dict(values) for name, values in DEFAULT_LIMITS.items()}
+    if config.ADMISSION_LIMITS:
+        try:
+            override = json.loads(config.ADMISSION_LIMITS)
+        except ValueError:
+            override = {}
+        for name, values in (override or {}).items():
+            if isinstance(values, dict):
+                limits.setdefault(name, {"rate": 1.0, "burst": 10, "concurrency": 4}).update(values)
+    return limits
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst: float):
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+
+class AdmissionController:
+    def __init__(self, limits: dict | None = None, enabled: bool = False):
+        self.limits = limits or _load_limits()
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._buckets: dict[tuple[str, str], _Bucket] = {}
+        self._in_flight = {name: 0 for name in self.limits}
+        self._counters = {name: {"admitted": 0, "rejected_rate": 0, "rejected_concurrency": 0} for name in self.limits}
+
+    def acquire(self, client: str, cls: str, cost: float = 1.0) -> None:
+        """Take `cost` tokens and a concurrency slot, or raise ToolError with retry-after."""
+        limit = self.limits[cls]
+        rate, burst, cap = float(limit["rate"]), float(limit["burst"]), int(limit["concurrency"])
+        with self._lock:
+            if cost > burst:
+                self._counters[cls]["rejected_rate"] += 1
+                metrics.incr("admission_rejected")
+                raise ToolError(f"request too large for '{cls}' admission class (cost {cost:g} > burst {burst:g}); reduce it")
+            bucket = self._bucket(client, cls, burst)
+            now = time.monotonic()
+            bucket.tokens = min(burst, bucket.tokens + (now - bucket.updated) * rate)
+            bucket.updated = now
+            if bucket.tokens < cost:
+                retry_after = (cost - bucket.tokens) / rate if rate > 0 else 60.0
+                self._counters[cls]["rejected_rate"] += 1
+                metrics.incr("admission_rejected")
+                raise ToolError(f"rate limited ('{cls}' tools); retry after {retry_after:.1f}s")
+            if self._in_flight[cls] >= cap:
+                self._counters[cls]["rejected_concurrency"] += 1
+                metrics.incr("admission_rejected")
+                raise ToolError(f"server busy ({cap} '{cls}' calls in progress); retry after 1.0s")
+            bucket.tokens -= cost
+            self._in_flight[cls] += 1
+            self._counters[cls]["admitted"] += 1
+
+    def release(self, cls: str) -> None:
+        with self._lock:
+            self._in_flight[cls] -= 1
+
+    def _bucket(self, client: str, cls: str, burst: float) -> _Bucket:
+        key = (client, cls)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= MAX_BUCKETS:
+                self._prune()
+            bucket = self._buckets[key] = _Bucket(burst)
+        return bucket
+
+    def _prune(self) -> None:
+        cutoff = time.monotonic() - 600
+        for key in [k for k, b in self._buckets.items() if b.updated < cutoff]:
+            del self._buckets[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "clients_tracked": len(self._buckets),
+                "classes": {
+                    name: {**self.limits[name], "in_flight": self._in_flight[name], **self._counters[name]}
+                    for name in self.limits
+                },
+                "tools": dict(TOOL_CLASSES),
+            }
+
+
+CONTROLLER = AdmissionController(enabled=config.ADMISSION_CONTROL in ("1", "true"))
+ADMIN_ENABLED = config.ADMIN_TOOLS in ("1", "true", "auto")
+
+
+def configure_for_transport(transport: str) -> None:
+    global ADMIN_ENABLED
+    mode = config.ADMISSION_CONTROL
+    CONTROLLER.enabled = mode in ("1", "true") or (mode == "auto" and transport in ("http", "sse"))
+    admin = config.ADMIN_TOOLS
+    ADMIN_ENABLED = admin in ("1", "true") or (admin == "auto" and transport not in ("http", "sse"))
+
+
+def admin_error() -> dict | None:
+    """Error result for admin tools when they are disabled, else None."""
+    if ADMIN_ENABLED:
+        return None
+    return {"error": "admin tools are disabled on this transport; set STORYWORLD_ADMIN_TOOLS=1 to allow them"}
+
+
+@functools.lru_cache(maxsize=1)
+def _trusted_networks(proxies: tuple[str, ...]) -> tuple:
+    networks = []
+    for entry in proxies:
+        try:
+            networks.append(ipaddress.ip_network(entry, strict=False))
+        except ValueError:
+            continue
+    return tuple(networks)
+
+
+def _is_trusted(host: str) -> bool:
+    try:
+        addr = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(addr in net for net in _trusted_networks(tuple(config.TRUSTED_PROXIES)))
+
+
+def forwarded_client(peer: str | None, forwarded: str) -> str | None:
+    """Client address for a request from `peer` carrying `X-Forwarded-For: forwarded`."""
+    if not peer or not forwarded or not _is_trusted(peer):
+        return peer
+    hops = [h.strip() for h in forwarded.split(",") if h.strip()]
+    for hop in reversed(hops):
+        if not _is_trusted(hop):
+            return hop
+    return hops[0] if hops else peer
+
+
+def client_key(fastmcp_context) -> str:
+    """Identify the caller: peer address (or trusted proxies' forwarded hop) over HTTP, else the session."""
+    try:
+        from fastmcp.server.dependencies import get_http_request
+
+        request = get_http_request()
+        peer = request.client.host if request.client else None
+        host = forwarded_client(peer, request.headers.get("x-forwarded-for", ""))
+        if host:
+            return "ip:" + host
+    except Exception:
+        pass
+    for attr in ("client_id", "session_id"):
+        try:
+            value = getattr(fastmcp_context, attr, None)
+        except Exception:
+            value = None
+        if value:
+            return f"{attr}:{value}"
+    return "local"
+
+
+class AdmissionMiddleware(Middleware):
+    async def _admit(self, context, call_next, op: str, arguments: dict | None):
+        ctl = CONTROLLER
+        if not ctl.enabled:
+            return await call_next(context)
+        cls, cost = classify(op, arguments)
+        if cls is None or cls not in ctl.limits:
+            return await call_next(context)
+        ctl.acquire(client_key(context.fastmcp_context), cls, cost)
+        try:
+            return await call_next(context)
+        finally:
+            ctl.release(cls)
+
+    async def on_call_tool(self, context, call_next):
+        return await self._admit(context, call_next, context.message.name, context.message.arguments)
+
+    async def on_read_resource(self, context, call_next):
+        uri = str(context.message.uri)
+        scheme, _, rest = uri.partition("://")
+        arguments = {"code": rest.split("/", 1)[0]} if scheme == "character" else None
+        return await self._admit(context, call_next, metrics.resource_op(uri), arguments)
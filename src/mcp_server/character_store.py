@@ -0,0 +1,162 @@
+"""Compiled character store: every character YAML parsed once into one SQLite file.
+
+With thousands of small YAML files, each lookup costs an open, a read and a
+slow YAML parse. The store keeps the parsed profiles in one SQLite database
+(`WORKSPACE_DIR/.cache/characters.sqlite3`, or `CHARACTER_STORE_PATH`)
+indexed by code. Reads go through SQLite's memory map (`mmap_size`), so a hit
+costs one indexed row read plus a `stat` of the source YAML.
+
+Rebuilds are incremental. Each row carries its source file's `mtime_ns:size`.
+`sync()` stats the directory and re-parses only the files that were added or
+changed, and drops rows whose YAML is gone. `get()` re-checks one file on every
+read, so an edited YAML is picked up before the next `sync()`.
+"""
+from pathlib import Path
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from . import config, metrics
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS characters (
+    code TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    version TEXT NOT NULL,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+_UPSERT = "INSERT OR REPLACE INTO characters (code, path, version, data, updated_at) VALUES (?, ?, ?, ?, ?)"
+_MMAP_BYTES = 256 * 1024 * 1024
+
+
+def _version(st: os.stat_result) -> str:
+    return f"{st.st_mtime_ns}:{st.st_size}"
+
+
+class CharacterStore:
+    def __init__(self, path: Path, parse):
+        """`parse(path) -> dict` turns one YAML file into a profile."""
+        self.path = path
+        self.parse = parse
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={_MMAP_BYTES}")
+            conn.execute(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def lookup(self, code: str, desc_dir: Path) -> dict | None:
+        """Profile for `code` if its stored row is from `desc_dir` and still current, else None."""
+        row = self._conn().execute("SELECT path, version, data FROM characters WHERE code = ?", (code,)).fetchone()
+        if row is None or os.path.dirname(row[0]) != str(desc_dir):
+            return None
+        try:
+            st = os.stat(row[0])
+        except OSError:
+            return None
+        if _version(st) != row[1]:
+            return None
+        metrics.incr("cache_hit:character_store")
+        return json.loads(row[2])
+
+    def get(self, yaml_path: Path, st: os.stat_result | None = None) -> dict:
+        """Profile for one YAML file, re-parsing (and storing) it if it changed."""
+        st = st or yaml_path.stat()
+        version = _version(st)
+        row = self._conn().execute("SELECT path, version, data FROM characters WHERE code = ?", (yaml_path.stem,)).fetchone()
+        if row is not None and row[:2] == (str(yaml_path), version):
+            metrics.incr("cache_hit:character_store")
+            return json.loads(row[2])
+        metrics.incr("cache_miss:character_store")
+        data = self.parse(yaml_path)
+        self._put(yaml_path, version, data)
+        return data
+
+    def sync(self, desc_dir: Path) -> dict:
+        """Bring the store in line with `desc_dir`; only changed files are parsed."""
+        conn = self._conn()
+        stored = {code: (path, version) for code, path, version in conn.execute("SELECT code, path, version FROM characters")}
+        seen = set()
+        rows = []
+        added = updated = failed = 0
+        with metrics.stage("character_store_sync"):
+            try:
+                entries = list(os.scandir(desc_dir))
+            except OSError:
+                entries = []
+            for entry in entries:
+                if not entry.name.endswith(".yaml") or not entry.is_file():
+                    continue
+                code = entry.name[: -len(".yaml")]
+                seen.add(code)
+                version = _version(entry.stat())
+                previous = stored.get(code)
+                if previous is not None and previous == (entry.path, version):
+                    continue
+                try:
+                    data = self.parse(Path(entry.path))
+                except Exception:
+                    failed += 1
+                    continue
+                rows.append(self._row(Path(entry.path), version, data))
+                if previous is None:
+                    added += 1
+                else:
+                    updated += 1
+            removed = [code for code in stored if code not in seen]
+            if rows or removed:
+                # One transaction per sync: a cold build of thousands of files is a single commit.
+                with conn:
+                    conn.execute("BEGIN")
+                    conn.executemany(_UPSERT, rows)
+                    conn.executemany("DELETE FROM characters WHERE code = ?", [(code,) for code in removed])
+        if added or updated:
+            metrics.incr("cache_miss:character_store", added + updated)
+        return {"added": added, "updated": updated, "removed": len(removed), "failed": failed, "total": len(seen) - failed}
+
+    def items(self) -> list[tuple[str, dict]]:
+        """All `(code, profile)` pairs, in code order."""
+        rows = self._conn().execute("SELECT code, data FROM characters ORDER BY code").fetchall()
+        return [(code, json.loads(data)) for code, data in rows]
+
+    def clear(self) -> None:
+        self._conn().execute("DELETE FROM characters")
+
+    def _put(self, yaml_path: Path, version: str, data: dict) -> None:
+        self._conn().execute(_UPSERT, self._row(yaml_path, version, data))
+
+    @staticmethod
+    def _row(yaml_path: Path, version: str, data: dict) -> tuple:
+        return (yaml_path.stem, str(yaml_path), version, json.dumps(data, default=str), time.time())
+
+
+_stores: dict[str, CharacterStore] = {}
+_guard = threading.Lock()
+
+
+def store_path() -> Path:
+    if config.CHARACTER_STORE_PATH:
+        return Path(config.CHARACTER_STORE_PATH)
+    return config.WORKSPACE_DIR / ".cache" / "characters.sqlite3"
+
+
+def get_store(parse) -> CharacterStore:
+    """Store for the current workspace (tests and CLI flags may re-point it)."""
+    path = store_path()
+    key = str(path)
+    with _guard:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = CharacterStore(path, parse)
+        return store
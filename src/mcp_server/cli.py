@@ -0,0 +1,37 @@
+"""`storyworld-mcp` entry point.
+
+With `STORYWORLD_DAEMON=1` (or `--daemon`), stdio launches go through the
+lightweight shim in `mcp_server.shim` and never import the server itself.
+Everything else runs `mcp_app.main` in-process as before.
+"""
+import sys
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = list(sys.argv[1:] if argv is None else argv)
+    daemon_flag = "--daemon" in args
+    args = [a for a in args if a != "--daemon"]
+
+    from . import config
+
+    if (daemon_flag or config.DAEMON_MODE) and _is_stdio(args):
+        from . import shim
+
+        sys.exit(shim.main(args))
+
+    from .mcp_app import main as server_main
+
+    server_main(args)
+
+
+def _is_stdio(args: list[str]) -> bool:
+    for i, arg in enumerate(args):
+        if arg == "--transport" and i + 1 < len(args):
+            return args[i + 1] == "stdio"
+        if arg.startswith("--transport="):
+            return arg.split("=", 1)[1] == "stdio"
+    return True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""Managed proxy to the upstream comfy MCP server.
+
+`create_proxy(target)` opens a fresh upstream session for every request and
+never notices when the upstream dies. `ManagedComfyProxy` wraps the same
+FastMCP proxy machinery with:
+
+- lazy spawn + keep-alive: one upstream session, opened on first use and
+  reused by every request (stdio upstreams are spawned once);
+- health checks: if the upstream has been quiet for `COMFY_PROXY_HEALTH_INTERVAL`
+  seconds it is pinged before the next call, and restarted if the ping fails;
+- automatic restart: a transport failure drops the session so the next call
+  reconnects; read-only calls are retried once on a fresh session;
+- per-tool upstream latency in `metrics` (operation `upstream:comfy:<tool>`);
+- a TTL cache for read-only upstream tools (`readOnlyHint` or a name matching
+  `COMFY_PROXY_CACHE_TOOLS`, default `list_*`).
+"""
+from fnmatch import fnmatch
+import asyncio
+import json
+import logging
+import time
+
+from fastmcp.exceptions import FastMCPError
+from mcp.shared.exceptions import McpError
+from mcp.types import CONNECTION_CLOSED
+from fastmcp.server.middleware import Middleware
+from fastmcp.server.providers.proxy import FastMCPProxy, StatefulProxyClient
+
+from . import config, metrics
+
+LOG = logging.getLogger(__name__)
+
+
+class _KeepAliveClient(StatefulProxyClient):
+    """Stateful proxy client with ordinary ref-counted exits.
+
+    `StatefulProxyClient.__aexit__` is a no-op (it is torn down per downstream
+    session); here the manager holds one reference for the client's lifetime,
+    so each request's `async with client:` must release its own.
+    """
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self._disconnect()
+
+
+class ManagedComfyProxy:
+    def __init__(
+        self,
+        target,
+        name: str = "comfy",
+        cache_ttl: float | None = None,
+        cache_patterns: list[str] | None = None,
+        health_interval: float | None = None,
+        ping_timeout: float = 5.0,
+    ):
+        self.target = target
+        self.name = name
+        self.cache_ttl = config.COMFY_PROXY_CACHE_TTL if cache_ttl is None else cache_ttl
+        self.cache_patterns = config.COMFY_PROXY_CACHE_TOOLS if cache_patterns is None else cache_patterns
+        self.health_interval = config.COMFY_PROXY_HEALTH_INTERVAL if health_interval is None else health_interval
+        self.ping_timeout = ping_timeout
+        self._client: _KeepAliveClient | None = None
+        self._client_loop = None
+        self._lock: asyncio.Lock | None = None
+        self._lock_loop = None
+        self._cache: dict[tuple[str, str], tuple[float, object]] = {}
+        self.connects = 0
+        self.restarts = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.last_ok: float | None = None
+        self.last_error: str | None = None
+        self.server = FastMCPProxy(client_factory=self._get_client, name=f"{name}-proxy")
+        self.server.add_middleware(_ManagedProxyMiddleware(self))
+
+    # -- session management -------------------------------------------------
+
+    def _get_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._lock_loop is not loop:
+            self._lock, self._lock_loop = asyncio.Lock(), loop
+        return self._lock
+
+    async def _get_client(self) -> _KeepAliveClient:
+        loop = asyncio.get_running_loop()
+        client = self._client
+        if client is not None and client.is_connected() and self._client_loop is loop:
+            return client
+        async with self._get_lock():
+            client = self._client
+            if client is not None and client.is_connected() and self._client_loop is loop:
+                return client
+            client = _KeepAliveClient(self.target)
+            start = time.perf_counter()
+            try:
+                # Held open (nesting count 1) until reset: this is the keep-alive.
+                await client._connect()
+            except Exception as ex:
+                self.last_error = f"connect failed: {ex}"
+                metrics.incr("upstream_connect_errors", op=f"upstream:{self.name}")
+                raise
+            metrics.METRICS.observe("stage:connect", time.perf_counter() - start, op=f"upstream:{self.name}")
+            self._client, self._client_loop = client, loop
+            self.connects += 1
+            self.last_ok = time.monotonic()
+            return client
+
+    async def reset(self, reason: str) -> None:
+        """Drop the upstream session; the next call reconnects (respawns stdio)."""
+        client, self._client = self._client, None
+        self.restarts += 1
+        self.last_error = reason
+        metrics.incr("upstream_restarts", op=f"upstream:{self.name}")
+        self._cache.clear()
+        LOG.warning("Restarting %s proxy: %s", self.name, reason)
+        if client is not None:
+            try:
+                await client._disconnect(force=True)
+            except Exception:
+                pass
+
+    async def check_health(self) -> bool:
+        try:
+            client = await self._get_client()
+            await asyncio.wait_for(client.ping(), timeout=self.ping_timeout)
+        except Exception as ex:
+            await self.reset(f"health check failed: {ex}")
+            return False
+        self.last_ok = time.monotonic()
+        return True
+
+    async def aclose(self) -> None:
+        client, self._client = self._client, None
+        if client is not None:
+            try:
+                await client._disconnect(force=True)
+            except Exception:
+                pass
+
+    # -- caching ------------------------------------------------------------
+
+    def is_cacheable(self, tool_name: str, tool=None) -> bool:
+        if self.cache_ttl <= 0:
+            return False
+        annotations = getattr(tool, "annotations", None)
+        if annotations is not None and getattr(annotations, "readOnlyHint", False):
+            return True
+        return any(fnmatch(tool_name, pattern) for pattern in self.cache_patterns)
+
+    def cache_get(self, key: tuple[str, str]):
+        entry = self._cache.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.cache_ttl:
+            self._cache.pop(key, None)
+            return None
+        return entry[1]
+
+    def cache_put(self, key: tuple[str, str], value) -> None:
+        self._cache[key] = (time.monotonic(), value)
+
+    def status(self) -> dict:
+        client = self._client
+        return {
+            "name": self.name,
+            "connected": bool(client is not None and client.is_connected()),
+            "connects": self.connects,
+            "restarts": self.restarts,
+            "last_ok_age_s": round(time.monotonic() - self.last_ok, 3) if self.last_ok else None,
+            "last_error": self.last_error,
+            "cache": {
+                "ttl_s": self.cache_ttl,
+                "patterns": list(self.cache_patterns),
+                "entries": len(self._cache),
+                "hits": self.cache_hits,
+                "misses": self.cache_misses,
+            },
+            "upstream": {
+                op: summary
+                for op, summary in metrics.METRICS.snapshot()["operations"].items()
+                if op.startswith(f"upstream:{self.name}:")
+            },
+        }
+
+
+def _is_transport_failure(ex: BaseException) -> bool:
+    """True if a call failed in the upstream link rather than in the tool.
+
+    Upstream tool errors come back as error results, and the server wraps any
+    exception raised while forwarding in a `ToolError`, so look at its cause.
+    """
+    cause = ex.__cause__ if isinstance(ex, FastMCPError) else ex
+    if cause is None or isinstance(cause, FastMCPError):
+        return False
+    if isinstance(cause, McpError):
+        return cause.error.code == CONNECTION_CLOSED
+    return True
+
+
+class _ManagedProxyMiddleware(Middleware):
+    def __init__(self, proxy: ManagedComfyProxy):
+        self.proxy = proxy
+
+    async def on_call_tool(self, context, call_next):
+        proxy = self.proxy
+        name = context.message.name
+        op = f"upstream:{proxy.name}:{name}"
+        tool = None
+        try:
+            tool = await proxy.server.get_tool(name)
+        except Exception:
+            pass
+        cacheable = proxy.is_cacheable(name, tool)
+        key = (name, json.dumps(context.message.arguments or {}, sort_keys=True, default=str))
+        if cacheable:
+            cached = proxy.cache_get(key)
+            if cached is not None:
+                proxy.cache_hits += 1
+                metrics.incr(f"cache_hit:{proxy.name}_proxy")
+                return cached
+            proxy.cache_misses += 1
+            metrics.incr(f"cache_miss:{proxy.name}_proxy")
+
+        if proxy.last_ok is not None and time.monotonic() - proxy.last_ok > proxy.health_interval:
+            await proxy.check_health()
+
+        attempts = 2 if cacheable else 1
+        for attempt in range(attempts):
+            with metrics.operation(op):
+                try:
+                    result = await call_next(context)
+                except Exception as ex:
+                    if not _is_transport_failure(ex):
+                        raise
+                    await proxy.reset(f"{name} failed: {ex.__cause__ or ex!r}")
+                    if attempt + 1 < attempts:
+                        continue
+                    raise
+            proxy.last_ok = time.monotonic()
+            if cacheable and not getattr(result, "is_error", False):
+                proxy.cache_put(key, result)
+            return result
+
+    async def on_list_tools(self, context, call_next):
+        try:
+            return await call_next(context)
+        except Exception as ex:
+            if _is_transport_failure(ex):
+                await self.proxy.reset(f"list_tools failed: {ex.__cause__ or ex!r}")
+            raise
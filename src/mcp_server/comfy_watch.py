@@ -0,0 +1,242 @@
+"""Push-based ingest of Comfy outputs as they are written.
+
+`ComfyWatcher` polls `COMFY_OUTPUT_DIR` from a background thread, but only
+re-lists directories whose mtime changed, so an idle output folder costs one
+`stat` per directory per tick. Files that existed when the watch started are
+left alone. A new file is ingested once its size and mtime have not changed
+for `COMFY_WATCH_STABLE_S` seconds. This is how we tell that Comfy has
+finished writing it.
+
+Each ingested batch is reported to subscribed sessions as an MCP log
+notification (logger `storyworld.comfy_watch`), so agents no longer poll
+`ingest_comfy_outputs`.
+
+There is one watcher per process and one target. Starting it again for a
+different character or story is refused until it is stopped, so one client
+cannot silently redirect another's outputs. A batch whose ingest fails is
+retried with exponential backoff. After `max_failures` attempts its files are
+dropped and listed under `failed` in the status.
+"""
+from pathlib import Path
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from . import metrics
+
+LOG = logging.getLogger(__name__)
+NOTIFY_LOGGER = "storyworld.comfy_watch"
+# Directories modified this recently are always re-listed: on filesystems with
+# coarse mtimes a file created right after a scan may not bump the mtime again.
+_RECENT_S = 2.0
+_FAILED_KEEP = 100
+
+
+class ComfyWatcher:
+    def __init__(self, root: Path, ingest, extensions: tuple[str, ...], interval: float = 0.5, stable_s: float = 1.0,
+                 max_failures: int = 3):
+        self.root = Path(root)
+        self.ingest = ingest
+        self.extensions = extensions
+        self.interval = interval
+        self.stable_s = stable_s
+        self.max_failures = max(1, max_failures)
+        self.target: dict | None = None
+        self._dirs: dict[str, tuple[int, list[str], set[str]]] = {}
+        self._pending: dict[str, tuple[tuple[int, int], float]] = {}
+        # path -> (failed attempts, monotonic time of the next attempt)
+        self._retries: dict[str, tuple[int, float]] = {}
+        self._failed: dict[str, str] = {}
+        self._subscribers: list[tuple[object, asyncio.AbstractEventLoop]] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.ingested = 0
+        self.batches = 0
+        self.last_event: dict | None = None
+        self.last_error: str | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, code: str, story_id: str = "", mode: str = "copy") -> bool:
+        """Start watching for `code` / `story_id`; False if already watching for another target."""
+        with self._lock:
+            target = {"code": code, "story_id": story_id or "", "mode": mode}
+            if self.running:
+                return self.target == target
+            self.target = target
+            self._dirs.clear()
+            self._pending.clear()
+            self._retries.clear()
+            self._walk(str(self.root), baseline=True)
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="comfy-watch", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self) -> None:
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=max(5.0, self.interval * 4))
+        with self._lock:
+            self._subscribers.clear()
+
+    def subscribe(self, session, loop: asyncio.AbstractEventLoop) -> None:
+        """Send ingest events to `session` (anything with `send_log_message`)."""
+        with self._lock:
+            if all(s is not session for s, _ in self._subscribers):
+                self._subscribers.append((session, loop))
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "running": self.running,
+                "root": str(self.root),
+                "target": dict(self.target) if self.target else None,
+                "interval_s": self.interval,
+                "stable_s": self.stable_s,
+                "directories": len(self._dirs),
+                "pending": sorted(self._pending),
+                "retrying": {p: n for p, (n, _) in sorted(self._retries.items())},
+                "failed": [{"path": p, "error": e} for p, e in self._failed.items()],
+                "subscribers": len(self._subscribers),
+                "ingested": self.ingested,
+                "batches": self.batches,
+                "last_event": self.last_event,
+                "last_error": self.last_error,
+            }
+
+    # -- background loop ----------------------------------------------------
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as ex:
+                self.last_error = str(ex)
+                LOG.warning("Comfy watch tick failed: %s", ex)
+
+    def poll(self, now: float | None = None) -> dict | None:
+        """One tick: discover new files, ingest the ones that are stable."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._walk(str(self.root), baseline=False)
+            ready = self._ready(now)
+            target = dict(self.target) if self.target else None
+        if not ready or target is None:
+            return None
+        ready.sort(key=lambda item: item[1])
+        paths = [Path(p) for p, _ in ready]
+        with metrics.operation("watch:comfy"):
+            try:
+                result = self.ingest(paths, target["code"], target["story_id"], target["mode"])
+            except Exception as ex:
+                self.last_error = f"ingest failed: {ex}"
+                self._failed_batch([p for p, _ in ready], now, str(ex))
+                raise
+        with self._lock:
+            for p, _ in ready:
+                self._pending.pop(p, None)
+                self._retries.pop(p, None)
+        self.ingested += len(paths)
+        self.batches += 1
+        metrics.incr("watch_ingested", len(paths), op="watch:comfy")
+        event = {
+            "event": "comfy_outputs_ingested",
+            "code": target["code"],
+            "story_id": result.get("story_id"),
+            "ingested": result.get("ingested", len(paths)),
+            "assets": [a.get("filename") for a in result.get("assets") or []],
+        }
+        self.last_event = event
+        self._notify(event)
+        return result
+
+    def _failed_batch(self, paths: list[str], now: float, error: str) -> None:
+        with self._lock:
+            for p in paths:
+                attempts = self._retries.get(p, (0, 0.0))[0] + 1
+                if attempts < self.max_failures:
+                    self._retries[p] = (attempts, now + max(self.stable_s, self.interval) * 2 ** attempts)
+                    continue
+                self._pending.pop(p, None)
+                self._retries.pop(p, None)
+                self._failed[p] = error
+                metrics.incr("watch_failed", op="watch:comfy")
+                LOG.warning("Comfy watch gave up on %s after %d attempts: %s", p, attempts, error)
+            while len(self._failed) > _FAILED_KEEP:
+                self._failed.pop(next(iter(self._failed)))
+
+    def _walk(self, d: str, baseline: bool) -> None:
+        try:
+            st = os.stat(d)
+        except OSError:
+            self._dirs.pop(d, None)
+            return
+        known = self._dirs.get(d)
+        recent = time.time() - st.st_mtime < _RECENT_S
+        if known is None or known[0] != st.st_mtime_ns or recent:
+            subdirs, files = [], set()
+            try:
+                with os.scandir(d) as it:
+                    for entry in it:
+                        if entry.name.startswith("."):
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        elif os.path.splitext(entry.name)[1].lower() in self.extensions:
+                            files.add(entry.path)
+            except OSError:
+                return
+            previous = known[2] if known is not None else set()
+            if not baseline:
+                for p in files - previous:
+                    self._pending.setdefault(p, ((-1, -1), 0.0))
+            known = self._dirs[d] = (st.st_mtime_ns, subdirs, files)
+        for sub in known[1]:
+            self._walk(sub, baseline)
+
+    def _ready(self, now: float) -> list[tuple[str, float]]:
+        ready = []
+        for p, (sig, since) in list(self._pending.items()):
+            try:
+                st = os.stat(p)
+            except OSError:
+                self._pending.pop(p, None)
+                self._retries.pop(p, None)
+                continue
+            retry = self._retries.get(p)
+            if retry is not None and now < retry[1]:
+                continue
+            current = (st.st_size, st.st_mtime_ns)
+            if current != sig:
+                self._pending[p] = (current, now)
+            elif st.st_size > 0 and now - since >= self.stable_s:
+                ready.append((p, st.st_mtime))
+        return ready
+
+    def _notify(self, event: dict) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for session, loop in subscribers:
+            try:
+                future = asyncio.run_coroutine_threadsafe(
+                    session.send_log_message(level="info", data=event, logger=NOTIFY_LOGGER), loop
+                )
+            except RuntimeError:
+                self._drop(session)
+                continue
+            future.add_done_callback(lambda f, s=session: self._sent(f, s))
+
+    def _sent(self, future, session) -> None:
+        if future.cancelled() or future.exception() is not None:
+            self._drop(session)
+
+    def _drop(self, session) -> None:
+        with self._lock:
+            self._subscribers = [(s, l) for s, l in self._subscribers if s is not session]
@@ -22,6 +22,8 @@ COMFY_OUTPUT_DIR = Path(os.getenv("COMFY_OUTPUT_DIR", str(WORKSPACE_DIR / "comfy
 
 # Default remote sources (overrideable)
 GITHUB_CHARACTERS_REPO = os.getenv("GITHUB_CHARACTERS_REPO", "venetanji/polyu-storyworld")
+# GitHub REST API base (point at a local stand-in for offline load tests)
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com").strip().rstrip("/")
 GITHUB_CHARACTERS_PATH = os.getenv("GITHUB_CHARACTERS_PATH", "characters")
 HF_IMAGES_DATASET = os.getenv("HF_IMAGES_DATASET", "venetanji/polyu-storyworld-characters")
 
@@ -39,25 +41,109 @@ COMFY_MCP_AUTO_SPAWN = os.getenv("COMFY_MCP_AUTO_SPAWN", "1") in ("1", "true", "
 COMFY_MCP_SERVER_SPEC = os.getenv("COMFY_MCP_SERVER_SPEC", "git+https://github.com/venetanji/comfyui-mcp-server.git").strip()
 COMFY_MCP_SERVER_ENTRYPOINT = os.getenv("COMFY_MCP_SERVER_ENTRYPOINT", "comfyui-mcp-server").strip()
 COMFY_MCP_SERVER_EXTRA_ARGS = os.getenv("COMFY_MCP_SERVER_EXTRA_ARGS", "").strip()
+# Managed comfy proxy: TTL (s) for cached read-only upstream results (0 disables),
+# extra tool-name patterns treated as read-only, and idle seconds before a health ping
+COMFY_PROXY_CACHE_TTL = float(os.getenv("COMFY_PROXY_CACHE_TTL", "30"))
+COMFY_PROXY_CACHE_TOOLS = [p.strip() for p in os.getenv("COMFY_PROXY_CACHE_TOOLS", "list_*").split(",") if p.strip()]
+COMFY_PROXY_HEALTH_INTERVAL = float(os.getenv("COMFY_PROXY_HEALTH_INTERVAL", "60"))
 FASTMCP_SHOW_BANNER = os.getenv("FASTMCP_SHOW_BANNER", "0") in ("1", "true", "True")
 FASTMCP_LOG_LEVEL = os.getenv("FASTMCP_LOG_LEVEL", "WARNING").strip()
+# Serve Prometheus text metrics on GET /metrics in http/sse mode
+METRICS_HTTP_ENDPOINT = os.getenv("METRICS_HTTP_ENDPOINT", "0") in ("1", "true", "True")
+# Sampling profiler: calls slower than the threshold are saved under WORKSPACE_DIR/.profiles
+PROFILE_ENABLED = os.getenv("STORYWORLD_PROFILE", "0") in ("1", "true", "True")
+PROFILE_THRESHOLD_MS = float(os.getenv("STORYWORLD_PROFILE_THRESHOLD_MS", "500"))
+PROFILE_INTERVAL_MS = float(os.getenv("STORYWORLD_PROFILE_INTERVAL_MS", "5"))
+PROFILE_KEEP = int(os.getenv("STORYWORLD_PROFILE_KEEP", "50"))
+# Store argument values in saved profiles (off: argument names only)
+PROFILE_ARGS = os.getenv("STORYWORLD_PROFILE_ARGS", "0") in ("1", "true", "True")
 
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN", "").strip() or os.getenv("GH_TOKEN", "").strip()
 STORY_GITHUB_REPO = os.getenv("STORY_GITHUB_REPO", "").strip()
 STORY_REPOS_DIR = Path(os.getenv("STORY_REPOS_DIR", str(STORIES_DIR / "repos")))
+# Story pushes: allowed `owner/repo` prefixes (comma-separated, empty = any GitHub repo);
+# URLs and local paths as remotes only with STORY_GIT_ALLOW_LOCAL=1
+STORY_GIT_REMOTE_PREFIX = [p.strip() for p in os.getenv("STORY_GIT_REMOTE_PREFIX", "").split(",") if p.strip()]
+STORY_GIT_ALLOW_LOCAL = os.getenv("STORY_GIT_ALLOW_LOCAL", "0") in ("1", "true", "True")
+# Route story media through Git LFS (needs git-lfs installed and an LFS-capable remote)
+STORY_GIT_LFS = os.getenv("STORY_GIT_LFS", "0") in ("1", "true", "True")
+# Blobs above this size are stored without delta compression (git core.bigFileThreshold)
+STORY_GIT_BIG_FILE_THRESHOLD = os.getenv("STORY_GIT_BIG_FILE_THRESHOLD", "16m").strip()
+# Gallery items per generated story page (newest on index.html, older blocks on index-1.html, ...)
+STORY_PAGE_SIZE = int(os.getenv("STORY_PAGE_SIZE", "60"))
+# Downscaled srcset widths for story gallery images (needs Pillow; posters need ffmpeg)
+STORY_VARIANT_WIDTHS = [int(w) for w in os.getenv("STORY_VARIANT_WIDTHS", "320,640,1280").split(",") if w.strip().isdigit()]
+STORY_MEDIA_WORKERS = int(os.getenv("STORY_MEDIA_WORKERS", str(min(8, os.cpu_count() or 1))))
+
+# Daemon mode: `storyworld-mcp` (stdio) forwards to one long-lived server over a Unix socket
+DAEMON_MODE = os.getenv("STORYWORLD_DAEMON", "0") in ("1", "true", "True")
+DAEMON_SOCKET = os.getenv("STORYWORLD_DAEMON_SOCKET", "").strip()
+# Seconds without connected clients before the daemon exits (0 = never)
+DAEMON_IDLE_TIMEOUT = float(os.getenv("STORYWORLD_DAEMON_IDLE_TIMEOUT", "1800"))
+DAEMON_START_TIMEOUT = float(os.getenv("STORYWORLD_DAEMON_START_TIMEOUT", "30"))
+
+# Multi-worker HTTP: worker processes (each stateless) and the shared SQLite cache they use
+HTTP_WORKERS = int(os.getenv("HTTP_WORKERS", "1"))
+# auto: only with HTTP_WORKERS > 1 (a single process keeps its caches in memory)
+SHARED_CACHE_MODE = os.getenv("SHARED_CACHE", "auto").strip().lower()
+SHARED_CACHE = SHARED_CACHE_MODE in ("1", "true") or (SHARED_CACHE_MODE == "auto" and HTTP_WORKERS > 1)
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", "").strip()
+# Compiled character store: parsed YAML profiles in one SQLite file, synced incrementally
+CHARACTER_STORE = os.getenv("CHARACTER_STORE", "0") in ("1", "true", "True")
+CHARACTER_STORE_PATH = os.getenv("CHARACTER_STORE_PATH", "").strip()
+
+# Image encoding pool: 0 workers encodes inline; files under IMAGE_POOL_MIN_BYTES never use the pool
+IMAGE_POOL_WORKERS = int(os.getenv("IMAGE_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+IMAGE_POOL_MAX_PENDING = int(os.getenv("IMAGE_POOL_MAX_PENDING", str(max(1, IMAGE_POOL_WORKERS) * 4)))
+IMAGE_POOL_QUEUE_TIMEOUT = float(os.getenv("IMAGE_POOL_QUEUE_TIMEOUT", "10"))
+IMAGE_POOL_MIN_BYTES = int(os.getenv("IMAGE_POOL_MIN_BYTES", str(256 * 1024)))
+# Byte budget of the in-memory cache of base64-encoded images (per process)
+IMAGE_CACHE_MB = int(os.getenv("IMAGE_CACHE_MB", "64"))
+
+# Admission control for expensive tools: auto (on for http/sse), 1 or 0; limits as JSON per class
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "auto").strip().lower()
+ADMISSION_LIMITS = os.getenv("ADMISSION_LIMITS", "").strip()
+# Admin tools (profiler control, saved profiles, metrics reset): auto (stdio/daemon only), 1 or 0
+ADMIN_TOOLS = os.getenv("STORYWORLD_ADMIN_TOOLS", "auto").strip().lower()
+# Reverse proxies (IPs or CIDRs) whose X-Forwarded-For is trusted when identifying clients
+TRUSTED_PROXIES = [p.strip() for p in os.getenv("TRUSTED_PROXIES", "").split(",") if p.strip()]
+
+# Comfy output watcher: poll interval, seconds a new file's size must hold still before
+# it is ingested, and an optional character/story to start watching for at startup
+COMFY_WATCH_INTERVAL = float(os.getenv("COMFY_WATCH_INTERVAL", "0.5"))
+COMFY_WATCH_STABLE_S = float(os.getenv("COMFY_WATCH_STABLE_S", "1.0"))
+# Ingest attempts per file (with backoff) before the watcher gives up on it
+COMFY_WATCH_MAX_FAILURES = int(os.getenv("COMFY_WATCH_MAX_FAILURES", "3"))
+COMFY_WATCH_CODE = os.getenv("COMFY_WATCH_CODE", "").strip()
+COMFY_WATCH_STORY = os.getenv("COMFY_WATCH_STORY", "").strip()
+COMFY_WATCH_MODE = os.getenv("COMFY_WATCH_MODE", "copy").strip().lower()
+
+# Near-duplicate detection on ingest (needs numpy + Pillow): off, flag or skip images whose
+# perceptual hash is within DEDUPE_MAX_DISTANCE bits (of 64) of one already in the character folder
+DEDUPE_MODE = os.getenv("DEDUPE_MODE", "off").strip().lower()
+DEDUPE_MAX_DISTANCE = int(os.getenv("DEDUPE_MAX_DISTANCE", "6"))
+
+# Semantic character index (needs numpy): embedder (hashing[:dim], sentence-transformers:<model>
+# or module:callable) and where its memory-mapped vectors live (default WORKSPACE_DIR/.cache/semantic)
+SEMANTIC_MODEL = os.getenv("SEMANTIC_MODEL", "hashing").strip()
+SEMANTIC_INDEX_DIR = os.getenv("SEMANTIC_INDEX_DIR", "").strip()
+
+# Media metadata (dimensions, duration) is read from headers; also hash file contents (sha256)
+MEDIA_META_HASH = os.getenv("MEDIA_META_HASH", "1") in ("1", "true", "True")
+
+# Snapshot archive (python -m mcp_server.snapshot export) restored at startup when no character YAMLs exist
+WORKSPACE_SNAPSHOT = os.getenv("WORKSPACE_SNAPSHOT", "").strip()
 
 # Behavior
 DISABLE_AUTO_DOWNLOAD = os.getenv("DISABLE_AUTO_DOWNLOAD", "1") in ("1", "true", "True")
 STARTUP_PREFETCH = os.getenv("STARTUP_PREFETCH", "0") in ("1", "true", "True")
 
-# Ensure directories exist
-WORKSPACE_DIR.mkdir(parents=True, exist_ok=True)
-CHARACTERS_DIR.mkdir(parents=True, exist_ok=True)
-CHARACTERS_DESC_DIR.mkdir(parents=True, exist_ok=True)
-CHARACTERS_IMAGE_DIR.mkdir(parents=True, exist_ok=True)
-IMAGES_DIR.mkdir(parents=True, exist_ok=True)
-STORIES_DIR.mkdir(parents=True, exist_ok=True)
-STORY_REPOS_DIR.mkdir(parents=True, exist_ok=True)
+
+
+def ensure_dirs() -> None:
+    """Create the workspace folders. Called at server startup rather than import."""
+    for d in (WORKSPACE_DIR, CHARACTERS_DIR, CHARACTERS_DESC_DIR, CHARACTERS_IMAGE_DIR, IMAGES_DIR, STORIES_DIR, STORY_REPOS_DIR):
+        d.mkdir(parents=True, exist_ok=True)
 
 
 def comfy_stdio_env_map() -> dict[str, str]:
@@ -0,0 +1,206 @@
+"""Token-budgeted character contexts.
+
+`get_character_context(code, max_tokens=..., fields=[...])` returns a bounded
+profile instead of every YAML key. Sizes are estimated, not tokenized: one
+token per `CHARS_PER_TOKEN` characters of the field's compact JSON, which is
+close enough for budgeting English prose and avoids a tokenizer dependency.
+
+Assembly keeps the profile's key order:
+
+1. `fields` (if given) selects and orders the keys;
+2. whole fields are admitted smallest first, so short facts (name, age, code)
+   survive tight budgets;
+3. the fields that did not fit are trimmed, in profile order, into what is
+   left: strings are cut at a sentence or word boundary and marked with `…`,
+   lists and mappings keep their leading items. Fields left with no room are
+   omitted.
+
+The budget report travels inside the profile (`_context_budget`), so its size
+is reserved up front. The whole result, report included, stays within
+`max_tokens`. Per-field estimates are only added to the report when it then
+takes at most a quarter of the budget. A budget smaller than the bare report cannot be met, and the
+report is still returned.
+
+Per-field estimates and assembled variants are cached per profile version
+(the caller passes a version key, e.g. the YAML file's `mtime_ns:size`), so
+repeated calls at the same budget cost a dict lookup.
+"""
+from collections import OrderedDict
+import json
+import math
+import threading
+
+from . import metrics
+
+CHARS_PER_TOKEN = 4
+# Images are billed by area (about width*height/750 tokens) and downscaled past ~1.15 MP.
+IMAGE_TOKENS_MAX = 1600
+_MIN_TRIM_TOKENS = 8
+_ELLIPSIS = "…"
+_CACHE_MAX = 4096
+REPORT_KEY = "_context_budget"
+_estimates: OrderedDict[tuple, dict] = OrderedDict()
+_variants: OrderedDict[tuple, tuple[dict, dict]] = OrderedDict()
+_lock = threading.Lock()
+
+
+def estimate_tokens(value) -> int:
+    return math.ceil(len(json.dumps(value, ensure_ascii=False, separators=(",", ":"))) / CHARS_PER_TOKEN)
+
+
+def field_tokens(key: str, value) -> int:
+    """Estimated cost of `"key": value` inside the profile object."""
+    return estimate_tokens({key: value})
+
+
+def image_tokens(width: int | None, height: int | None) -> int:
+    if not width or not height:
+        return IMAGE_TOKENS_MAX
+    return min(IMAGE_TOKENS_MAX, math.ceil(width * height / 750))
+
+
+def _trim_text(text: str, tokens: int) -> str:
+    limit = max(0, tokens * CHARS_PER_TOKEN - 2 - len(_ELLIPSIS))
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    sentence = max(cut.rfind(". "), cut.rfind(".\n"), cut.rfind("! "), cut.rfind("? "))
+    if sentence >= limit // 2:
+        return cut[: sentence + 1] + " " + _ELLIPSIS
+    space = cut.rfind(" ")
+    if space >= limit // 2:
+        cut = cut[:space]
+    return cut.rstrip(" ,;:") + _ELLIPSIS
+
+
+def _trim(value, tokens: int):
+    """Largest prefix of `value` estimated at no more than `tokens`; None if nothing fits."""
+    if estimate_tokens(value) <= tokens:
+        return value
+    if isinstance(value, str):
+        trimmed = _trim_text(value, tokens)
+        return trimmed if trimmed.strip(_ELLIPSIS + " ") else None
+    if isinstance(value, list):
+        out = []
+        for item in value:
+            room = tokens - estimate_tokens(out + [None])
+            part = _trim(item, room) if room > 0 else None
+            if part is None:
+                break
+            out.append(part)
+            if part is not item:
+                break
+        return out or None
+    if isinstance(value, dict):
+        out = {}
+        for key, item in value.items():
+            room = tokens - estimate_tokens({**out, key: None})
+            part = _trim(item, room) if room > 0 else None
+            if part is None:
+                break
+            out[key] = part
+            if part is not item:
+                break
+        return out or None
+    return None
+
+
+def _remember(cache: OrderedDict, key: tuple, value):
+    with _lock:
+        cache[key] = value
+        if len(cache) > _CACHE_MAX:
+            cache.popitem(last=False)
+
+
+def field_estimates(content: dict, version_key: tuple | None = None) -> dict[str, int]:
+    """Estimated tokens per top-level field, cached per `version_key`."""
+    if version_key is not None:
+        with _lock:
+            hit = _estimates.get(version_key)
+        if hit is not None:
+            return hit
+    estimates = {k: field_tokens(k, v) for k, v in content.items()}
+    if version_key is not None:
+        _remember(_estimates, version_key, estimates)
+    return estimates
+
+
+def _fit(content: dict, keys: list[str], estimates: dict[str, int], budget: int) -> tuple[dict, list[str], list[str]]:
+    chosen: dict[str, object] = {}
+    truncated: list[str] = []
+    omitted: list[str] = []
+    left = budget - 1  # braces
+    for k in sorted(keys, key=lambda k: estimates[k]):
+        if estimates[k] <= left:
+            chosen[k] = content[k]
+            left -= estimates[k]
+    for k in keys:
+        if k in chosen:
+            continue
+        room = left - field_tokens(k, "")
+        part = _trim(content[k], room) if room >= _MIN_TRIM_TOKENS else None
+        if part is None:
+            omitted.append(k)
+            continue
+        chosen[k] = part
+        truncated.append(k)
+        left -= field_tokens(k, part)
+    return {k: chosen[k] for k in keys if k in chosen}, truncated, omitted
+
+
+def _report(max_tokens: int, estimated: int, truncated: list[str], omitted: list[str], missing: list[str],
+            details: dict | None = None) -> dict:
+    report = {"max_tokens": max_tokens or None, "estimated_tokens": estimated, **(details or {}),
+              "truncated": truncated, "omitted": omitted}
+    if missing:
+        report["missing"] = missing
+    return report
+
+
+def assemble(content: dict, max_tokens: int = 0, fields: list[str] | None = None,
+             version_key: tuple | None = None, reserve: int = 0) -> tuple[dict, dict]:
+    """Return `(profile, budget_report)` for the selected fields within `max_tokens` (0 = no limit).
+
+    The profile plus the report under `REPORT_KEY` fit in `max_tokens`, leaving
+    `reserve` tokens for entries the caller adds to the report afterwards.
+    """
+    cache_key = None
+    if version_key is not None:
+        cache_key = (*version_key, max_tokens, tuple(fields) if fields is not None else None, reserve)
+        with _lock:
+            hit = _variants.get(cache_key)
+        if hit is not None:
+            metrics.incr("cache_hit:context_budget")
+            return dict(hit[0]), dict(hit[1])
+        metrics.incr("cache_miss:context_budget")
+
+    estimates = field_estimates(content, version_key)
+    if fields is not None:
+        keys = [k for k in dict.fromkeys(fields) if k in content]
+        missing = [k for k in fields if k not in content]
+    else:
+        keys = list(content)
+        missing = []
+    details = {"full_tokens": estimate_tokens(content), "field_tokens": {k: estimates[k] for k in keys}}
+    if max_tokens <= 0:
+        chosen = {k: content[k] for k in keys}
+        report = _report(max_tokens, estimate_tokens(chosen), [], [], missing, details)
+    else:
+        if field_tokens(REPORT_KEY, _report(max_tokens, max_tokens, keys, [], missing, details)) > max_tokens // 4:
+            details = None
+        # Reserve the report: its lists grow as fields are cut, so re-fit until it fits,
+        # then fall back to the bound where every field is named once.
+        need = field_tokens(REPORT_KEY, _report(max_tokens, max_tokens, [], [], missing, details))
+        for attempt in range(4):
+            if attempt == 3:
+                need = field_tokens(REPORT_KEY, _report(max_tokens, max_tokens, keys, [], missing, details))
+            chosen, truncated, omitted = _fit(content, keys, estimates, max_tokens - reserve - need)
+            report = _report(max_tokens, max_tokens, truncated, omitted, missing, details)
+            used = field_tokens(REPORT_KEY, report)
+            if used <= need:
+                break
+            need = used
+        report["estimated_tokens"] = estimate_tokens(chosen) + reserve + used
+    if cache_key is not None:
+        _remember(_variants, cache_key, (chosen, report))
+    return dict(chosen), dict(report)
@@ -0,0 +1,148 @@
+"""Long-lived storyworld server shared by many stdio clients over a Unix socket.
+
+One daemon owns the caches, indexes and the comfy proxy; every accepted
+connection gets its own MCP session, framed exactly like stdio
+(newline-delimited JSON-RPC). Started on demand by `mcp_server.shim`, or by
+hand:
+
+    python -m mcp_server.daemon --socket /tmp/storyworld.sock
+
+The daemon exits after `STORYWORLD_DAEMON_IDLE_TIMEOUT` seconds without
+connected clients and removes its socket.
+"""
+from pathlib import Path
+import logging
+import os
+import sys
+import time
+
+import anyio
+from mcp import types
+from mcp.server.lowlevel.server import NotificationOptions
+from mcp.shared.message import SessionMessage
+
+from . import admission, config, mcp_app, shim
+
+LOG = logging.getLogger(__name__)
+
+
+class _Clients:
+    def __init__(self):
+        self.active = 0
+        self.total = 0
+        self.idle_since = time.monotonic()
+
+
+async def _serve_connection(stream, clients: _Clients) -> None:
+    server = mcp_app.mcp._mcp_server
+    read_w, read_r = anyio.create_memory_object_stream(0)
+    write_w, write_r = anyio.create_memory_object_stream(0)
+
+    async def reader():
+        buf = bytearray()
+        async with read_w:
+            try:
+                while True:
+                    buf += await stream.receive()
+                    while (nl := buf.find(b"\n")) >= 0:
+                        line = bytes(buf[:nl])
+                        del buf[: nl + 1]
+                        if not line.strip():
+                            continue
+                        try:
+                            message = types.JSONRPCMessage.model_validate_json(line)
+                        except Exception as exc:
+                            await read_w.send(exc)
+                            continue
+                        await read_w.send(SessionMessage(message))
+            except (anyio.EndOfStream, anyio.BrokenResourceError, anyio.ClosedResourceError):
+                pass
+
+    async def writer():
+        async with write_r:
+            async for session_message in write_r:
+                data = session_message.message.model_dump_json(by_alias=True, exclude_none=True)
+                try:
+                    await stream.send(data.encode("utf-8") + b"\n")
+                except (anyio.BrokenResourceError, anyio.ClosedResourceError):
+                    return
+
+    clients.active += 1
+    clients.total += 1
+    try:
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(reader)
+            tg.start_soon(writer)
+            try:
+                await server.run(
+                    read_r,
+                    write_w,
+                    server.create_initialization_options(notification_options=NotificationOptions(tools_changed=True)),
+                )
+            finally:
+                write_w.close()
+                tg.cancel_scope.cancel()
+    except Exception as ex:
+        LOG.warning("Client session ended with error: %s", ex)
+    finally:
+        await stream.aclose()
+        clients.active -= 1
+        if clients.active == 0:
+            clients.idle_since = time.monotonic()
+
+
+async def serve(path: Path, idle_timeout: float, fingerprint: str = "") -> None:
+    from fastmcp.server.context import reset_transport, set_transport
+
+    clients = _Clients()
+    token = set_transport("stdio")
+    try:
+        async with mcp_app.mcp._lifespan_manager():
+            path.unlink(missing_ok=True)
+            # Written before listening, so a shim never sees a socket without it.
+            path.with_suffix(".env").write_text(fingerprint, encoding="utf-8")
+            listener = await anyio.create_unix_listener(path)
+            os.chmod(path, 0o600)
+            path.with_suffix(".pid").write_text(str(os.getpid()), encoding="utf-8")
+            LOG.info("storyworld daemon listening on %s", path)
+
+            async def _handle(stream):
+                await _serve_connection(stream, clients)
+
+            async with anyio.create_task_group() as tg:
+                tg.start_soon(listener.serve, _handle)
+                while idle_timeout <= 0 or clients.active or time.monotonic() - clients.idle_since < idle_timeout:
+                    await anyio.sleep(min(1.0, idle_timeout) if idle_timeout > 0 else 60)
+                LOG.info("No clients for %.0fs; shutting down (%d sessions served)", idle_timeout, clients.total)
+                tg.cancel_scope.cancel()
+            await listener.aclose()
+    finally:
+        reset_transport(token)
+        path.unlink(missing_ok=True)
+        path.with_suffix(".pid").unlink(missing_ok=True)
+        path.with_suffix(".env").unlink(missing_ok=True)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = mcp_app._build_arg_parser()
+    parser.prog = "storyworld-mcp-daemon"
+    parser.add_argument("--socket", default=None, help="Unix socket path (default: derived from WORKSPACE_DIR)")
+    parser.add_argument("--idle-timeout", type=float, default=config.DAEMON_IDLE_TIMEOUT,
+                        help="Exit after this many seconds without clients (0 = never)")
+    args = list(sys.argv[1:] if argv is None else argv)
+    fingerprint = shim.env_fingerprint()
+    ns = parser.parse_args(args)
+    mcp_app._apply_cli_overrides(ns)
+    if not ns.socket:
+        ns.socket = str(shim.socket_path(args))
+
+    logging.basicConfig(level=config.FASTMCP_LOG_LEVEL, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    mcp_app._runtime_transport = "daemon"
+    admission.configure_for_transport("daemon")
+    mcp_app._register_tools_dir()
+    mcp_app._configure_comfy_proxy("stdio")
+    anyio.run(serve, Path(ns.socket), ns.idle_timeout, fingerprint)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,35 +4,39 @@ Default sources mirror the user's provided repos; both are overrideable.
 This module exposes the same `fetch_all` function used by the HTTP routes and the FastMCP tools.
 """
 from pathlib import Path
-import requests
 import shutil
 import os
 import logging
-import yaml
-from huggingface_hub import snapshot_download
-from . import config
+from . import config, transfers
 
 LOG = logging.getLogger(__name__)
 
 
 def _github_list_and_download(repo: str, path: str, dest: Path):
     """List files in `path` from GitHub repo and download YAMLs into dest."""
+    import requests
+
     owner, name = repo.split("/")
-    api_url = f"https://api.github.com/repos/{owner}/{name}/contents/{path}"
+    api_url = f"{config.GITHUB_API_URL}/repos/{owner}/{name}/contents/{path}"
     resp = requests.get(api_url, timeout=30)
     resp.raise_for_status()
     items = resp.json()
     for it in items:
         if it.get("type") == "file" and it.get("name", "").endswith(".yaml"):
-            raw = requests.get(it["download_url"], timeout=30)
-            raw.raise_for_status()
             dest_path = dest / it["name"]
-            dest_path.write_bytes(raw.content)
+            transfers.download(
+                it["download_url"],
+                dest_path,
+                checksum=("git-sha1", it["sha"]) if it.get("sha") else None,
+                size=it.get("size"),
+            )
             LOG.info("Downloaded %s -> %s", it["name"], dest_path)
 
 
 def _hf_download_images(dataset_id: str, dest: Path, subfolder: str | None = None):
     """Use huggingface_hub to snapshot the dataset and copy images to dest."""
+    from huggingface_hub import snapshot_download
+
     cache_dir = Path(".cache") / "hf-datasets"
     snapshot_dir = snapshot_download(repo_type='dataset', repo_id=dataset_id, cache_dir=str(cache_dir))
     src = Path(snapshot_dir)
@@ -82,6 +86,8 @@ def fetch_all(github_repo: str | None = None, github_path: str | None = None, hf
 
 def list_local_character_codes():
     """Return sorted list of character codes found in the local characters dir."""
+    import yaml
+
     codes = []
     for f in config.CHARACTERS_DIR.glob("*.yaml"):
         try:
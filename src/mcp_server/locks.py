@@ -0,0 +1,90 @@
+"""Locks shared by threads and by worker processes.
+
+Multi-worker HTTP serving runs several server processes over one workspace,
+so per-process `threading.Lock`s no longer protect story writes or on-demand
+downloads. `file_lock(path)` returns a re-entrant lock that holds a thread
+lock and an exclusive `flock` on `path` while entered (`msvcrt.locking` on
+Windows).
+"""
+from pathlib import Path
+import re
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+_registry: dict[str, "FileLock"] = {}
+_guard = threading.Lock()
+_UNSAFE_RE = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+class FileLock:
+    def __init__(self, path: Path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fh = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                fh = open(self.path, "a+b")
+                _lock_file(fh)
+            except BaseException:
+                self._thread_lock.release()
+                raise
+            self._fh = fh
+        self._depth += 1
+        return self
+
+    def __exit__(self, *_exc):
+        self._depth -= 1
+        if self._depth == 0 and self._fh is not None:
+            try:
+                _unlock_file(self._fh)
+            finally:
+                self._fh.close()
+                self._fh = None
+        self._thread_lock.release()
+        return False
+
+
+def _lock_file(fh) -> None:
+    if fcntl is not None:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        return
+    fh.seek(0)
+    while True:
+        try:
+            # LK_LOCK retries for ~10 s before raising; keep waiting like flock does.
+            msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            continue
+
+
+def _unlock_file(fh) -> None:
+    if fcntl is not None:
+        fcntl.flock(fh, fcntl.LOCK_UN)
+        return
+    fh.seek(0)
+    msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def lock_name(name: str) -> str:
+    """Make `name` safe to use as a lock file name."""
+    return _UNSAFE_RE.sub("_", name) or "_"
+
+
+def file_lock(path: Path) -> FileLock:
+    key = str(path)
+    with _guard:
+        lock = _registry.get(key)
+        if lock is None:
+            lock = _registry[key] = FileLock(path)
+        return lock
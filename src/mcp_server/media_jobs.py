@@ -0,0 +1,10 @@
+"""Jobs executed inside the image process pool (see `media_pool`).
+
+Kept free of fastmcp/config imports so pool workers start quickly.
+"""
+import base64
+
+
+def b64_file(path: str) -> str:
+    with open(path, "rb") as fh:
+        return base64.b64encode(fh.read()).decode("ascii")
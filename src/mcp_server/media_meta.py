@@ -0,0 +1,348 @@
+"""Media metadata from container headers: dimensions, duration and content hash.
+
+Nothing is decoded. Each parser reads only the headers it needs:
+
+- PNG `IHDR`, BMP info header and WebP `VP8 `/`VP8L`/`VP8X` chunks give sizes;
+- JPEG: the first start-of-frame marker;
+- GIF: the logical screen size, plus the frame delays added up by walking
+  block headers, for animated files;
+- MP4/MOV: `moov/mvhd` gives the duration and the first visual `trak/tkhd`
+  gives the size. `mdat` is skipped by seeking, so `moov` may sit at the end;
+- WebM/Matroska: EBML `Info` (TimecodeScale, Duration) and the first
+  `Tracks/TrackEntry/Video` (PixelWidth, PixelHeight).
+
+`describe(path)` adds a sha256 of the content (`MEDIA_META_HASH=0` skips it)
+and caches the result per file version (`path`, `mtime_ns`, `size`). The cache
+is an in-process LRU backed by the shared SQLite cache, so manifests pay for
+extraction once per file, not once per request.
+"""
+from collections import OrderedDict
+from pathlib import Path
+import hashlib
+import logging
+import os
+import struct
+import threading
+
+from . import config, metrics, shared_cache
+
+LOG = logging.getLogger(__name__)
+_MEMO_MAX = 20_000
+_memo: OrderedDict[tuple, dict] = OrderedDict()
+_memo_lock = threading.Lock()
+
+
+# -- images -----------------------------------------------------------------
+
+def _png(fh, head: bytes) -> dict:
+    if head[12:16] != b"IHDR":
+        return {}
+    width, height = struct.unpack(">II", head[16:24])
+    return {"width": width, "height": height}
+
+
+def _bmp(fh, head: bytes) -> dict:
+    if struct.unpack("<I", head[14:18])[0] == 12:  # OS/2 BITMAPCOREHEADER
+        width, height = struct.unpack("<HH", head[18:22])
+    else:
+        width, height = struct.unpack("<ii", head[18:26])
+    return {"width": width, "height": abs(height)}
+
+
+def _webp(fh, head: bytes) -> dict:
+    chunk = head[12:16]
+    if chunk == b"VP8X":
+        width = int.from_bytes(head[24:27], "little") + 1
+        height = int.from_bytes(head[27:30], "little") + 1
+        return {"width": width, "height": height}
+    if chunk == b"VP8 " and head[23:26] == b"\x9d\x01\x2a":
+        width, height = struct.unpack("<HH", head[26:30])
+        return {"width": width & 0x3FFF, "height": height & 0x3FFF}
+    if chunk == b"VP8L" and head[20] == 0x2F:
+        bits = int.from_bytes(head[21:25], "little")
+        return {"width": (bits & 0x3FFF) + 1, "height": ((bits >> 14) & 0x3FFF) + 1}
+    return {}
+
+
+def _jpeg(fh, head: bytes) -> dict:
+    fh.seek(2)
+    while True:
+        marker = fh.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return {}
+        code = marker[1]
+        if code == 0xFF:  # fill byte
+            fh.seek(-1, os.SEEK_CUR)
+            continue
+        if code in (0xD8, 0x01) or 0xD0 <= code <= 0xD7:
+            continue
+        length = struct.unpack(">H", fh.read(2))[0]
+        if 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC):
+            _precision, height, width = struct.unpack(">BHH", fh.read(5))
+            return {"width": width, "height": height}
+        fh.seek(length - 2, os.SEEK_CUR)
+
+
+def _skip_gif_sub_blocks(fh) -> None:
+    while True:
+        size = fh.read(1)
+        if not size or size[0] == 0:
+            return
+        fh.seek(size[0], os.SEEK_CUR)
+
+
+def _gif(fh, head: bytes) -> dict:
+    width, height, flags = struct.unpack("<HHB", head[6:11])
+    info = {"width": width, "height": height}
+    fh.seek(13 + (3 * 2 ** ((flags & 7) + 1) if flags & 0x80 else 0))
+    frames = 0
+    delay_cs = 0
+    while True:
+        block = fh.read(1)
+        if not block or block == b"\x3b":
+            break
+        if block == b"\x21":  # extension
+            label = fh.read(1)
+            if label == b"\xf9":  # graphic control: delay in 1/100 s
+                data = fh.read(6)
+                if len(data) == 6:
+                    delay_cs += struct.unpack("<H", data[2:4])[0]
+                    continue
+            _skip_gif_sub_blocks(fh)
+        elif block == b"\x2c":  # image descriptor
+            desc = fh.read(9)
+            if len(desc) < 9:
+                break
+            frames += 1
+            if desc[8] & 0x80:
+                fh.seek(3 * 2 ** ((desc[8] & 7) + 1), os.SEEK_CUR)
+            fh.seek(1, os.SEEK_CUR)  # LZW minimum code size
+            _skip_gif_sub_blocks(fh)
+        else:
+            break
+    if frames > 1:
+        info["frames"] = frames
+        info["duration_s"] = round(delay_cs / 100, 3)
+    return info
+
+
+# -- video containers -------------------------------------------------------
+
+def _mp4_boxes(fh, start: int, end: int):
+    pos = start
+    while pos + 8 <= end:
+        fh.seek(pos)
+        header = fh.read(8)
+        if len(header) < 8:
+            return
+        size, kind = struct.unpack(">I4s", header)
+        offset = 8
+        if size == 1:
+            size = struct.unpack(">Q", fh.read(8))[0]
+            offset = 16
+        elif size == 0:
+            size = end - pos
+        if size < offset:
+            return
+        yield kind, pos + offset, pos + size
+        pos += size
+
+
+def _mp4(fh, head: bytes) -> dict:
+    end = fh.seek(0, os.SEEK_END)
+    info: dict = {}
+    for kind, body, box_end in _mp4_boxes(fh, 0, end):
+        if kind != b"moov":
+            continue
+        for sub, sub_body, sub_end in _mp4_boxes(fh, body, box_end):
+            if sub == b"mvhd":
+                fh.seek(sub_body)
+                version = fh.read(4)[0]
+                if version == 1:
+                    timescale, duration = struct.unpack(">16xIQ", fh.read(28))
+                else:
+                    timescale, duration = struct.unpack(">8xII", fh.read(16))
+                if timescale:
+                    info["duration_s"] = round(duration / timescale, 3)
+            elif sub == b"trak" and "width" not in info:
+                for leaf, leaf_body, leaf_end in _mp4_boxes(fh, sub_body, sub_end):
+                    if leaf != b"tkhd":
+                        continue
+                    fh.seek(leaf_end - 8)
+                    width, height = struct.unpack(">II", fh.read(8))
+                    if width and height:
+                        info["width"], info["height"] = width >> 16, height >> 16
+        break
+    return info
+
+
+_EBML_SEGMENT, _EBML_INFO, _EBML_TRACKS, _EBML_CLUSTER = 0x18538067, 0x1549A966, 0x1654AE6B, 0x1F43B675
+_EBML_TRACK_ENTRY, _EBML_VIDEO = 0xAE, 0xE0
+
+
+def _ebml_vint(fh, keep_marker: bool) -> tuple[int | None, int]:
+    first = fh.read(1)
+    if not first:
+        return None, 0
+    b = first[0]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not b & mask:
+        mask >>= 1
+        length += 1
+    if length > 8:
+        return None, 0
+    value = b if keep_marker else b & (mask - 1)
+    rest = fh.read(length - 1)
+    for byte in rest:
+        value = (value << 8) | byte
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        value = -1  # unknown size
+    return value, length
+
+
+def _ebml_elements(fh, start: int, end: int):
+    pos = start
+    while pos < end:
+        fh.seek(pos)
+        element_id, id_len = _ebml_vint(fh, keep_marker=True)
+        size, size_len = _ebml_vint(fh, keep_marker=False)
+        if element_id is None or size is None:
+            return
+        body = pos + id_len + size_len
+        stop = end if size < 0 else min(end, body + size)
+        yield element_id, body, stop
+        if size < 0 and element_id != _EBML_SEGMENT:
+            return
+        pos = stop
+
+
+def _ebml_read(fh, body: int, stop: int) -> bytes:
+    fh.seek(body)
+    return fh.read(stop - body)
+
+
+def _webm(fh, head: bytes) -> dict:
+    end = fh.seek(0, os.SEEK_END)
+    info: dict = {}
+    timescale = 1_000_000
+    duration = None
+    for element_id, body, stop in _ebml_elements(fh, 0, end):
+        if element_id != _EBML_SEGMENT:
+            continue
+        for child, cbody, cstop in _ebml_elements(fh, body, stop):
+            if child == _EBML_INFO:
+                for leaf, lbody, lstop in _ebml_elements(fh, cbody, cstop):
+                    raw = _ebml_read(fh, lbody, lstop)
+                    if leaf == 0x2AD7B1:
+                        timescale = int.from_bytes(raw, "big")
+                    elif leaf == 0x4489 and len(raw) in (4, 8):
+                        duration = struct.unpack(">f" if len(raw) == 4 else ">d", raw)[0]
+            elif child == _EBML_TRACKS:
+                for entry, ebody, estop in _ebml_elements(fh, cbody, cstop):
+                    if entry != _EBML_TRACK_ENTRY or "width" in info:
+                        continue
+                    for field, fbody, fstop in _ebml_elements(fh, ebody, estop):
+                        if field != _EBML_VIDEO:
+                            continue
+                        for leaf, lbody, lstop in _ebml_elements(fh, fbody, fstop):
+                            if leaf == 0xB0:
+                                info["width"] = int.from_bytes(_ebml_read(fh, lbody, lstop), "big")
+                            elif leaf == 0xBA:
+                                info["height"] = int.from_bytes(_ebml_read(fh, lbody, lstop), "big")
+            elif child == _EBML_CLUSTER:
+                break
+        break
+    if duration is not None:
+        info["duration_s"] = round(duration * timescale / 1e9, 3)
+    return info
+
+
+def _parser_for(head: bytes):
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png", _png
+    if head[:3] == b"\xff\xd8\xff":
+        return "jpeg", _jpeg
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif", _gif
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp", _webp
+    if head[:2] == b"BM":
+        return "bmp", _bmp
+    if head[4:8] in (b"ftyp", b"moov", b"mdat", b"free", b"wide", b"skip"):
+        return "mp4", _mp4
+    if head[:4] == b"\x1a\x45\xdf\xa3":
+        return "webm", _webm
+    return None, None
+
+
+def probe(path: Path) -> dict:
+    """Header-only `{format, width, height, duration_s?, frames?}` for a media file."""
+    with open(path, "rb") as fh:
+        head = fh.read(64)
+        fmt, parser = _parser_for(head)
+        if parser is None:
+            return {}
+        try:
+            info = parser(fh, head.ljust(64, b"\0"))
+        except (struct.error, IndexError, ValueError, OSError) as ex:
+            LOG.debug("Could not parse %s header of %s: %s", fmt, path, ex)
+            info = {}
+    return {"format": fmt, **info}
+
+
+def content_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def describe(path: Path, st: os.stat_result | None = None) -> dict:
+    """Cached metadata for one file version: probe() fields plus `sha256`."""
+    st = st or os.stat(path)
+    key = (str(path), st.st_mtime_ns, st.st_size)
+    with _memo_lock:
+        hit = _memo.get(key)
+        if hit is not None:
+            _memo.move_to_end(key)
+    if hit is not None:
+        metrics.incr("cache_hit:media_meta")
+        return hit
+    version = shared_cache.file_version(st)
+    cache_key = str(Path(path).resolve())
+    data = None
+    if config.SHARED_CACHE:
+        try:
+            data = shared_cache.get_cache().get("media_meta", cache_key, version)
+        except Exception as ex:
+            LOG.warning("Shared cache read failed: %s", ex)
+    if isinstance(data, dict) and ("sha256" in data or not config.MEDIA_META_HASH):
+        metrics.incr("cache_hit:media_meta")
+    else:
+        metrics.incr("cache_miss:media_meta")
+        with metrics.stage("media_meta"):
+            data = probe(path)
+            if config.MEDIA_META_HASH:
+                data["sha256"] = content_hash(path)
+                metrics.incr("bytes_read", st.st_size)
+        if config.SHARED_CACHE:
+            try:
+                shared_cache.get_cache().put("media_meta", cache_key, version, data)
+            except Exception as ex:
+                LOG.warning("Shared cache write failed: %s", ex)
+    with _memo_lock:
+        _memo[key] = data
+        if len(_memo) > _MEMO_MAX:
+            _memo.popitem(last=False)
+    return data
+
+
+def fields(path: Path, st: os.stat_result | None = None) -> dict:
+    """Manifest fields (`width`, `height`, `duration_s`, `sha256`); {} if the file can't be read."""
+    try:
+        data = describe(path, st)
+    except OSError:
+        return {}
+    return {k: data[k] for k in ("width", "height", "duration_s", "sha256") if k in data}
@@ -0,0 +1,148 @@
+"""Process pool for CPU-heavy image work, with backpressure and a b64 cache.
+
+Base64-encoding (and any future resizing) of large images runs in a small
+process pool so it neither holds the GIL against cheap tools nor blocks the
+event loop. Submissions are bounded: at most `IMAGE_POOL_MAX_PENDING` jobs may
+be queued or running, and callers wait up to `IMAGE_POOL_QUEUE_TIMEOUT`
+seconds for a slot before `PoolBusyError` is raised. Small files skip the pool
+(the IPC costs more than the encoding).
+
+Encoded results are cached per file version (path, mtime_ns, size) in a
+byte-bounded LRU, so repeated requests for the same image are free.
+"""
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import atexit
+import mimetypes
+import multiprocessing
+import os
+import threading
+
+from . import config, media_jobs, metrics
+
+mimetypes.add_type("image/webp", ".webp")
+
+
+class PoolBusyError(RuntimeError):
+    """Raised when the image pool stays saturated for the whole queue timeout."""
+
+
+class _B64Cache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple, str] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> str | None:
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def put(self, key: tuple, data: str) -> None:
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+
+class ImagePool:
+    def __init__(self, workers: int, max_pending: int, queue_timeout: float):
+        self.workers = workers
+        self.max_pending = max(1, max_pending)
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # forkserver: never fork the threaded server process itself.
+                ctx = multiprocessing.get_context("forkserver" if os.name == "posix" else "spawn")
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx)
+            return self._executor
+
+    def run(self, fn, *args):
+        """Run `fn(*args)` in the pool, blocking the calling (worker) thread."""
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self.rejected += 1
+            metrics.incr("image_pool_rejected")
+            raise PoolBusyError(f"image pool busy ({self.max_pending} jobs pending); retry shortly")
+        try:
+            return self._get_executor().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+_pool: ImagePool | None = None
+_pool_guard = threading.Lock()
+_cache = _B64Cache(config.IMAGE_CACHE_MB * 1024 * 1024)
+
+
+def get_pool() -> ImagePool | None:
+    global _pool
+    if config.IMAGE_POOL_WORKERS <= 0:
+        return None
+    with _pool_guard:
+        if _pool is None:
+            _pool = ImagePool(config.IMAGE_POOL_WORKERS, config.IMAGE_POOL_MAX_PENDING, config.IMAGE_POOL_QUEUE_TIMEOUT)
+        return _pool
+
+
+def encode_image(path: Path) -> tuple[str, str]:
+    """Return `(base64_data, mime_type)` for an image file."""
+    st = path.stat()
+    key = (str(path), st.st_mtime_ns, st.st_size)
+    mime = mimetypes.guess_type(path.name, strict=False)[0] or "application/octet-stream"
+    data = _cache.get(key)
+    if data is not None:
+        metrics.incr("cache_hit:image_b64")
+        return data, mime
+    metrics.incr("cache_miss:image_b64")
+    metrics.incr("bytes_read", st.st_size)
+    pool = get_pool()
+    with metrics.stage("image_encode"):
+        if pool is None or st.st_size < config.IMAGE_POOL_MIN_BYTES:
+            data = media_jobs.b64_file(str(path))
+        else:
+            data = pool.run(media_jobs.b64_file, str(path))
+    _cache.put(key, data)
+    return data, mime
+
+
+def stats() -> dict:
+    pool = _pool
+    return {
+        "workers": config.IMAGE_POOL_WORKERS,
+        "max_pending": pool.max_pending if pool else config.IMAGE_POOL_MAX_PENDING,
+        "rejected": pool.rejected if pool else 0,
+        "cache": _cache.stats(),
+    }
+
+
+@atexit.register
+def _shutdown_pool() -> None:
+    if _pool is not None:
+        _pool.shutdown()
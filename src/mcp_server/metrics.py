@@ -0,0 +1,178 @@
+"""In-process metrics: per-operation latency, per-stage timers and counters.
+
+`MetricsMiddleware` times every tool call and resource read. Inside handlers,
+hot paths are wrapped in `stage("name")` blocks and counted with
+`incr("name", ...)`; both are attributed to the operation currently running
+(tracked in a context variable, which FastMCP propagates into its worker
+threads). Snapshots are served by the `get_server_metrics` tool and, in HTTP
+mode, optionally as Prometheus text on `/metrics`.
+"""
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+import re
+import threading
+import time
+
+from fastmcp.server.middleware import Middleware
+
+# Upper bounds (seconds) for the Prometheus latency histogram.
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Recent samples kept per timer for percentile estimates.
+RESERVOIR_SIZE = 1024
+
+_current_op: ContextVar[str] = ContextVar("storyworld_metrics_op", default="none")
+_URI_ID_RE = re.compile(r"^([a-z][a-z0-9+.-]*://)[^/]+")
+
+
+class _Timer:
+    __slots__ = ("count", "total", "max", "buckets", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self.samples: deque[float] = deque(maxlen=RESERVOIR_SIZE)
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.samples.append(seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+    def summary(self) -> dict:
+        ordered = sorted(self.samples)
+
+        def pct(q: float) -> float:
+            if not ordered:
+                return 0.0
+            return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+        return {
+            "count": self.count,
+            "total_ms": round(self.total * 1000, 3),
+            "avg_ms": round(self.total * 1000 / self.count, 3) if self.count else 0.0,
+            "p50_ms": round(pct(0.50), 3),
+            "p99_ms": round(pct(0.99), 3),
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: dict[tuple[str, str], float] = {}
+        self._timers: dict[tuple[str, str], _Timer] = {}
+        self.started_at = time.time()
+
+    def incr(self, name: str, value: float = 1, op: str | None = None) -> None:
+        key = (name, op or _current_op.get())
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, op: str | None = None) -> None:
+        key = (name, op or _current_op.get())
+        with self._lock:
+            timer = self._timers.get(key)
+            if timer is None:
+                timer = self._timers[key] = _Timer()
+            timer.observe(seconds)
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(f"stage:{name}", time.perf_counter() - start)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._timers.clear()
+            self.started_at = time.time()
+
+    def snapshot(self) -> dict:
+        """Return `{operations, stages, counters}` grouped by operation."""
+        with self._lock:
+            counters = dict(self._counters)
+            timers = {k: t.summary() for k, t in self._timers.items()}
+        operations: dict[str, dict] = {}
+        stages: dict[str, dict] = {}
+        for (name, op), summary in timers.items():
+            if name == "request":
+                operations[op] = summary
+            elif name.startswith("stage:"):
+                stages.setdefault(op, {})[name[len("stage:"):]] = summary
+        grouped: dict[str, dict] = {}
+        for (name, op), value in counters.items():
+            grouped.setdefault(op, {})[name] = value
+        return {
+            "uptime_s": round(time.time() - self.started_at, 3),
+            "operations": dict(sorted(operations.items())),
+            "stages": dict(sorted(stages.items())),
+            "counters": dict(sorted(grouped.items())),
+        }
+
+    def prometheus_text(self, prefix: str = "storyworld") -> str:
+        with self._lock:
+            counters = sorted(self._counters.items())
+            timers = sorted((k, t.count, t.total, list(t.buckets)) for k, t in self._timers.items())
+        lines = [f"# TYPE {prefix}_events_total counter"]
+        for (name, op), value in counters:
+            lines.append(f'{prefix}_events_total{{event="{_esc(name)}",op="{_esc(op)}"}} {value:g}')
+        lines.append(f"# TYPE {prefix}_duration_seconds histogram")
+        for (name, op), count, total, buckets in timers:
+            labels = f'name="{_esc(name)}",op="{_esc(op)}"'
+            running = 0
+            for bound, n in zip(BUCKETS, buckets):
+                running += n
+                lines.append(f'{prefix}_duration_seconds_bucket{{{labels},le="{bound:g}"}} {running}')
+            lines.append(f'{prefix}_duration_seconds_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"{prefix}_duration_seconds_sum{{{labels}}} {total:.6f}")
+            lines.append(f"{prefix}_duration_seconds_count{{{labels}}} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _esc(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def resource_op(uri: str) -> str:
+    """Collapse per-character URIs (`character://6166r/profile`) to one label."""
+    return "resource:" + _URI_ID_RE.sub(r"\1{id}", uri)
+
+
+METRICS = Metrics()
+incr = METRICS.incr
+stage = METRICS.stage
+
+
+@contextmanager
+def operation(op: str):
+    """Attribute nested stages/counters to `op` and time the whole block."""
+    token = _current_op.set(op)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        METRICS.incr("errors", op=op)
+        raise
+    finally:
+        METRICS.observe("request", time.perf_counter() - start, op=op)
+        _current_op.reset(token)
+
+
+class MetricsMiddleware(Middleware):
+    async def on_call_tool(self, context, call_next):
+        with operation(f"tool:{context.message.name}"):
+            return await call_next(context)
+
+    async def on_read_resource(self, context, call_next):
+        with operation(resource_op(str(context.message.uri))):
+            return await call_next(context)
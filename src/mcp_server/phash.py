@@ -0,0 +1,220 @@
+"""Near-duplicate detection for ingested renders, using perceptual hashes.
+
+ComfyUI batches often contain renders that differ only in noise. Each image
+gets a 64-bit difference hash (dHash): it is shrunk to 9x8 grayscale, and each
+bit records whether a pixel is brighter than its left neighbour. Two images
+are near-duplicates when their hashes differ in at most `max_distance` bits.
+
+Each character has a `HashIndex`, a NumPy `uint64` array of the hashes of the
+images in its folder, stored in `WORKSPACE_DIR/.cache/phash/<code>.npz`. A
+lookup is one vectorized XOR plus popcount over the whole array, so it stays
+in the microseconds with tens of thousands of images. The index is kept in
+sync incrementally: only files whose `mtime_ns:size` changed are re-hashed,
+and the folder is only re-listed when its mtime moves. JPEG decoding uses
+Pillow's draft mode (DCT scaling), so large renders are never fully decoded.
+
+Needs numpy and Pillow; without them `available()` is False and ingest skips
+the stage.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import logging
+import os
+import threading
+
+from . import config, locks, metrics
+
+LOG = logging.getLogger(__name__)
+HASH_SIZE = 8
+IMAGE_EXTS = {".png", ".jpg", ".jpeg", ".webp", ".bmp", ".gif"}
+_indexes: dict[str, "HashIndex"] = {}
+_guard = threading.Lock()
+
+
+def available() -> bool:
+    try:
+        import numpy  # noqa: F401
+        from PIL import Image  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def dhash(path: Path) -> int | None:
+    """64-bit difference hash of an image, or None if it can't be decoded."""
+    import numpy as np
+    from PIL import Image
+
+    try:
+        with Image.open(path) as im:
+            im.draft("L", (HASH_SIZE * 8, HASH_SIZE * 8))
+            small = im.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR, reducing_gap=2.0)
+    except (OSError, ValueError, Image.DecompressionBombError) as ex:
+        LOG.debug("Could not hash %s: %s", path, ex)
+        return None
+    px = np.asarray(small, dtype=np.int16)
+    bits = px[:, 1:] > px[:, :-1]
+    return int(np.packbits(bits.ravel()).view(">u8")[0])
+
+
+def hash_files(paths: list[Path], workers: int | None = None) -> list[int | None]:
+    """Hash images in parallel (Pillow releases the GIL while decoding); non-images get None."""
+    todo = [p for p in paths if Path(p).suffix.lower() in IMAGE_EXTS]
+    if not todo:
+        return [None] * len(paths)
+    with metrics.stage("phash"):
+        if len(todo) == 1:
+            hashed = {todo[0]: dhash(todo[0])}
+        else:
+            with ThreadPoolExecutor(max_workers=workers or min(8, os.cpu_count() or 1)) as pool:
+                hashed = dict(zip(todo, pool.map(dhash, todo)))
+    metrics.incr("phash_computed", len(todo))
+    return [hashed.get(p) for p in paths]
+
+
+def hamming(hashes, h: int):
+    """Bit distance between `h` and every entry of a uint64 array."""
+    import numpy as np
+
+    diff = hashes ^ np.uint64(h)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(diff)
+    return np.unpackbits(diff.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+class HashIndex:
+    """Perceptual hashes of one character folder, persisted as an .npz file."""
+
+    def __init__(self, folder: Path, path: Path):
+        import numpy as np
+
+        self.folder = folder
+        self.path = path
+        self.names: list[str] = []
+        self.versions: list[str] = []
+        self.hashes = np.zeros(0, dtype=np.uint64)
+        self._pending: list[int] = []
+        self._dir_mtime_ns = None
+        self._file_mtime_ns = None
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def _load(self) -> None:
+        import numpy as np
+
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return
+        if st.st_mtime_ns == self._file_mtime_ns:
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                self.names = data["names"].tolist()
+                self.versions = data["versions"].tolist()
+                self.hashes = data["hashes"].astype(np.uint64)
+        except (OSError, ValueError, KeyError) as ex:
+            LOG.warning("Ignoring unreadable hash index %s: %s", self.path, ex)
+            return
+        self._pending = []
+        self._file_mtime_ns = st.st_mtime_ns
+        self._dir_mtime_ns = None
+
+    def _compact(self) -> None:
+        import numpy as np
+
+        if self._pending:
+            self.hashes = np.concatenate([self.hashes, np.array(self._pending, dtype=np.uint64)])
+            self._pending = []
+
+    def sync(self) -> int:
+        """Bring the index in line with the folder; return how many files were hashed."""
+        import numpy as np
+
+        self._load()
+        try:
+            dir_mtime = self.folder.stat().st_mtime_ns
+        except FileNotFoundError:
+            dir_mtime = None
+        if dir_mtime is not None and dir_mtime == self._dir_mtime_ns:
+            return 0
+        self._compact()
+        current = {}
+        if dir_mtime is not None:
+            with os.scandir(self.folder) as it:
+                for entry in it:
+                    if Path(entry.name).suffix.lower() not in IMAGE_EXTS or not entry.is_file():
+                        continue
+                    st = entry.stat()
+                    current[entry.name] = f"{st.st_mtime_ns}:{st.st_size}"
+        known = {name: i for i, name in enumerate(self.names) if current.get(name) == self.versions[i]}
+        keep = sorted(known.values())
+        new = [name for name in current if name not in known]
+        hashes = hash_files([self.folder / name for name in new])
+        added = [(name, h) for name, h in zip(new, hashes) if h is not None]
+        changed = len(keep) != len(self.names) or bool(added)
+        self.names = [self.names[i] for i in keep] + [name for name, _ in added]
+        self.versions = [current[name] for name in self.names]
+        self.hashes = np.concatenate([self.hashes[keep], np.array([h for _, h in added], dtype=np.uint64)])
+        if changed:
+            self.save()
+        self._dir_mtime_ns = dir_mtime
+        return len(new)
+
+    def nearest(self, h: int) -> tuple[str, int] | None:
+        """Closest indexed image to hash `h` as `(name, distance)`."""
+        self._compact()
+        if not len(self.hashes):
+            return None
+        dist = hamming(self.hashes, h)
+        i = int(dist.argmin())
+        return self.names[i], int(dist[i])
+
+    def add(self, path: Path, h: int) -> None:
+        st = path.stat()
+        version = f"{st.st_mtime_ns}:{st.st_size}"
+        if path.name in self.names:  # overwritten in place
+            self._compact()
+            i = self.names.index(path.name)
+            self.versions[i] = version
+            self.hashes[i] = h
+            return
+        self.names.append(path.name)
+        self.versions.append(version)
+        self._pending.append(h)
+
+    def save(self) -> None:
+        import numpy as np
+
+        self._compact()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f".{self.path.stem}.tmp.npz")
+        np.savez(
+            tmp,
+            names=np.array(self.names, dtype=str),
+            versions=np.array(self.versions, dtype=str),
+            hashes=self.hashes,
+        )
+        os.replace(tmp, self.path)
+        self._file_mtime_ns = self.path.stat().st_mtime_ns
+        try:
+            self._dir_mtime_ns = self.folder.stat().st_mtime_ns
+        except FileNotFoundError:
+            self._dir_mtime_ns = None
+
+
+def index_lock(code: str) -> locks.FileLock:
+    return locks.file_lock(config.WORKSPACE_DIR / ".locks" / f"phash-{locks.lock_name(code)}.lock")
+
+
+def index_for(code: str) -> HashIndex:
+    """Process-wide index of `code`'s image folder; call `sync()` under `index_lock(code)`."""
+    folder = config.CHARACTERS_IMAGE_DIR / code
+    path = config.WORKSPACE_DIR / ".cache" / "phash" / f"{locks.lock_name(code)}.npz"
+    key = f"{folder}|{path}"
+    with _guard:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = HashIndex(folder, path)
+        return index
@@ -0,0 +1,253 @@
+"""Opt-in sampling profiler for slow tool calls and resource reads.
+
+Disabled by default; turn it on with `STORYWORLD_PROFILE=1` or the
+`configure_profiling` admin tool. While a profiled call is in flight, a
+background thread samples every thread's stack (`sys._current_frames()`) and
+keeps the stacks that pass through the called tool's function. That covers
+async tools running on the event loop and sync tools running on FastMCP's
+worker threads alike. Calls slower than the threshold are written to
+`WORKSPACE_DIR/.profiles/` as JSON (top functions plus collapsed stacks
+usable by flamegraph tools) together with the tool name and argument names
+(values too with `STORYWORLD_PROFILE_ARGS=1`).
+
+When profiling is off, the middleware costs one attribute check per call.
+"""
+from collections import Counter
+from pathlib import Path
+import asyncio
+import json
+import logging
+import sys
+import threading
+import time
+import uuid
+
+from fastmcp.server.middleware import Middleware
+
+from . import config
+from .metrics import resource_op
+
+LOG = logging.getLogger(__name__)
+
+MAX_ARG_CHARS = 200
+
+
+class ProfilerState:
+    def __init__(self):
+        self.enabled = config.PROFILE_ENABLED
+        self.threshold_ms = config.PROFILE_THRESHOLD_MS
+        self.interval_ms = config.PROFILE_INTERVAL_MS
+        self.keep = config.PROFILE_KEEP
+        # tool name -> remaining calls to profile regardless of threshold
+        self.armed: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def active(self, name: str) -> bool:
+        return self.enabled or name in self.armed
+
+    def take_armed(self, name: str) -> bool:
+        with self._lock:
+            left = self.armed.get(name, 0)
+            if left <= 0:
+                return False
+            if left == 1:
+                self.armed.pop(name, None)
+            else:
+                self.armed[name] = left - 1
+            return True
+
+
+STATE = ProfilerState()
+
+
+def profiles_dir() -> Path:
+    return config.WORKSPACE_DIR / ".profiles"
+
+
+class _Capture:
+    def __init__(self, target_code):
+        self.target_code = target_code
+        self.stacks: Counter[tuple[str, ...]] = Counter()
+        self.samples = 0
+
+
+class _Sampler:
+    """Single background thread that samples stacks for all in-flight captures."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._captures: set[_Capture] = set()
+        self._thread: threading.Thread | None = None
+
+    def add(self, capture: _Capture) -> None:
+        with self._lock:
+            self._captures.add(capture)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="storyworld-profiler", daemon=True)
+                self._thread.start()
+
+    def remove(self, capture: _Capture) -> None:
+        with self._lock:
+            self._captures.discard(capture)
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while True:
+            with self._lock:
+                captures = list(self._captures)
+                if not captures:
+                    self._thread = None
+                    return
+            hits: list[tuple[_Capture, tuple[str, ...]]] = []
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                chain = []
+                while frame is not None:
+                    chain.append(frame)
+                    frame = frame.f_back
+                chain.reverse()
+                for cap in captures:
+                    start = 0
+                    if cap.target_code is not None:
+                        start = next((i for i, f in enumerate(chain) if f.f_code is cap.target_code), -1)
+                        if start < 0:
+                            continue
+                    hits.append((cap, tuple(_label(f) for f in chain[start:])))
+            # Recorded under the lock and only for captures still registered, so once
+            # `remove()` returns a capture is no longer written to.
+            with self._lock:
+                for cap, stack in hits:
+                    if cap in self._captures:
+                        cap.stacks[stack] += 1
+                        cap.samples += 1
+            time.sleep(max(STATE.interval_ms, 0.5) / 1000)
+
+
+_SAMPLER = _Sampler()
+
+
+def _label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+
+def _short_args(arguments: dict | None) -> dict:
+    if not config.PROFILE_ARGS:
+        return {k: "<redacted>" for k in (arguments or {})}
+    out = {}
+    for k, v in (arguments or {}).items():
+        text = v if isinstance(v, (int, float, bool)) or v is None else repr(v)
+        if isinstance(text, str) and len(text) > MAX_ARG_CHARS:
+            text = text[:MAX_ARG_CHARS] + "..."
+        out[k] = text
+    return out
+
+
+def _summarize(cap: _Capture, top: int = 40) -> dict:
+    self_counts: Counter[str] = Counter()
+    total_counts: Counter[str] = Counter()
+    for stack, n in cap.stacks.items():
+        if not stack:
+            continue
+        self_counts[stack[-1]] += n
+        for label in set(stack):
+            total_counts[label] += n
+    rows = [
+        {"function": label, "total_samples": total, "self_samples": self_counts.get(label, 0)}
+        for label, total in total_counts.most_common(top)
+    ]
+    collapsed = [f"{';'.join(stack)} {n}" for stack, n in cap.stacks.most_common()]
+    return {"top": rows, "collapsed": collapsed}
+
+
+def _write_profile(op: str, arguments: dict | None, duration_ms: float, started_at: float, cap: _Capture, forced: bool) -> Path:
+    out_dir = profiles_dir()
+    out_dir.mkdir(parents=True, exist_ok=True)
+    stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime(started_at))
+    safe = "".join(c if c.isalnum() or c in "-_" else "_" for c in op)[:60]
+    pid = f"{stamp}-{safe}-{uuid.uuid4().hex[:8]}"
+    payload = {
+        "id": pid,
+        "operation": op,
+        "arguments": _short_args(arguments),
+        "duration_ms": round(duration_ms, 3),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(started_at)),
+        "forced": forced,
+        "interval_ms": STATE.interval_ms,
+        "samples": cap.samples,
+        **_summarize(cap),
+    }
+    path = out_dir / f"{pid}.json"
+    path.write_text(json.dumps(payload, indent=2), encoding="utf-8")
+    _prune(out_dir)
+    return path
+
+
+def _prune(out_dir: Path) -> None:
+    files = sorted(out_dir.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+    for stale in files[max(1, STATE.keep):]:
+        stale.unlink(missing_ok=True)
+
+
+def list_profiles(limit: int = 20) -> list[dict]:
+    out_dir = profiles_dir()
+    if not out_dir.exists():
+        return []
+    rows = []
+    for path in sorted(out_dir.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)[:limit]:
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except Exception:
+            continue
+        rows.append({k: data.get(k) for k in ("id", "operation", "arguments", "duration_ms", "started_at", "samples", "forced")})
+    return rows
+
+
+def load_profile(profile_id: str) -> dict | None:
+    safe = Path(profile_id).name
+    path = profiles_dir() / f"{safe}.json"
+    if not path.exists():
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+async def _profiled(op: str, arguments: dict | None, target_code, call):
+    forced = STATE.take_armed(op)
+    cap = _Capture(target_code)
+    _SAMPLER.add(cap)
+    started_at = time.time()
+    t0 = time.perf_counter()
+    try:
+        return await call()
+    finally:
+        duration_ms = (time.perf_counter() - t0) * 1000
+        _SAMPLER.remove(cap)
+        if forced or duration_ms >= STATE.threshold_ms:
+            # A profiling failure must never replace the call's result or exception.
+            try:
+                await asyncio.to_thread(_write_profile, op, arguments, duration_ms, started_at, cap, forced)
+            except Exception as ex:
+                LOG.warning("Saving profile for %s failed: %s", op, ex)
+
+
+class ProfilingMiddleware(Middleware):
+    async def on_call_tool(self, context, call_next):
+        name = context.message.name
+        if not STATE.active(name):
+            return await call_next(context)
+        target = None
+        server = getattr(context.fastmcp_context, "fastmcp", None)
+        if server is not None:
+            try:
+                tool = await server.get_tool(name)
+                target = getattr(getattr(tool, "fn", None), "__code__", None)
+            except Exception:
+                target = None
+        return await _profiled(name, context.message.arguments, target, lambda: call_next(context))
+
+    async def on_read_resource(self, context, call_next):
+        op = resource_op(str(context.message.uri))
+        if not STATE.active(op):
+            return await call_next(context)
+        return await _profiled(op, {"uri": str(context.message.uri)}, None, lambda: call_next(context))
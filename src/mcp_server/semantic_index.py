@@ -0,0 +1,352 @@
+"""Embedding index for semantic character lookup ("cautious and loves music").
+
+Each character's profile text (every string value except image references)
+becomes one unit-length vector. The vectors live in a float32 matrix on disk
+(`WORKSPACE_DIR/.cache/semantic/<model>.f32`, or `SEMANTIC_INDEX_DIR`), which
+is memory-mapped for search. A small JSON sidecar maps rows to codes. A query
+is one matrix-vector product over the map plus `argpartition` for the top k.
+
+Updates are incremental. Each row carries its YAML's `mtime_ns:size`, and
+`sync()` re-embeds only added or changed files, overwriting their rows in
+place. Rows of deleted characters are zeroed and reused. The matrix grows by
+doubling, so appends rarely rewrite the file.
+
+Embedders are pluggable (`SEMANTIC_MODEL`):
+
+- `hashing` / `hashing:<dim>`: the default, with no extra dependencies. It
+  hashes words and character 4-grams (so "music" meets "musical") into signed
+  buckets, with sublinear term frequency;
+- `sentence-transformers:<model>`: a local CPU sentence-transformers model;
+- `<module>:<callable>`: any callable mapping a list of texts to an
+  `(n, dim)` array.
+
+Needs numpy.
+"""
+from pathlib import Path
+import hashlib
+import importlib
+import json
+import logging
+import math
+import os
+import re
+import threading
+
+from . import config, locks, metrics
+
+LOG = logging.getLogger(__name__)
+_SKIP_KEYS = {"images", "profile_image", "code"}
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have he her his in is it its of on or she that the their "
+    "they to was were who with".split()
+)
+_BATCH = 256
+_indexes: dict[str, "SemanticIndex"] = {}
+_guard = threading.Lock()
+
+
+def available() -> bool:
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def profile_text(profile: dict) -> str:
+    """Flatten a profile's string values (nested lists/mappings included) into one text."""
+    parts: list[str] = []
+
+    def walk(value):
+        if isinstance(value, str):
+            parts.append(value)
+        elif isinstance(value, dict):
+            for v in value.values():
+                walk(v)
+        elif isinstance(value, list):
+            for v in value:
+                walk(v)
+
+    for key, value in profile.items():
+        if key not in _SKIP_KEYS:
+            walk(value)
+    return "\n".join(parts)
+
+
+class HashingEmbedder:
+    """Signed feature hashing of words and character 4-grams (stable across processes)."""
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+        self._buckets: dict[str, tuple[int, float]] = {}
+
+    def _bucket(self, feature: str) -> tuple[int, float]:
+        hit = self._buckets.get(feature)
+        if hit is None:
+            h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            hit = self._buckets[feature] = (h % self.dim, 1.0 if h >> 63 else -1.0)
+        return hit
+
+    def _features(self, text: str):
+        for word in _WORD_RE.findall(text.lower()):
+            if word in _STOPWORDS:
+                continue
+            yield word, 1.0
+            padded = f"<{word}>"
+            for i in range(len(padded) - 3):
+                yield padded[i:i + 4], 0.25
+
+    def embed(self, texts: list[str]):
+        import numpy as np
+
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            idx: list[int] = []
+            weights: list[float] = []
+            for feature, weight in self._features(text):
+                bucket, sign = self._bucket(feature)
+                idx.append(bucket)
+                weights.append(sign * weight)
+            if idx:
+                counts = np.bincount(np.array(idx), weights=np.array(weights), minlength=self.dim)
+                out[row] = np.sign(counts) * np.log1p(np.abs(counts))
+        return _normalize(out)
+
+
+class CallableEmbedder:
+    def __init__(self, name: str, fn):
+        self.name = name
+        self._fn = fn
+        self.dim = int(self.embed(["dimension probe"]).shape[1])
+
+    def embed(self, texts: list[str]):
+        import numpy as np
+
+        return _normalize(np.asarray(self._fn(texts), dtype=np.float32))
+
+
+def _sentence_transformer(model: str):
+    from sentence_transformers import SentenceTransformer
+
+    encoder = SentenceTransformer(model, device="cpu")
+    return lambda texts: encoder.encode(list(texts), batch_size=64, show_progress_bar=False)
+
+
+def _normalize(matrix):
+    import numpy as np
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+def get_embedder(spec: str):
+    """Build the embedder named by `spec` (see the module docstring)."""
+    spec = (spec or "hashing").strip()
+    if spec == "hashing" or spec.startswith("hashing:"):
+        _, _, dim = spec.partition(":")
+        return HashingEmbedder(int(dim) if dim else 1024)
+    kind, _, target = spec.partition(":")
+    if kind == "sentence-transformers" and target:
+        return CallableEmbedder(spec, _sentence_transformer(target))
+    if target:
+        return CallableEmbedder(spec, getattr(importlib.import_module(kind), target))
+    raise ValueError(f"unknown SEMANTIC_MODEL: {spec!r}")
+
+
+def _slug(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", name)
+
+
+class SemanticIndex:
+    def __init__(self, root: Path, parse, embedder):
+        """`parse(path) -> dict` turns one YAML file into a profile."""
+        self.root = root
+        self.parse = parse
+        self.embedder = embedder
+        slug = _slug(embedder.name)
+        self.vectors_path = root / f"{slug}.f32"
+        self.meta_path = root / f"{slug}.json"
+        self._lock = threading.RLock()
+        self._meta_mtime_ns = None
+        self._matrix = None
+        self._layout = None
+        self._rows: dict[str, list] = {}  # code -> [row, version, path, name]
+        self._capacity = 0
+
+    @property
+    def model(self) -> str:
+        return self.embedder.name
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _file_lock(self) -> locks.FileLock:
+        return locks.file_lock(self.root / f".{self.meta_path.stem}.lock")
+
+    def _load(self) -> None:
+        """Re-read the sidecar (and re-map the matrix) when another process changed it."""
+        try:
+            mtime = self.meta_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._meta_mtime_ns:
+            return
+        try:
+            meta = json.loads(self.meta_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as ex:
+            LOG.warning("Ignoring unreadable semantic index %s: %s", self.meta_path, ex)
+            return
+        if meta.get("model") != self.model or meta.get("dim") != self.embedder.dim:
+            return
+        self._rows = meta.get("rows") or {}
+        self._capacity = int(meta.get("capacity") or 0)
+        self._matrix = self._layout = None
+        self._meta_mtime_ns = mtime
+
+    def _map(self, mode: str = "r"):
+        import numpy as np
+
+        if not self._capacity:
+            return np.zeros((0, self.embedder.dim), dtype=np.float32)
+        return np.memmap(self.vectors_path, dtype=np.float32, mode=mode, shape=(self._capacity, self.embedder.dim))
+
+    def _grow(self, needed: int) -> None:
+        if needed <= self._capacity:
+            return
+        capacity = max(64, self._capacity)
+        while capacity < needed:
+            capacity *= 2
+        row_bytes = self.embedder.dim * 4
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.vectors_path, "ab") as fh:
+            fh.truncate(capacity * row_bytes)
+        self._capacity = capacity
+        self._matrix = None
+
+    def _save_meta(self) -> None:
+        meta = {"model": self.model, "dim": self.embedder.dim, "capacity": self._capacity, "rows": self._rows}
+        tmp = self.meta_path.with_name(f".{self.meta_path.name}.tmp")
+        tmp.write_text(json.dumps(meta, separators=(",", ":")), encoding="utf-8")
+        os.replace(tmp, self.meta_path)
+        self._meta_mtime_ns = self.meta_path.stat().st_mtime_ns
+
+    def sync(self, desc_dir: Path) -> dict:
+        """Bring the index in line with `desc_dir`; only added or changed YAMLs are embedded."""
+        with self._lock, self._file_lock():
+            self._load()
+            current = {}
+            if desc_dir.is_dir():
+                with os.scandir(desc_dir) as it:
+                    for entry in it:
+                        if entry.name.endswith(".yaml") and entry.is_file():
+                            st = entry.stat()
+                            current[entry.name[:-5]] = (entry.path, f"{st.st_mtime_ns}:{st.st_size}")
+            removed = [code for code in self._rows if code not in current]
+            changed = [code for code, (path, version) in current.items()
+                       if self._rows.get(code, [None, None, None])[1:3] != [version, path]]
+            if not removed and not changed:
+                metrics.incr("cache_hit:semantic_index")
+                return {"size": len(self._rows), "embedded": 0, "removed": 0}
+            metrics.incr("cache_miss:semantic_index")
+            matrix = self._map("r+") if self._capacity else None
+            for code in removed:
+                matrix[self._rows.pop(code)[0]] = 0
+            used = {entry[0] for entry in self._rows.values()}
+            free = sorted(set(range(self._capacity)) - used, reverse=True)
+            embedded = 0
+            for start in range(0, len(changed), _BATCH):
+                batch = changed[start:start + _BATCH]
+                profiles = []
+                for code in batch:
+                    try:
+                        profiles.append(self.parse(Path(current[code][0])))
+                    except Exception as ex:
+                        LOG.warning("Skipping %s in semantic index: %s", code, ex)
+                        profiles.append({})
+                with metrics.stage("embed"):
+                    vectors = self.embedder.embed([profile_text(p) for p in profiles])
+                new_codes = [code for code in batch if code not in self._rows]
+                if len(new_codes) > len(free):
+                    old_capacity = self._capacity
+                    self._grow(len(self._rows) + len(new_codes))
+                    free = sorted(free + list(range(old_capacity, self._capacity)), reverse=True)
+                    matrix = self._map("r+")
+                for code, profile, vector in zip(batch, profiles, vectors):
+                    row = self._rows[code][0] if code in self._rows else free.pop()
+                    matrix[row] = vector
+                    name = profile.get("name") if isinstance(profile, dict) else None
+                    self._rows[code] = [row, current[code][1], current[code][0], str(name or code)]
+                    embedded += 1
+            if matrix is not None:
+                matrix.flush()
+            self._matrix = self._layout = None
+            self._save_meta()
+            return {"size": len(self._rows), "embedded": embedded, "removed": len(removed)}
+
+    def embed_query(self, text: str):
+        return self.embedder.embed([text])[0]
+
+    def vector_for(self, code: str):
+        with self._lock:
+            entry = self._rows.get(code)
+            if entry is None:
+                return None
+            return self._matrix_view()[entry[0]].copy()
+
+    def _matrix_view(self):
+        if self._matrix is None:
+            self._matrix = self._map("r")
+        return self._matrix
+
+    def _row_layout(self):
+        """`(codes by row, mask of empty rows)`, rebuilt only when rows change."""
+        import numpy as np
+
+        if self._layout is None:
+            codes = [None] * self._capacity
+            for code, entry in self._rows.items():
+                codes[entry[0]] = code
+            self._layout = (codes, np.array([c is None for c in codes], dtype=bool))
+        return self._layout
+
+    def search(self, vector, k: int = 5, exclude: set[str] | None = None) -> list[dict]:
+        """Top-`k` characters by cosine similarity to the unit `vector`."""
+        import numpy as np
+
+        with self._lock:
+            if not self._rows:
+                return []
+            codes, empty = self._row_layout()
+            scores = self._matrix_view() @ np.asarray(vector, dtype=np.float32)
+            scores[empty] = -math.inf
+            excluded = [self._rows[c][0] for c in exclude or () if c in self._rows]
+            scores[excluded] = -math.inf
+            k = min(k, len(self._rows) - len(excluded))
+            if k <= 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [
+                {"code": codes[i], "name": self._rows[codes[i]][3], "score": round(float(scores[i]), 4)}
+                for i in top
+            ]
+
+
+def index_dir() -> Path:
+    if config.SEMANTIC_INDEX_DIR:
+        return Path(config.SEMANTIC_INDEX_DIR)
+    return config.WORKSPACE_DIR / ".cache" / "semantic"
+
+
+def get_index(parse) -> SemanticIndex:
+    """Index for the current workspace and `SEMANTIC_MODEL` (tests may re-point either)."""
+    root = index_dir()
+    key = f"{root}|{config.SEMANTIC_MODEL}"
+    with _guard:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = SemanticIndex(root, parse, get_embedder(config.SEMANTIC_MODEL))
+        return index
@@ -0,0 +1,124 @@
+"""Cross-process cache of derived data in a SQLite (WAL) file.
+
+Entries are keyed by `(namespace, key)` and tagged with the source file's
+version (`mtime_ns:size`), so every worker process sees the same parsed
+results and a changed file is simply a miss. The database lives at
+`WORKSPACE_DIR/.cache/storyworld.sqlite3` unless `SHARED_CACHE_PATH` is set;
+WAL mode lets readers run concurrently with a writer.
+
+The file is only used when `SHARED_CACHE` is on (by default, when
+`HTTP_WORKERS > 1`). A single process gets a `MemoryCache` with the same
+interface and writes nothing to the workspace.
+"""
+from pathlib import Path
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from . import config
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    ns TEXT NOT NULL,
+    key TEXT NOT NULL,
+    version TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (ns, key)
+)
+"""
+
+
+class SharedCache:
+    def __init__(self, path: Path):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def get(self, ns: str, key: str, version: str):
+        row = self._conn().execute(
+            "SELECT version, value FROM entries WHERE ns = ? AND key = ?", (ns, key)
+        ).fetchone()
+        if row is None or row[0] != version:
+            return None
+        return json.loads(row[1])
+
+    def put(self, ns: str, key: str, version: str, value) -> None:
+        self._conn().execute(
+            "INSERT OR REPLACE INTO entries (ns, key, version, value, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (ns, key, version, json.dumps(value), time.time()),
+        )
+
+    def clear(self, ns: str | None = None) -> None:
+        if ns is None:
+            self._conn().execute("DELETE FROM entries")
+        else:
+            self._conn().execute("DELETE FROM entries WHERE ns = ?", (ns,))
+
+
+class MemoryCache:
+    """In-process stand-in for `SharedCache` (single-process servers)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: dict[tuple[str, str], tuple[str, str]] = {}
+
+    def get(self, ns: str, key: str, version: str):
+        with self._lock:
+            hit = self._entries.get((ns, key))
+        if hit is None or hit[0] != version:
+            return None
+        return json.loads(hit[1])
+
+    def put(self, ns: str, key: str, version: str, value) -> None:
+        raw = json.dumps(value)
+        with self._lock:
+            self._entries[(ns, key)] = (version, raw)
+
+    def clear(self, ns: str | None = None) -> None:
+        with self._lock:
+            if ns is None:
+                self._entries.clear()
+            else:
+                for k in [k for k in self._entries if k[0] == ns]:
+                    del self._entries[k]
+
+
+_caches: dict[str, SharedCache] = {}
+_memory = MemoryCache()
+_guard = threading.Lock()
+
+
+def cache_path() -> Path:
+    if config.SHARED_CACHE_PATH:
+        return Path(config.SHARED_CACHE_PATH)
+    return config.WORKSPACE_DIR / ".cache" / "storyworld.sqlite3"
+
+
+def get_cache() -> SharedCache | MemoryCache:
+    """Cache for the current workspace (tests and CLI flags may re-point it)."""
+    if not config.SHARED_CACHE:
+        return _memory
+    path = cache_path()
+    key = str(path)
+    with _guard:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = SharedCache(path)
+        return cache
+
+
+def file_version(st: os.stat_result) -> str:
+    return f"{st.st_mtime_ns}:{st.st_size}"
@@ -0,0 +1,165 @@
+"""Thin stdio shim that forwards an MCP session to the storyworld daemon.
+
+Only the standard library (plus `config`) is imported here so a client launch
+costs milliseconds. The shim connects to the daemon's Unix socket, starting
+`python -m mcp_server.daemon` in the background if nothing is listening, then
+copies newline-delimited JSON-RPC bytes stdin -> socket and socket -> stdout
+until either side closes.
+
+A daemon serves with the environment it was started with, so the socket name
+also hashes the variables that configure the server (paths, tokens,
+`COMFY_*`). Clients launched with different credentials get their own daemon.
+A pinned `STORYWORLD_DAEMON_SOCKET` whose daemon was started with another
+environment is refused instead of shared.
+"""
+from pathlib import Path
+import errno
+import fcntl
+import hashlib
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from . import config
+
+CHUNK = 64 * 1024
+# Variables that shape the server; daemon launch knobs are left out so they can differ per client.
+_ENV_PREFIXES = (
+    "WORKSPACE_", "CHARACTER", "IMAGES_DIR", "PUBLIC_IMAGES_DIR", "STORY", "COMFY", "GITHUB_", "GH_", "HF_",
+    "HUGGING_FACE_", "SHARED_CACHE", "SEMANTIC_", "DEDUPE_", "IMAGE_", "MEDIA_", "ADMISSION_", "TRUSTED_",
+    "DISABLE_AUTO_DOWNLOAD", "STARTUP_PREFETCH", "METRICS_", "FASTMCP_",
+)
+_ENV_IGNORED = ("STORYWORLD_DAEMON",)
+
+
+def env_fingerprint(environ=None) -> str:
+    """Short digest of the server-shaping environment (values never leave the hash)."""
+    environ = os.environ if environ is None else environ
+    items = sorted(
+        f"{k}={v}" for k, v in environ.items() if k.startswith(_ENV_PREFIXES) and not k.startswith(_ENV_IGNORED)
+    )
+    return hashlib.sha256("\0".join(items).encode("utf-8")).hexdigest()[:16]
+
+
+def socket_path(server_args: list[str]) -> Path:
+    """Socket for this workspace + environment + CLI overrides (different configs get different daemons)."""
+    if config.DAEMON_SOCKET:
+        return Path(config.DAEMON_SOCKET)
+    key = "\0".join([str(config.WORKSPACE_DIR), env_fingerprint(), *server_args])
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+    # AF_UNIX paths are limited to ~100 bytes, so keep them out of WORKSPACE_DIR.
+    return Path(tempfile.gettempdir()) / f"storyworld-{os.getuid()}-{digest}.sock"
+
+
+def _connect(path: Path) -> socket.socket | None:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(path))
+        return sock
+    except OSError as ex:
+        sock.close()
+        if ex.errno in (errno.ENOENT, errno.ECONNREFUSED):
+            return None
+        raise
+
+
+def _check_fingerprint(path: Path, sock: socket.socket) -> socket.socket:
+    try:
+        started_with = path.with_suffix(".env").read_text(encoding="utf-8").strip()
+    except OSError:
+        return sock
+    if started_with and started_with != env_fingerprint():
+        sock.close()
+        raise RuntimeError(
+            f"the storyworld daemon on {path} was started with a different environment "
+            "(tokens, paths or COMFY_* settings); stop it or use another STORYWORLD_DAEMON_SOCKET"
+        )
+    return sock
+
+
+def _spawn_daemon(path: Path, server_args: list[str]) -> subprocess.Popen:
+    log = open(path.with_suffix(".log"), "ab")
+    try:
+        return subprocess.Popen(
+            [sys.executable, "-m", "mcp_server.daemon", "--socket", str(path), *server_args],
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+    finally:
+        log.close()
+
+
+def connect_or_spawn(server_args: list[str], timeout: float | None = None) -> socket.socket:
+    """Return a connected socket, starting the daemon first when needed."""
+    path = socket_path(server_args)
+    sock = _connect(path)
+    if sock is not None:
+        return _check_fingerprint(path, sock)
+    timeout = config.DAEMON_START_TIMEOUT if timeout is None else timeout
+    # Serialize spawns so concurrent client launches start a single daemon.
+    with open(path.with_suffix(".lock"), "a+b") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        sock = _connect(path)
+        if sock is not None:
+            return _check_fingerprint(path, sock)
+        path.unlink(missing_ok=True)  # stale socket from a dead daemon
+        proc = _spawn_daemon(path, server_args)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            sock = _connect(path)
+            if sock is not None:
+                return sock
+            if proc.poll() is not None:
+                raise RuntimeError(f"storyworld daemon exited with code {proc.returncode}; see {path.with_suffix('.log')}")
+            time.sleep(0.05)
+    raise TimeoutError(f"storyworld daemon did not listen on {path} within {timeout}s")
+
+
+def forward(sock: socket.socket, stdin=None, stdout=None) -> None:
+    """Copy stdin to the socket and the socket to stdout until the daemon hangs up."""
+    stdin = stdin or sys.stdin.buffer
+    stdout = stdout or sys.stdout.buffer
+
+    def pump_in():
+        try:
+            while True:
+                data = os.read(stdin.fileno(), CHUNK)
+                if not data:
+                    break
+                sock.sendall(data)
+        except OSError:
+            pass
+        finally:
+            try:
+                sock.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+
+    threading.Thread(target=pump_in, name="storyworld-shim-stdin", daemon=True).start()
+    try:
+        while True:
+            data = sock.recv(CHUNK)
+            if not data:
+                break
+            stdout.write(data)
+            stdout.flush()
+    except (OSError, ValueError):
+        pass
+    finally:
+        sock.close()
+
+
+def main(server_args: list[str]) -> int:
+    try:
+        sock = connect_or_spawn(server_args)
+    except Exception as ex:
+        print(f"storyworld-mcp: {ex}", file=sys.stderr)
+        return 1
+    forward(sock)
+    return 0
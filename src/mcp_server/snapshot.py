@@ -0,0 +1,290 @@
+"""Workspace snapshots: pack a warm workspace into one archive, restore it elsewhere.
+
+A snapshot is a tar archive (gzip when the name ends in `.gz`). Its first
+member, `snapshot.json`, is a manifest listing every file with its size,
+`mtime_ns` and sha256. The files sit under fixed archive roots:
+
+- `descriptions/`: character YAMLs (`CHARACTERS_DESC_DIR`);
+- `images/`: character images (`CHARACTERS_IMAGE_DIR`);
+- `stories/`: story bundles, including `_variants/` thumbnails (`STORIES_DIR`,
+  without the story git repos);
+- `cache/`: the shared parse cache and the character store (SQLite), copied
+  with SQLite's online backup API.
+
+Import restores each root into the target workspace's configured folders.
+Every file is first extracted next to its destination (`.<name>.part`) and
+its hash verified. Nothing is moved into place until the whole archive has
+checked out. The rename phase is bracketed by a marker
+(`WORKSPACE_DIR/.snapshot-import.partial`). An import interrupted there is
+detected by `import_incomplete()` and redone on the next start. Import
+restores `mtime_ns`, so cache entries (tagged `mtime_ns:size`) stay valid. It also
+rewrites the absolute paths stored in the SQLite caches to the new folders.
+A fresh replica therefore serves from warm indexes with no network access.
+
+    python -m mcp_server.snapshot export workspace.tar
+    python -m mcp_server.snapshot import workspace.tar [--force]
+"""
+from datetime import datetime, timezone
+from pathlib import Path
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+import sqlite3
+import sys
+import tarfile
+import tempfile
+
+from . import character_store, config, shared_cache
+
+LOG = logging.getLogger(__name__)
+MANIFEST_NAME = "snapshot.json"
+FORMAT_VERSION = 1
+_CHUNK = 1024 * 1024
+
+
+class SnapshotError(RuntimeError):
+    """Raised for unreadable, tampered or unsafe snapshot archives."""
+
+
+def _dir_roots(include_stories: bool) -> dict[str, Path]:
+    roots = {"descriptions": config.CHARACTERS_DESC_DIR, "images": config.CHARACTERS_IMAGE_DIR}
+    if include_stories:
+        roots["stories"] = config.STORIES_DIR
+    return roots
+
+
+def _cache_files() -> dict[str, Path]:
+    return {
+        "cache/storyworld.sqlite3": shared_cache.cache_path(),
+        "cache/characters.sqlite3": character_store.store_path(),
+    }
+
+
+def _root_paths(path: Path) -> dict:
+    return {"path": str(path), "resolved": str(path.resolve())}
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as fh:
+        for chunk in iter(lambda: fh.read(_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _walk(root: Path, skip: set[Path]):
+    for dirpath, dirnames, filenames in os.walk(root):
+        here = Path(dirpath)
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith(".") and (here / d) not in skip)
+        for name in sorted(filenames):
+            if name.startswith(".") and name != ".catalog.json":
+                continue
+            yield here / name
+
+
+def export_snapshot(dest: Path, include_stories: bool = True, include_caches: bool = True) -> dict:
+    """Write a snapshot of the current workspace to `dest`; return its manifest."""
+    dest = Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    skip = {config.STORY_REPOS_DIR}
+    entries: list[tuple[str, Path]] = []
+    roots = {}
+    for name, root in _dir_roots(include_stories).items():
+        if not root.is_dir():
+            continue
+        roots[name] = _root_paths(root)
+        entries.extend((f"{name}/{p.relative_to(root).as_posix()}", p) for p in _walk(root, skip))
+
+    with tempfile.TemporaryDirectory(prefix="storyworld-snapshot-") as tmp:
+        caches = {}
+        if include_caches:
+            for arcname, src in _cache_files().items():
+                if not src.is_file():
+                    continue
+                copy = Path(tmp) / Path(arcname).name
+                with sqlite3.connect(str(src)) as source, sqlite3.connect(str(copy)) as target:
+                    source.backup(target)
+                caches[arcname] = str(src)
+                entries.append((arcname, copy))
+
+        files = []
+        for arcname, path in entries:
+            st = path.stat()
+            files.append({"path": arcname, "bytes": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": _sha256(path)})
+        manifest = {
+            "format": FORMAT_VERSION,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "roots": roots,
+            "caches": caches,
+            "files": files,
+            "file_count": len(files),
+            "total_bytes": sum(f["bytes"] for f in files),
+        }
+        mode = "w:gz" if dest.name.endswith(".gz") else "w"
+        tmp_dest = dest.with_name(f".{dest.name}.tmp")
+        with tarfile.open(tmp_dest, mode, format=tarfile.PAX_FORMAT) as tar:
+            raw = json.dumps(manifest, indent=2).encode("utf-8")
+            info = tarfile.TarInfo(MANIFEST_NAME)
+            info.size = len(raw)
+            tar.addfile(info, io.BytesIO(raw))
+            for arcname, path in entries:
+                tar.add(str(path), arcname=arcname, recursive=False)
+        os.replace(tmp_dest, dest)
+    return manifest
+
+
+def read_manifest(archive: Path) -> dict:
+    with tarfile.open(archive, "r:*") as tar:
+        return _read_manifest(tar)
+
+
+def _read_manifest(tar: tarfile.TarFile) -> dict:
+    first = tar.next()
+    if first is None or first.name != MANIFEST_NAME:
+        raise SnapshotError(f"not a storyworld snapshot (first member is not {MANIFEST_NAME})")
+    manifest = json.loads(tar.extractfile(first).read())
+    if manifest.get("format") != FORMAT_VERSION:
+        raise SnapshotError(f"unsupported snapshot format: {manifest.get('format')!r}")
+    return manifest
+
+
+def _partial_marker() -> Path:
+    return config.WORKSPACE_DIR / ".snapshot-import.partial"
+
+
+def import_incomplete() -> bool:
+    """True when an earlier import stopped after it began moving files into place."""
+    return _partial_marker().exists()
+
+
+def _target_for(arcname: str, targets: dict[str, Path]) -> Path:
+    if arcname in targets:
+        return targets[arcname]
+    root, _, rel = arcname.partition("/")
+    parts = Path(rel).parts
+    if root not in targets or not rel or any(p in ("..", "") for p in parts) or Path(rel).is_absolute():
+        raise SnapshotError(f"unsafe or unknown path in snapshot: {arcname!r}")
+    return targets[root].joinpath(*parts)
+
+
+def import_snapshot(archive: Path, force: bool = False) -> dict:
+    """Restore `archive` into the configured workspace folders; return a summary.
+
+    Refuses to overwrite existing character YAMLs unless `force=True` (or an
+    earlier import was interrupted, see `import_incomplete`).
+    """
+    targets: dict[str, Path] = {
+        "descriptions": config.CHARACTERS_DESC_DIR,
+        "images": config.CHARACTERS_IMAGE_DIR,
+        "stories": config.STORIES_DIR,
+        **_cache_files(),
+    }
+    if not force and not import_incomplete() and config.CHARACTERS_DESC_DIR.is_dir() and any(config.CHARACTERS_DESC_DIR.glob("*.yaml")):
+        raise SnapshotError(f"{config.CHARACTERS_DESC_DIR} already has characters; use force=True to overwrite")
+    staged: list[tuple[str, Path, Path]] = []
+    try:
+        with tarfile.open(archive, "r:*") as tar:
+            manifest = _read_manifest(tar)
+            expected = {f["path"]: f for f in manifest["files"]}
+            for member in tar:
+                if not member.isfile() or member.name == MANIFEST_NAME:
+                    continue
+                meta = expected.get(member.name)
+                if meta is None:
+                    raise SnapshotError(f"file not listed in manifest: {member.name!r}")
+                dest = _target_for(member.name, targets)
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                part = dest.with_name(f".{dest.name}.part")
+                staged.append((member.name, part, dest))
+                digest = hashlib.sha256()
+                src = tar.extractfile(member)
+                with part.open("wb") as fh:
+                    for chunk in iter(lambda: src.read(_CHUNK), b""):
+                        digest.update(chunk)
+                        fh.write(chunk)
+                if digest.hexdigest() != meta["sha256"]:
+                    raise SnapshotError(f"sha256 mismatch for {member.name!r}")
+                os.utime(part, ns=(meta["mtime_ns"], meta["mtime_ns"]))
+        missing = sorted(set(expected) - {name for name, _, _ in staged})
+        if missing:
+            raise SnapshotError(f"snapshot is missing {len(missing)} file(s), e.g. {missing[0]!r}")
+    except BaseException:
+        for _, part, _ in staged:
+            part.unlink(missing_ok=True)
+        raise
+
+    marker = _partial_marker()
+    marker.parent.mkdir(parents=True, exist_ok=True)
+    marker.write_text(str(archive), encoding="utf-8")
+    for name, part, dest in staged:
+        if name in manifest.get("caches", {}):
+            # A stale WAL next to a replaced database would be replayed into it.
+            for suffix in ("-wal", "-shm"):
+                Path(f"{dest}{suffix}").unlink(missing_ok=True)
+        os.replace(part, dest)
+
+    rewrites = {}
+    for name, paths in (manifest.get("roots") or {}).items():
+        if name in targets:
+            new = targets[name]
+            rewrites[paths["resolved"]] = str(new.resolve())
+            rewrites[paths["path"]] = str(new)
+    for arcname in manifest.get("caches") or {}:
+        _rewrite_cache_paths(targets[arcname], rewrites)
+    marker.unlink(missing_ok=True)
+    return {
+        "archive": str(archive),
+        "created_at": manifest.get("created_at"),
+        "files": len(staged),
+        "bytes": sum(expected[name]["bytes"] for name, _, _ in staged),
+        "roots": {name: str(targets[name]) for name in manifest.get("roots") or {}},
+    }
+
+
+def _rewrite_cache_paths(db: Path, rewrites: dict[str, str]) -> None:
+    """Point path-keyed cache rows at the folders the snapshot was restored into."""
+    pairs = [(old.rstrip("/") + "/", new.rstrip("/") + "/") for old, new in rewrites.items() if old != new]
+    if not pairs or not db.is_file():
+        return
+    with sqlite3.connect(str(db)) as conn:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for table, column in (("entries", "key"), ("characters", "path")):
+            if table not in tables:
+                continue
+            for old, new in pairs:
+                conn.execute(
+                    f"UPDATE {table} SET {column} = ? || substr({column}, ?) WHERE substr({column}, 1, ?) = ?",
+                    (new, len(old) + 1, len(old), old),
+                )
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m mcp_server.snapshot", description="Export or import a workspace snapshot.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    exp = sub.add_parser("export", help="pack the workspace into an archive")
+    exp.add_argument("archive")
+    exp.add_argument("--no-stories", action="store_true", help="leave story bundles out")
+    exp.add_argument("--no-caches", action="store_true", help="leave the SQLite caches out")
+    imp = sub.add_parser("import", help="restore an archive into the workspace")
+    imp.add_argument("archive")
+    imp.add_argument("--force", action="store_true", help="overwrite an existing workspace")
+    ns = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    try:
+        if ns.command == "export":
+            manifest = export_snapshot(Path(ns.archive), include_stories=not ns.no_stories, include_caches=not ns.no_caches)
+            summary = {"archive": ns.archive, "files": manifest["file_count"], "bytes": manifest["total_bytes"]}
+        else:
+            summary = import_snapshot(Path(ns.archive), force=ns.force)
+    except (SnapshotError, OSError, tarfile.TarError) as ex:
+        print(f"snapshot {ns.command} failed: {ex}", file=sys.stderr)
+        return 1
+    print(json.dumps(summary, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,223 @@
+"""Git backend for story repos.
+
+Keeps the number of `git` subprocesses per tool call to a minimum:
+
+- repo metadata (HEAD, remotes, identity) is read and written in-process from
+  `.git/` instead of spawning `rev-parse` / `config` / `remote` commands;
+- bundles are mirrored into the repo incrementally, so unchanged media keeps
+  its mtime and `git add` does not re-hash it;
+- pushes pass credentials through a one-shot `http.extraHeader` instead of
+  rewriting the remote URL before and after every push. One-shot settings go
+  through `GIT_CONFIG_COUNT`/`GIT_CONFIG_KEY_n`/`GIT_CONFIG_VALUE_n`, so the
+  token never appears on a command line visible in `ps`.
+
+Large media is marked `binary -delta` in `.gitattributes` so packing does not
+spend time delta-compressing video, or routed through Git LFS when enabled
+and `git-lfs` is installed.
+"""
+from pathlib import Path
+import base64
+import os
+import re
+import shutil
+import subprocess
+import time
+
+GIT_USER_NAME = "Storyworld Agent"
+GIT_USER_EMAIL = "storyworld-agent@local"
+LARGE_MEDIA_PATTERNS = ("*.mp4", "*.webm", "*.mov", "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.bmp")
+_WRITING_RE = re.compile(r"Writing objects:\s+100% \([^)]*\),\s+([\d.]+)\s*(bytes|KiB|MiB|GiB)")
+_UNITS = {"bytes": 1, "KiB": 1024, "MiB": 1024 ** 2, "GiB": 1024 ** 3}
+_GITHUB_REPO_RE = re.compile(r"^[A-Za-z0-9_.-]+/[A-Za-z0-9_.-]+$")
+
+
+def is_local_remote(target: str) -> bool:
+    """True when `target` is a URL or path (e.g. a local bare repo), not `owner/repo`."""
+    return "://" in target or target.startswith(("/", ".", "~", "file:")) or os.path.isabs(target)
+
+
+def remote_error(target: str, prefixes: list[str], allow_local: bool) -> str | None:
+    """Why `target` may not be used as a story remote, or None if it may."""
+    if is_local_remote(target):
+        if allow_local:
+            return None
+        return "URL and local-path remotes are disabled; set STORY_GIT_ALLOW_LOCAL=1 to allow them"
+    if not _GITHUB_REPO_RE.match(target) or ".." in target:
+        return f"Invalid github_repo '{target}'; expected owner/repo"
+    # A prefix without `/` names an owner, so `my-class` must not match `my-class-evil/x`.
+    prefixes = [p if "/" in p else p + "/" for p in prefixes]
+    if prefixes and not any(target.startswith(prefix) for prefix in prefixes):
+        return f"github_repo '{target}' is outside STORY_GIT_REMOTE_PREFIX"
+    return None
+
+
+def config_env(config: dict[str, str]) -> dict[str, str]:
+    """Environment passing `config` to git as one-shot settings, after any already set."""
+    env = dict(os.environ)
+    try:
+        start = int(env.get("GIT_CONFIG_COUNT", "0"))
+    except ValueError:
+        start = 0
+    for i, (key, value) in enumerate(config.items(), start=start):
+        env[f"GIT_CONFIG_KEY_{i}"] = key
+        env[f"GIT_CONFIG_VALUE_{i}"] = value
+    env["GIT_CONFIG_COUNT"] = str(start + len(config))
+    return env
+
+
+class StoryRepo:
+    def __init__(self, repo_dir: Path):
+        self.repo_dir = repo_dir
+        self.git_dir = repo_dir / ".git"
+
+    def run(self, args: list[str], config: dict[str, str] | None = None) -> tuple[int, str]:
+        proc = subprocess.run(
+            ["git", *args],
+            cwd=str(self.repo_dir),
+            env=config_env(config) if config else None,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            check=False,
+        )
+        return proc.returncode, (proc.stdout or "").strip()
+
+    def ensure(self, lfs: bool = False, big_file_threshold: str = "") -> tuple[bool, str]:
+        """Initialize the repo if needed. Returns (initialized, error)."""
+        self.repo_dir.mkdir(parents=True, exist_ok=True)
+        if self.git_dir.exists():
+            return False, ""
+        rc, out = self.run(["init", "-q", "-b", "main"])
+        if rc != 0:
+            return False, out or "git init failed"
+        extra = f"[user]\n\tname = {GIT_USER_NAME}\n\temail = {GIT_USER_EMAIL}\n"
+        if big_file_threshold:
+            extra += f"[core]\n\tbigFileThreshold = {big_file_threshold}\n"
+        with (self.git_dir / "config").open("a", encoding="utf-8") as fh:
+            fh.write(extra)
+        use_lfs = lfs and shutil.which("git-lfs") is not None
+        if use_lfs:
+            self.run(["lfs", "install", "--local"])
+        attrs = "filter=lfs diff=lfs merge=lfs -text" if use_lfs else "binary -delta"
+        lines = [f"{pattern} {attrs}" for pattern in LARGE_MEDIA_PATTERNS]
+        (self.repo_dir / ".gitattributes").write_text("\n".join(lines) + "\n", encoding="utf-8")
+        return True, ""
+
+    def head(self) -> str | None:
+        """Resolve HEAD to a commit sha without spawning git."""
+        try:
+            ref = (self.git_dir / "HEAD").read_text(encoding="utf-8").strip()
+        except OSError:
+            return None
+        if not ref.startswith("ref:"):
+            return ref or None
+        name = ref.split(":", 1)[1].strip()
+        loose = self.git_dir / name
+        if loose.exists():
+            return loose.read_text(encoding="utf-8").strip() or None
+        packed = self.git_dir / "packed-refs"
+        if packed.exists():
+            for line in packed.read_text(encoding="utf-8").splitlines():
+                parts = line.split(" ", 1)
+                if len(parts) == 2 and parts[1].strip() == name:
+                    return parts[0]
+        return None
+
+    def remote_url(self, name: str = "origin") -> str | None:
+        try:
+            text = (self.git_dir / "config").read_text(encoding="utf-8")
+        except OSError:
+            return None
+        section = None
+        for line in text.splitlines():
+            stripped = line.strip()
+            if stripped.startswith("["):
+                section = stripped
+                continue
+            if section == f'[remote "{name}"]' and stripped.startswith("url"):
+                key, _, value = stripped.partition("=")
+                if key.strip() == "url":
+                    return value.strip()
+        return None
+
+    def set_remote(self, url: str, name: str = "origin") -> tuple[bool, str]:
+        current = self.remote_url(name)
+        if current == url:
+            return True, ""
+        args = ["remote", "set-url", name, url] if current is not None else ["remote", "add", name, url]
+        rc, out = self.run(args)
+        return rc == 0, out
+
+    def commit_all(self, message: str) -> dict:
+        rc, out = self.run(["add", "-A"])
+        if rc != 0:
+            return {"ok": False, "error": out}
+        rc, out = self.run(["commit", "-q", "-m", message])
+        if rc != 0:
+            if "nothing to commit" in out.lower() or "nothing added to commit" in out.lower():
+                return {"ok": True, "committed": False, "message": out}
+            return {"ok": False, "error": out}
+        return {"ok": True, "committed": True, "commit": self.head()}
+
+    def push(self, remote: str, branch: str, token: str = "") -> dict:
+        """Push HEAD to `remote`/`branch` and report pack size and throughput."""
+        config = {}
+        if token:
+            basic = base64.b64encode(f"x-access-token:{token}".encode("utf-8")).decode("ascii")
+            config["http.https://github.com/.extraheader"] = f"AUTHORIZATION: basic {basic}"
+        started = time.monotonic()
+        rc, out = self.run(["push", "--progress", "-u", remote, f"HEAD:refs/heads/{branch}"], config=config)
+        elapsed = time.monotonic() - started
+        if token:
+            out = out.replace(token, "***")
+        pushed = 0
+        match = _WRITING_RE.search(out)
+        if match:
+            pushed = int(float(match.group(1)) * _UNITS[match.group(2)])
+        return {
+            "ok": rc == 0,
+            "output": out,
+            "pushed_bytes": pushed,
+            "elapsed_s": round(elapsed, 3),
+            "bytes_per_s": int(pushed / elapsed) if elapsed > 0 and pushed else 0,
+        }
+
+
+def sync_tree(src: Path, dst: Path) -> dict:
+    """Mirror `src` into `dst`, copying only new or changed files.
+
+    Files are compared by size and mtime (copy2 preserves mtime), so unchanged
+    assets are left alone and git's stat cache stays valid for them.
+    """
+    copied = 0
+    removed = 0
+    seen: set[Path] = set()
+    dst.mkdir(parents=True, exist_ok=True)
+    for p in src.rglob("*"):
+        rel = p.relative_to(src)
+        out = dst / rel
+        if p.is_dir():
+            out.mkdir(parents=True, exist_ok=True)
+            seen.add(rel)
+            continue
+        seen.add(rel)
+        st = p.stat()
+        try:
+            ost = out.stat()
+            if ost.st_size == st.st_size and ost.st_mtime_ns == st.st_mtime_ns:
+                continue
+        except FileNotFoundError:
+            pass
+        out.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(p, out)
+        copied += 1
+    for p in sorted(dst.rglob("*"), reverse=True):
+        rel = p.relative_to(dst)
+        if rel in seen:
+            continue
+        if p.is_dir():
+            shutil.rmtree(p, ignore_errors=True)
+        else:
+            p.unlink(missing_ok=True)
+        removed += 1
+    return {"copied": copied, "removed": removed}
@@ -0,0 +1,229 @@
+"""Static story page rendering.
+
+Story bundles are rendered from a precompiled `string.Template` into one or
+more gallery pages. Pages are anchored to fixed chronological blocks of
+assets, numbered from the oldest: block N is `index-N.html` and the newest,
+possibly partial, block is `index.html`. A page's file name, number and
+content therefore never depend on how many pages follow it, so ingesting new
+files only changes `index.html`. Starting a new block also writes the block
+it replaced and updates the "Newer" link of the page before it. Each page
+carries a content hash and is skipped when the hash matches the previous
+build. Files are written atomically.
+"""
+from pathlib import Path
+from html import escape
+from string import Template
+import hashlib
+import json
+import os
+import tempfile
+
+# Bump when the markup changes so existing bundles are re-rendered.
+TEMPLATE_VERSION = "4"
+
+PAGE_TEMPLATE = Template("""<!doctype html>
+<html lang="en">
+<head>
+  <meta charset="utf-8" />
+  <meta name="viewport" content="width=device-width, initial-scale=1" />
+  <title>$title</title>
+  <style>
+    :root { --bg:#f2efe9; --fg:#151515; --accent:#005f73; --card:#ffffff; }
+    body { margin:0; font-family: ui-serif, Georgia, 'Times New Roman', serif; background: radial-gradient(circle at 20% 10%, #fff, var(--bg)); color:var(--fg); }
+    main { max-width: 980px; margin: 0 auto; padding: 2rem 1rem 3rem; }
+    h1 { font-size: clamp(2rem, 5vw, 3.2rem); margin: 0 0 .4rem; letter-spacing: .01em; }
+    .meta { display:flex; flex-wrap:wrap; gap:.5rem; margin-bottom: 1.25rem; }
+    .chip { background: var(--card); border:1px solid #ddd; border-radius:999px; padding:.25rem .65rem; font-size:.85rem; }
+    .grid { display:grid; grid-template-columns: repeat(auto-fit, minmax(260px, 1fr)); gap: 1rem; }
+    figure { margin:0; background:var(--card); border:1px solid #ddd; border-radius:14px; overflow:hidden; }
+    img,video { display:block; width:100%; height:auto; background:#000; }
+    figcaption { padding:.6rem .75rem; font-size:.85rem; color:#444; }
+    nav.pages { display:flex; gap:1rem; justify-content:center; margin:1.5rem 0 0; font-size:.95rem; }
+    a { color: var(--accent); }
+  </style>
+</head>
+<body>
+  <main>
+    <h1>$title</h1>
+    <div class="meta">$chips</div>
+    $notes
+    <section class="grid">
+      $gallery
+    </section>
+    $nav
+  </main>
+</body>
+</html>
+""")
+
+IMAGE_TEMPLATE = Template("<figure><a href='$href'><img src='$src'$attrs alt='$name' loading='lazy' decoding='async'/></a><figcaption>$name</figcaption></figure>")
+VIDEO_TEMPLATE = Template("<figure><video src='$src'$attrs controls preload='$preload'></video><figcaption>$name</figcaption></figure>")
+# Gallery tiles are at most ~320px wide on desktop, full width on phones.
+IMAGE_SIZES = "(max-width: 600px) 100vw, 320px"
+LINK_TEMPLATE = Template("<p><a href='$src'>$name</a></p>")
+
+
+def page_filename(block: int, blocks: int) -> str:
+    """File for chronological `block` (1 = oldest) out of `blocks`; the newest is `index.html`."""
+    return "index.html" if block >= blocks else f"index-{block}.html"
+
+
+def atomic_write_text(path: Path, text: str) -> None:
+    """Write text to a temp file next to `path` and rename it into place."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=str(path.parent))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            fh.write(text)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def paginate_assets(assets: list[dict], page_size: int) -> list[list[dict]]:
+    """Split newest-first assets into chronological blocks, oldest block first.
+
+    Blocks are cut from the oldest asset forward, so block N keeps the same
+    content once it is full; each block lists its assets newest first.
+    """
+    page_size = max(1, int(page_size))
+    oldest_first = list(reversed(assets))
+    blocks = [oldest_first[i:i + page_size] for i in range(0, len(oldest_first), page_size)]
+    return [list(reversed(block)) for block in blocks] or [[]]
+
+
+def _size_attrs(asset: dict) -> str:
+    width, height = asset.get("width"), asset.get("height")
+    if isinstance(width, int) and isinstance(height, int) and width > 0 and height > 0:
+        return f" width='{width}' height='{height}'"
+    return ""
+
+
+def render_asset(asset: dict) -> str:
+    """Render one gallery tile; uses `srcset`/`poster`/`width`/`height` when present."""
+    src = escape(str(asset.get("path", "")))
+    mime = str(asset.get("mime_type") or "")
+    name = escape(str(asset.get("filename", asset.get("path", ""))))
+    attrs = _size_attrs(asset)
+    if mime.startswith("image/"):
+        srcset = [(str(rel), int(w)) for rel, w in asset.get("srcset") or []]
+        img_src = src
+        if srcset:
+            # Default to the largest variant that still fits a gallery tile.
+            fitting = [rel for rel, w in srcset if w <= 640] or [srcset[0][0]]
+            img_src = escape(fitting[-1])
+            candidates = [f"{rel} {w}w" for rel, w in srcset]
+            if isinstance(asset.get("width"), int):
+                candidates.append(f"{asset.get('path')} {asset['width']}w")
+            attrs += f" srcset='{escape(', '.join(candidates))}' sizes='{IMAGE_SIZES}'"
+        return IMAGE_TEMPLATE.substitute(href=src, src=img_src, attrs=attrs, name=name)
+    if mime.startswith("video/"):
+        preload = "metadata"
+        if asset.get("poster"):
+            attrs += f" poster='{escape(str(asset['poster']))}'"
+            preload = "none"
+        return VIDEO_TEMPLATE.substitute(src=src, attrs=attrs, preload=preload, name=name)
+    return LINK_TEMPLATE.substitute(src=src, name=name)
+
+
+def _nav_links(block: int, blocks: int) -> tuple[str | None, str | None]:
+    """(newer, older) page files linked from `block`."""
+    newer = page_filename(block + 1, blocks) if block < blocks else None
+    older = page_filename(block - 1, blocks) if block > 1 else None
+    return newer, older
+
+
+def _render_nav(block: int, newer: str | None, older: str | None) -> str:
+    if newer is None and older is None:
+        return ""
+    links = []
+    if newer:
+        links.append(f"<a href='{newer}'>&larr; Newer</a>")
+    links.append(f"<span>Page {block}</span>")
+    if older:
+        links.append(f"<a href='{older}'>Older &rarr;</a>")
+    return f"<nav class='pages'>{' '.join(links)}</nav>"
+
+
+def render_page(manifest: dict, assets: list[dict], block: int = 1, newer: str | None = None,
+                older: str | None = None, notes: str = "") -> str:
+    """Render one gallery page; `notes` are shown on the landing page (no `newer` link)."""
+    title = escape(str(manifest.get("title") or manifest.get("story_id") or "Story"))
+    chars = manifest.get("characters") or []
+    chips = " ".join(f"<span class='chip'>{escape(str(c))}</span>" for c in chars) or "<span class='chip'>No characters</span>"
+    gallery = "\n".join(render_asset(a) for a in assets) or "<p>No media assets yet.</p>"
+    notes_html = f"<section><h2>Notes</h2><p>{escape(notes)}</p></section>" if notes and newer is None else ""
+    return PAGE_TEMPLATE.substitute(
+        title=title,
+        chips=chips,
+        notes=notes_html,
+        gallery=gallery,
+        nav=_render_nav(block, newer, older),
+    )
+
+
+def _page_hash(manifest: dict, assets: list[dict], block: int, newer: str | None, older: str | None, notes: str) -> str:
+    payload = {
+        "template": TEMPLATE_VERSION,
+        "title": manifest.get("title"),
+        "story_id": manifest.get("story_id"),
+        "characters": manifest.get("characters") or [],
+        "notes": notes if newer is None else "",
+        "block": block,
+        "newer": newer,
+        "older": older,
+        "assets": [
+            [
+                a.get("path"), a.get("filename"), a.get("mime_type"), a.get("bytes"), a.get("mtime"),
+                a.get("width"), a.get("height"), a.get("srcset"), a.get("poster"),
+            ]
+            for a in assets
+        ],
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def write_story_pages(sdir: Path, manifest: dict, notes: str = "", page_size: int = 60, previous: dict | None = None) -> dict:
+    """Render the paginated gallery for a story bundle into `sdir`.
+
+    `previous` is the `render` state stored in story.json by the last build;
+    pages whose hash is unchanged (and whose file still exists) are skipped.
+    Returns the new render state plus written/skipped counts.
+    """
+    previous = previous if isinstance(previous, dict) else {}
+    old_hashes = previous.get("pages") if isinstance(previous.get("pages"), dict) else {}
+    blocks = paginate_assets(list(manifest.get("assets") or []), page_size)
+    hashes = {}
+    written = []
+    skipped = 0
+    # Newest first, so the landing page is written before the archive.
+    for block in range(len(blocks), 0, -1):
+        assets = blocks[block - 1]
+        fname = page_filename(block, len(blocks))
+        newer, older = _nav_links(block, len(blocks))
+        digest = _page_hash(manifest, assets, block, newer, older, notes)
+        hashes[fname] = digest
+        if old_hashes.get(fname) == digest and (sdir / fname).exists():
+            skipped += 1
+            continue
+        atomic_write_text(sdir / fname, render_page(manifest, assets, block, newer, older, notes=notes))
+        written.append(fname)
+
+    # Drop pages left over from a build that had more pages.
+    for fname in old_hashes:
+        if fname not in hashes and fname.startswith("index") and "/" not in fname:
+            try:
+                (sdir / fname).unlink()
+            except OSError:
+                pass
+
+    return {
+        "state": {"template": TEMPLATE_VERSION, "page_size": max(1, int(page_size)), "pages": hashes},
+        "pages": list(hashes),
+        "written": written,
+        "skipped": skipped,
+    }
@@ -0,0 +1,169 @@
+"""Responsive image variants and video poster frames for story pages.
+
+`build_story_page` calls `build_variants` before rendering so gallery tiles
+can point at downscaled copies (`srcset`) with explicit width/height instead
+of the full-resolution originals in `assets/`.
+
+Variants are written to `stories/<story_id>/_variants/` and indexed in
+`_variants/index.json`, keyed by each asset's path, size and mtime, so
+unchanged assets are skipped on rebuild. Image work needs Pillow and poster
+frames need an `ffmpeg` binary; when either is missing the affected assets are
+rendered from the originals as before. Pillow comes with the `images` extra;
+its absence is logged once at INFO.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import functools
+import hashlib
+import json
+import logging
+import shutil
+import subprocess
+
+from .story_pages import atomic_write_text
+
+LOG = logging.getLogger(__name__)
+VARIANTS_DIRNAME = "_variants"
+# Animated formats lose frames when resized through Pillow, so keep originals.
+_RESIZABLE_MIME = {"image/png", "image/jpeg", "image/webp", "image/bmp"}
+
+
+@functools.lru_cache(maxsize=1)
+def _pil():
+    try:
+        from PIL import Image
+    except ImportError:
+        LOG.info("Pillow not installed (pip install 'storyworld-mcp[images]'); story image variants are skipped")
+        return None
+    return Image
+
+
+def _asset_key(asset: dict) -> str:
+    raw = f"{asset.get('path')}|{asset.get('bytes')}|{asset.get('mtime')}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def _image_variants(sdir: Path, asset: dict, key: str, widths: list[int]) -> dict:
+    Image = _pil()
+    if Image is None:
+        return {}
+    src = sdir / str(asset.get("path"))
+    with Image.open(src) as im:
+        width, height = im.size
+        info = {"width": width, "height": height, "srcset": []}
+        if str(asset.get("mime_type")) not in _RESIZABLE_MIME:
+            return info
+        out_dir = sdir / VARIANTS_DIRNAME
+        out_dir.mkdir(parents=True, exist_ok=True)
+        for w in widths:
+            if w >= width:
+                continue
+            h = max(1, round(height * w / width))
+            rel = f"{VARIANTS_DIRNAME}/{key}-{w}.webp"
+            out = sdir / rel
+            if not out.exists():
+                resized = im.convert("RGBA" if im.mode in ("RGBA", "LA", "P") else "RGB").resize((w, h), Image.LANCZOS)
+                tmp = out.with_name(f".{out.name}.tmp")
+                resized.save(tmp, format="WEBP", quality=80)
+                tmp.replace(out)
+            info["srcset"].append([rel, w])
+    return info
+
+
+def _video_poster(sdir: Path, asset: dict, key: str, widths: list[int]) -> dict:
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        return {}
+    src = sdir / str(asset.get("path"))
+    rel = f"{VARIANTS_DIRNAME}/{key}-poster.jpg"
+    out = sdir / rel
+    if not out.exists():
+        out.parent.mkdir(parents=True, exist_ok=True)
+        tmp = out.with_name(f".{key}-poster.tmp.jpg")
+        scale = f"scale='min({max(widths)},iw)':-2" if widths else "scale=iw:ih"
+        proc = subprocess.run(
+            [ffmpeg, "-loglevel", "error", "-y", "-ss", "0.5", "-i", str(src), "-frames:v", "1", "-vf", scale, str(tmp)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            check=False,
+        )
+        if proc.returncode != 0 or not tmp.exists():
+            LOG.info("Poster extraction failed for %s: %s", src, (proc.stderr or b"").decode(errors="replace").strip())
+            return {}
+        tmp.replace(out)
+    info = {"poster": rel}
+    Image = _pil()
+    if Image is not None:
+        with Image.open(out) as im:
+            info["width"], info["height"] = im.size
+    return info
+
+
+def _build_one(sdir: Path, asset: dict, key: str, widths: list[int]) -> dict:
+    mime = str(asset.get("mime_type") or "")
+    try:
+        if mime.startswith("image/"):
+            return _image_variants(sdir, asset, key, widths)
+        if mime.startswith("video/"):
+            return _video_poster(sdir, asset, key, widths)
+    except Exception as ex:
+        LOG.warning("Variant build failed for %s: %s", asset.get("path"), ex)
+    return {}
+
+
+def build_variants(sdir: Path, assets: list[dict], widths: list[int], workers: int = 4) -> dict[str, dict]:
+    """Ensure variants exist for every asset; return `{asset_path: variant_info}`.
+
+    Assets whose key matches the cached index are not touched. New or changed
+    assets are processed in parallel on a thread pool (Pillow and ffmpeg do the
+    heavy lifting outside the GIL).
+    """
+    index_path = sdir / VARIANTS_DIRNAME / "index.json"
+    try:
+        cached = json.loads(index_path.read_text(encoding="utf-8"))
+        if not isinstance(cached, dict):
+            cached = {}
+    except Exception:
+        cached = {}
+
+    widths = sorted({int(w) for w in widths if int(w) > 0})
+    result: dict[str, dict] = {}
+    todo: list[tuple[dict, str]] = []
+    for asset in assets:
+        path = str(asset.get("path") or "")
+        key = _asset_key(asset)
+        hit = cached.get(path)
+        if isinstance(hit, dict) and hit.get("key") == key and hit.get("widths") == widths:
+            result[path] = hit
+        else:
+            todo.append((asset, key))
+
+    if todo:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            built = pool.map(lambda item: _build_one(sdir, item[0], item[1], widths), todo)
+            for (asset, key), info in zip(todo, built):
+                # Empty results (no Pillow/ffmpeg, unreadable file) are retried next build.
+                if info:
+                    result[str(asset.get("path") or "")] = {"key": key, "widths": widths, **info}
+
+    if result != cached:
+        # Prune by file, not asset key: a width dropped from `widths` leaves its
+        # `<key>-<w>.webp` behind even though the asset itself is still live.
+        live_files = {rel for info in result.values() for rel in _variant_files(info)}
+        for stale in cached.values():
+            if isinstance(stale, dict):
+                for rel in _variant_files(stale) - live_files:
+                    if str(rel).startswith(f"{VARIANTS_DIRNAME}/"):
+                        try:
+                            (sdir / rel).unlink()
+                        except OSError:
+                            pass
+        atomic_write_text(index_path, json.dumps(result, indent=2))
+    return result
+
+
+def _variant_files(info: dict) -> set[str]:
+    rels = {str(v[0]) for v in info.get("srcset") or [] if isinstance(v, (list, tuple)) and v}
+    if info.get("poster"):
+        rels.add(str(info["poster"]))
+    return rels
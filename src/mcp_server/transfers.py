@@ -0,0 +1,277 @@
+"""Resumable, streamed, checksum-verified downloads.
+
+`download(url, dest)` streams the response into `.<name>.part` next to
+`dest` and never holds the body in memory. Once all bytes have arrived, the
+part file is fsync'ed and its checksum is checked over the whole file, so
+resumed bytes are covered too. Only then is it atomically renamed over
+`dest`: readers see either no file or the complete file.
+
+An interrupted transfer keeps its `.part` file plus a small `.part.json`
+sidecar (URL, ETag/Last-Modified). The next attempt, whether a retry in the
+same call or a later call, asks for the remaining bytes with `Range` and
+`If-Range`. If the server ignores the range or the file changed upstream, the
+download restarts from zero.
+
+Checksums come from the caller (`checksum=("sha256", hex)` or
+`("git-sha1", blob_sha)` for GitHub contents) or from response headers
+(`X-Linked-Etag` on Hugging Face LFS files, `Digest: sha-256=`). Throughput is
+recorded in `metrics` (`bytes_downloaded`, stage `download`) and in `stats()`.
+"""
+from pathlib import Path
+import base64
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from . import metrics
+
+LOG = logging.getLogger(__name__)
+CHUNK_SIZE = 1024 * 1024
+_SHA256_HEX = re.compile(r"^[0-9a-f]{64}$")
+
+
+class DownloadError(RuntimeError):
+    """Raised when a download fails for good (HTTP error, checksum mismatch, retries exhausted)."""
+
+
+class _Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.values = {"downloads": 0, "resumed": 0, "restarted": 0, "failures": 0,
+                       "checksum_failures": 0, "bytes": 0, "seconds": 0.0}
+
+    def add(self, **deltas) -> None:
+        with self._lock:
+            for key, value in deltas.items():
+                self.values[key] += value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            out = dict(self.values)
+        out["seconds"] = round(out["seconds"], 3)
+        out["bytes_per_s"] = round(out["bytes"] / out["seconds"], 1) if out["seconds"] else 0.0
+        return out
+
+
+STATS = _Stats()
+
+
+def stats() -> dict:
+    return STATS.snapshot()
+
+
+def _new_hasher(algo: str, total_size: int | None):
+    if algo == "sha256":
+        return hashlib.sha256()
+    if algo == "git-sha1":
+        if total_size is None:
+            raise DownloadError("git-sha1 verification needs the file size")
+        hasher = hashlib.sha1()
+        hasher.update(f"blob {total_size}\0".encode("ascii"))
+        return hasher
+    raise DownloadError(f"unsupported checksum algorithm: {algo}")
+
+
+def file_checksum(path: Path, algo: str) -> str:
+    """Hex digest of a local file, computed like the download verification (`sha256` or `git-sha1`)."""
+    path = Path(path)
+    hasher = _new_hasher(algo, path.stat().st_size)
+    with path.open("rb") as fh:
+        for chunk in iter(lambda: fh.read(CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _header_checksum(headers) -> tuple[str, str] | None:
+    linked = (headers.get("X-Linked-Etag") or "").strip('"').lower()
+    if _SHA256_HEX.match(linked):
+        return ("sha256", linked)
+    for name in ("Repr-Digest", "Digest"):
+        for part in (headers.get(name) or "").split(","):
+            key, _, value = part.strip().partition("=")
+            if key.lower() == "sha-256" and value:
+                try:
+                    return ("sha256", base64.b64decode(value.strip(":")).hex())
+                except ValueError:
+                    continue
+    return None
+
+
+def _validator(headers) -> str:
+    return headers.get("ETag") or headers.get("Last-Modified") or ""
+
+
+def _part_paths(dest: Path) -> tuple[Path, Path]:
+    part = dest.with_name(f".{dest.name}.part")
+    return part, part.with_name(part.name + ".json")
+
+
+def download(
+    url: str,
+    dest: Path,
+    *,
+    headers: dict | None = None,
+    checksum: tuple[str, str] | None = None,
+    size: int | None = None,
+    timeout: float = 30,
+    retries: int = 3,
+    backoff: float = 0.5,
+    session=None,
+) -> dict:
+    """Download `url` to `dest` (resuming a previous `.part`); return transfer stats."""
+    import requests
+
+    dest = Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    part, sidecar = _part_paths(dest)
+    http = session or requests
+    started = time.perf_counter()
+    resumed_from = 0
+    fetched = 0
+    last_error: Exception | None = None
+
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(backoff * (2 ** (attempt - 1)))
+        offset, validator, saved_checksum = _resume_point(url, part, sidecar)
+        req_headers = dict(headers or {})
+        if offset:
+            req_headers["Range"] = f"bytes={offset}-"
+            if validator:
+                req_headers["If-Range"] = validator
+        metrics.incr("network_calls")
+        try:
+            with http.get(url, headers=req_headers, stream=True, timeout=timeout) as resp:
+                if resp.status_code == 416 and offset:
+                    # Nothing left to send: the part file is already complete (verified below).
+                    total = offset
+                    append = True
+                elif resp.status_code == 206 and offset and _range_start(resp.headers) == offset:
+                    total = _range_total(resp.headers)
+                    append = True
+                elif resp.status_code == 206 and offset:
+                    # The range does not continue our part file: drop it and start over.
+                    _discard(part, sidecar)
+                    STATS.add(restarted=1)
+                    last_error = DownloadError(f"range starts at {_range_start(resp.headers)}, not {offset}")
+                    LOG.info("Restarting download of %s: %s", url, last_error)
+                    continue
+                elif resp.status_code == 200:
+                    total = int(resp.headers["Content-Length"]) if resp.headers.get("Content-Length") else None
+                    append = False
+                else:
+                    resp.raise_for_status()
+                    raise DownloadError(f"unexpected HTTP {resp.status_code} for {url}")
+                if offset and not append:
+                    STATS.add(restarted=1)
+                if append and offset:
+                    resumed_from = resumed_from or offset
+                    STATS.add(resumed=1)
+                else:
+                    offset = 0
+                expected = checksum or _header_checksum(resp.headers) or (saved_checksum if offset else None)
+                _write_sidecar(sidecar, url, _validator(resp.headers), expected)
+                with part.open("ab" if append else "wb") as fh:
+                    if resp.status_code != 416:
+                        with metrics.stage("download"):
+                            for chunk in resp.iter_content(CHUNK_SIZE):
+                                if chunk:
+                                    fh.write(chunk)
+                                    fetched += len(chunk)
+                    fh.flush()
+                    os.fsync(fh.fileno())
+        except DownloadError:
+            STATS.add(failures=1)
+            raise
+        except requests.HTTPError as ex:
+            status = ex.response.status_code if ex.response is not None else 0
+            if status >= 500 or status == 429:
+                last_error = ex
+                continue
+            STATS.add(failures=1)
+            raise DownloadError(f"download failed for {url}: {ex}") from ex
+        except (requests.RequestException, OSError) as ex:
+            last_error = ex
+            LOG.info("Download of %s interrupted (attempt %s): %s", url, attempt + 1, ex)
+            continue
+
+        got = part.stat().st_size
+        total = size if size is not None else total
+        if total is not None and got < total:
+            last_error = DownloadError(f"short read: {got} of {total} bytes")
+            continue
+        if total is not None and got > total:
+            _discard(part, sidecar)
+            last_error = DownloadError(f"too many bytes: {got} > {total}")
+            continue
+        digest = _verify(part, expected, got)
+        os.replace(part, dest)
+        sidecar.unlink(missing_ok=True)
+        elapsed = time.perf_counter() - started
+        metrics.incr("bytes_downloaded", fetched)
+        STATS.add(downloads=1, bytes=fetched, seconds=elapsed)
+        return {
+            "path": str(dest),
+            "bytes": got,
+            "fetched_bytes": fetched,
+            "resumed_from": resumed_from,
+            "checksum": digest,
+            "elapsed_s": round(elapsed, 3),
+            "bytes_per_s": round(fetched / elapsed, 1) if elapsed > 0 else 0.0,
+        }
+
+    STATS.add(failures=1)
+    raise DownloadError(f"download of {url} failed after {retries + 1} attempts: {last_error}")
+
+
+def _resume_point(url: str, part: Path, sidecar: Path) -> tuple[int, str, tuple[str, str] | None]:
+    try:
+        meta = json.loads(sidecar.read_text(encoding="utf-8"))
+        offset = part.stat().st_size
+    except (OSError, ValueError):
+        return 0, "", None
+    if meta.get("url") != url:
+        return 0, "", None
+    saved = meta.get("checksum")
+    return offset, meta.get("validator") or "", tuple(saved) if saved else None
+
+
+def _write_sidecar(sidecar: Path, url: str, validator: str, expected) -> None:
+    sidecar.write_text(json.dumps({"url": url, "validator": validator, "checksum": expected}), encoding="utf-8")
+
+
+def _range_start(headers) -> int | None:
+    match = re.match(r"bytes (\d+)-\d+/(\d+|\*)", headers.get("Content-Range", ""))
+    return int(match.group(1)) if match else None
+
+
+def _range_total(headers) -> int | None:
+    match = re.match(r"bytes \d+-\d+/(\d+)", headers.get("Content-Range", ""))
+    return int(match.group(1)) if match else None
+
+
+def _verify(part: Path, expected: tuple[str, str] | None, size: int) -> str | None:
+    """Hash the finished part file; the whole file is re-read so resumed bytes are covered."""
+    if expected is None:
+        return None
+    algo, want = expected
+    hasher = _new_hasher(algo, size)
+    with part.open("rb") as fh:
+        for chunk in iter(lambda: fh.read(CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    got = hasher.hexdigest()
+    if got != want.lower():
+        _discard(part, part.with_name(part.name + ".json"))
+        STATS.add(checksum_failures=1, failures=1)
+        metrics.incr("download_checksum_failures")
+        raise DownloadError(f"{algo} mismatch for {part.name[1:-5]}: expected {want}, got {got}")
+    return f"{algo}:{got}"
+
+
+def _discard(part: Path, sidecar: Path) -> None:
+    part.unlink(missing_ok=True)
+    sidecar.unlink(missing_ok=True)
@@ -0,0 +1,12 @@
+import pytest
+
+from mcp_server import config
+
+
+@pytest.fixture(autouse=True)
+def _isolated_workspace(tmp_path, monkeypatch):
+    """Keep caches, lock files and public image copies out of the repo's workspace/."""
+    workspace = tmp_path / "_workspace"
+    monkeypatch.setattr(config, "WORKSPACE_DIR", workspace)
+    monkeypatch.setattr(config, "CHARACTERS_DIR", workspace / "characters")
+    monkeypatch.setenv("PUBLIC_IMAGES_DIR", str(workspace / "characters" / "public_images"))
@@ -1,4 +1,10 @@
 import asyncio
+import json
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
 
 from mcp_server import config, mcp_app
 
@@ -147,6 +153,40 @@ def test_story_repo_push_requires_token(tmp_path):
     assert "required" in res["error"].lower()
 
 
+def test_story_repo_remotes_are_restricted(tmp_path, monkeypatch):
+    config.STORIES_DIR = tmp_path / "stories"
+    config.STORY_REPOS_DIR = tmp_path / "story-repos"
+    config.STORY_GITHUB_REPO = ""
+    monkeypatch.setattr(config, "GITHUB_TOKEN", "secret-token")
+    monkeypatch.setattr(config, "STORY_GIT_ALLOW_LOCAL", False)
+    monkeypatch.setattr(config, "STORY_GIT_REMOTE_PREFIX", ["my-class/"])
+
+    for target in (str(tmp_path / "remote.git"), "https://evil.example/x.git", "other/repo", "my-class/../x"):
+        res = mcp_app.push_story_repo("guarded", github_repo=target)
+        assert res["ok"] is False and "error" in res, target
+    # An owner-only prefix matches that owner exactly, not longer owner names.
+    assert mcp_app.story_git.remote_error("my-class-evil/x", ["my-class"], False)
+    assert mcp_app.story_git.remote_error("my-class/x", ["my-class"], False) is None
+    monkeypatch.setattr(config, "STORY_GIT_REMOTE_PREFIX", ["my-class"])
+    assert mcp_app.push_story_repo("guarded", github_repo="my-class-evil/x")["ok"] is False
+    monkeypatch.setattr(config, "STORY_GIT_REMOTE_PREFIX", ["my-class/"])
+    init = mcp_app.init_story_repo("guarded", github_repo="file:///tmp/x")
+    assert init["ok"] is False and "STORY_GIT_ALLOW_LOCAL" in init["error"]
+
+    seen = {}
+
+    def fake_run(cmd, **kwargs):
+        seen["cmd"], seen["env"] = cmd, kwargs.get("env") or {}
+        return subprocess.CompletedProcess(cmd, 0, stdout="")
+
+    monkeypatch.setattr(mcp_app.story_git.subprocess, "run", fake_run)
+    assert mcp_app.push_story_repo("guarded", github_repo="my-class/story")["ok"] is True
+    assert not any("secret-token" in part or "AUTHORIZATION" in part for part in seen["cmd"])
+    env = seen["env"]
+    count = int(env["GIT_CONFIG_COUNT"])
+    assert env[f"GIT_CONFIG_KEY_{count - 1}"] == "http.https://github.com/.extraheader"
+
+
 def test_load_yaml_fetches_on_demand(tmp_path):
     config.CHARACTERS_DESC_DIR = tmp_path / "descriptions"
     config.CHARACTERS_DESC_DIR.mkdir(parents=True, exist_ok=True)
@@ -167,3 +207,905 @@ def test_load_yaml_fetches_on_demand(tmp_path):
         mcp_app._download_yaml_for_code = original
 
     assert data["name"] == "Athena"
+
+
+def test_story_manifest_tracks_assets_incrementally(tmp_path):
+    config.CHARACTERS_IMAGE_DIR = tmp_path / "images"
+    config.COMFY_OUTPUT_DIR = tmp_path / "comfy-output"
+    config.COMFY_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    config.STORIES_DIR = tmp_path / "stories"
+
+    (config.COMFY_OUTPUT_DIR / "frame_a.png").write_bytes(b"png")
+    mcp_app.ingest_comfy_outputs("6166r", story_id="incr", limit=10)
+    story_json = config.STORIES_DIR / "incr" / "story.json"
+    indexed = json.loads(story_json.read_text(encoding="utf-8"))["assets"]
+    assert [a["bytes"] for a in indexed] == [3]
+
+    (config.COMFY_OUTPUT_DIR / "frame_b.png").write_bytes(b"png-b")
+    mcp_app.ingest_comfy_outputs("6166r", story_id="incr", limit=1)
+    assert len(mcp_app._story_manifest("incr")["assets"]) == 2
+
+    # Files dropped in by hand are only picked up on an explicit rescan.
+    (config.STORIES_DIR / "incr" / "assets" / "manual.png").write_bytes(b"x")
+    assert mcp_app.build_story_page("incr")["assets_count"] == 2
+    assert mcp_app.build_story_page("incr", rescan=True)["assets_count"] == 3
+
+
+def test_list_stories_reads_catalog_with_pagination(tmp_path):
+    config.STORIES_DIR = tmp_path / "stories"
+    config.STORY_REPOS_DIR = config.STORIES_DIR / "repos"
+    config.STORY_REPOS_DIR.mkdir(parents=True, exist_ok=True)
+
+    for sid in ("alpha", "beta", "gamma"):
+        mcp_app.build_story_page(sid, title=sid.title(), character_codes=["6166r"])
+    assert (config.STORIES_DIR / ".catalog.json").exists()
+
+    first = mcp_app.list_stories(limit=2)
+    assert first["count"] == 3
+    assert [s["story_id"] for s in first["stories"]] == ["alpha", "beta"]
+    assert first["next_offset"] == 2
+    rest = mcp_app.list_stories(offset=2, limit=2)
+    assert [s["title"] for s in rest["stories"]] == ["Gamma"]
+    assert rest["next_offset"] is None
+
+    (config.STORIES_DIR / ".catalog.json").unlink()
+    rebuilt = mcp_app.list_stories()
+    assert rebuilt["count"] == 3
+    assert rebuilt["stories"][0]["characters"] == ["6166r"]
+    assert not (config.STORIES_DIR / "repos" / "story.json").exists()
+
+
+def test_build_story_page_paginates_and_skips_unchanged(tmp_path):
+    config.STORIES_DIR = tmp_path / "stories"
+    assets_dir = config.STORIES_DIR / "paged" / "assets" / "6166r"
+    assets_dir.mkdir(parents=True)
+    for i in range(5):
+        (assets_dir / f"frame_{i}.png").write_bytes(b"png")
+    original_page_size = config.STORY_PAGE_SIZE
+    config.STORY_PAGE_SIZE = 2
+    try:
+        first = mcp_app.build_story_page("paged", title="Paged", rescan=True)
+        assert first["pages"] == ["index.html", "index-2.html", "index-1.html"]
+        assert first["pages_written"] == 3
+        assert "index-2.html" in (config.STORIES_DIR / "paged" / "index.html").read_text(encoding="utf-8")
+
+        again = mcp_app.build_story_page("paged")
+        assert again["pages_written"] == 0
+        assert again["pages_skipped"] == 3
+
+        noted = mcp_app.build_story_page("paged", notes="new notes")
+        assert noted["pages_written"] == 1
+
+        # Growing the newest block rewrites only the landing page...
+        (assets_dir / "frame_5.png").write_bytes(b"png")
+        grown = mcp_app.build_story_page("paged", notes="new notes", rescan=True)
+        assert grown["pages_written"] == 1
+        # ...and starting a new block touches the new page and its neighbour, not the archive.
+        (assets_dir / "frame_6.png").write_bytes(b"png")
+        split = mcp_app.build_story_page("paged", notes="new notes", rescan=True)
+        assert split["pages"] == ["index.html", "index-3.html", "index-2.html", "index-1.html"]
+        assert split["pages_written"] == 3 and split["pages_skipped"] == 1
+    finally:
+        config.STORY_PAGE_SIZE = original_page_size
+
+
+def test_build_story_page_emits_responsive_variants(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    config.STORIES_DIR = tmp_path / "stories"
+    assets_dir = config.STORIES_DIR / "variants" / "assets" / "6166r"
+    assets_dir.mkdir(parents=True)
+    Image.new("RGB", (800, 400), "teal").save(assets_dir / "wide.png")
+
+    mcp_app.build_story_page("variants", rescan=True)
+    sdir = config.STORIES_DIR / "variants"
+    html = (sdir / "index.html").read_text(encoding="utf-8")
+    assert "width='800' height='400'" in html
+    assert "320w" in html and "640w" in html
+    index = json.loads((sdir / "_variants" / "index.json").read_text(encoding="utf-8"))
+    smallest = index["assets/6166r/wide.png"]["srcset"][0][0]
+    with Image.open(sdir / smallest) as im:
+        assert im.size == (320, 160)
+
+    again = mcp_app.build_story_page("variants")
+    assert again["pages_written"] == 0
+
+    # Dropping a width removes its files even though the asset is unchanged.
+    wide = sdir / "assets" / "6166r" / "wide.png"
+    assets = [{"path": "assets/6166r/wide.png", "mime_type": "image/png", "bytes": wide.stat().st_size, "mtime": 1}]
+    mcp_app.story_variants.build_variants(sdir, assets, [320, 640])
+    mcp_app.story_variants.build_variants(sdir, assets, [320])
+    assert sorted(p.name.rsplit("-", 1)[1] for p in (sdir / "_variants").glob("*.webp")) == ["320.webp"]
+
+
+def test_story_repo_push_to_local_bare_repo(tmp_path, monkeypatch):
+    config.STORIES_DIR = tmp_path / "stories"
+    config.STORY_REPOS_DIR = tmp_path / "story-repos"
+    config.GITHUB_TOKEN = ""
+    monkeypatch.setattr(config, "STORY_GIT_ALLOW_LOCAL", True)
+    bare = tmp_path / "remote.git"
+    subprocess.run(["git", "init", "-q", "--bare", str(bare)], check=True)
+
+    mcp_app.build_story_page("push-demo", title="Push Demo")
+    first = mcp_app.commit_story_repo("push-demo", message="first")
+    assert first["committed"] is True
+    again = mcp_app.commit_story_repo("push-demo", message="noop")
+    assert again["committed"] is False
+    assert again["files_copied"] == 0
+
+    pushed = mcp_app.push_story_repo("push-demo", github_repo=str(bare))
+    assert pushed["ok"] is True, pushed
+    assert pushed["commit"] == first["commit"]
+    remote_head = subprocess.run(
+        ["git", "--git-dir", str(bare), "rev-parse", "refs/heads/main"],
+        capture_output=True, text=True, check=True,
+    ).stdout.strip()
+    assert remote_head == first["commit"]
+
+
+def test_concurrent_ingests_into_one_story_keep_every_asset(tmp_path):
+    config.CHARACTERS_IMAGE_DIR = tmp_path / "images"
+    config.COMFY_OUTPUT_DIR = tmp_path / "comfy-output"
+    config.COMFY_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    config.STORIES_DIR = tmp_path / "stories"
+    for i in range(3):
+        (config.COMFY_OUTPUT_DIR / f"frame_{i}.png").write_bytes(b"png")
+
+    codes = [f"c{i:02d}" for i in range(8)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda code: mcp_app.ingest_comfy_outputs(code, story_id="shared", limit=3), codes))
+        list(pool.map(lambda i: mcp_app.build_story_page("shared", notes=f"pass {i}"), range(4)))
+
+    manifest = json.loads((config.STORIES_DIR / "shared" / "story.json").read_text(encoding="utf-8"))
+    assert len(manifest["assets"]) == 3 * len(codes)
+    assert mcp_app.list_stories()["stories"][0]["assets_count"] == 3 * len(codes)
+    assert not list((config.STORIES_DIR / "shared").glob(".*.tmp"))
+
+
+def test_server_metrics_track_tool_stages(tmp_path):
+    from fastmcp import Client
+
+    config.CHARACTERS_DESC_DIR = tmp_path / "descriptions"
+    config.CHARACTERS_DESC_DIR.mkdir(parents=True)
+    # Non-ASCII, so characters and bytes differ.
+    (config.CHARACTERS_DESC_DIR / "0000g.yaml").write_text("name: Zoë 🌊\n", encoding="utf-8")
+    mcp_app.metrics.METRICS.reset()
+
+    async def _run():
+        async with Client(mcp_app.mcp) as client:
+            await client.call_tool("list_characters", {})
+            result = await client.call_tool("get_server_metrics", {})
+            return result.data
+
+    snapshot = asyncio.run(_run())
+    assert snapshot["operations"]["tool:list_characters"]["count"] == 1
+    assert snapshot["stages"]["tool:list_characters"]["yaml_parse"]["count"] == 1
+    assert snapshot["counters"]["tool:list_characters"]["bytes_read"] == (config.CHARACTERS_DESC_DIR / "0000g.yaml").stat().st_size
+
+    text = mcp_app.metrics.METRICS.prometheus_text()
+    assert 'storyworld_duration_seconds_count{name="request",op="tool:list_characters"} 1' in text
+
+
+def test_profiling_captures_forced_and_slow_calls(tmp_path, monkeypatch):
+    from fastmcp import Client
+    import time
+
+    monkeypatch.setattr(config, "WORKSPACE_DIR", tmp_path)
+    config.CHARACTERS_DESC_DIR = tmp_path / "descriptions"
+    config.CHARACTERS_DESC_DIR.mkdir(parents=True)
+    (config.CHARACTERS_DESC_DIR / "0000p.yaml").write_text("name: Pat\n", encoding="utf-8")
+    real_parse = mcp_app._parse_character_text
+
+    def slow_parse(text):
+        time.sleep(0.1)
+        return real_parse(text)
+
+    monkeypatch.setattr(mcp_app, "_parse_character_text", slow_parse)
+    # A fresh cache per lookup: every call parses (slowly) again.
+    monkeypatch.setattr(mcp_app.shared_cache, "get_cache", lambda: mcp_app.shared_cache.MemoryCache())
+    monkeypatch.setattr(mcp_app.profiling, "STATE", mcp_app.profiling.ProfilerState())
+
+    async def _run():
+        async with Client(mcp_app.mcp) as client:
+            await client.call_tool("list_characters", {})
+            armed = (await client.call_tool("configure_profiling", {"profile_next": "list_characters"})).data
+            await client.call_tool("list_characters", {})
+            await client.call_tool("list_characters", {})
+            listing = (await client.call_tool("list_profiles", {})).data
+            profile = (await client.call_tool("get_profile", {"profile_id": listing["profiles"][0]["id"]})).data
+            return armed, listing, profile
+
+    armed, listing, profile = asyncio.run(_run())
+    assert armed["armed"] == {"list_characters": 1}
+    # Only the armed call is saved: profiling is off and the rest are not forced.
+    assert listing["count"] == 1
+    assert profile["operation"] == "list_characters" and profile["forced"] is True
+    assert profile["duration_ms"] >= 100
+    assert profile["samples"] > 0
+    assert any("slow_parse" in row["function"] for row in profile["top"])
+    assert all(line.startswith("list_characters ") for line in profile["collapsed"])
+    assert (tmp_path / ".profiles" / f"{profile['id']}.json").exists()
+
+
+def test_profile_write_failure_never_fails_the_call(monkeypatch):
+    from mcp_server import profiling
+
+    def broken_write(*_args):
+        raise RuntimeError("dictionary changed size during iteration")
+
+    monkeypatch.setattr(profiling, "_write_profile", broken_write)
+    monkeypatch.setattr(profiling.STATE, "threshold_ms", 0.0)
+
+    async def call():
+        await asyncio.sleep(0.02)
+        return "result"
+
+    assert asyncio.run(profiling._profiled("tool", {}, None, call)) == "result"
+    cap = profiling._Capture(None)
+    profiling._SAMPLER.add(cap)
+    time.sleep(0.05)
+    profiling._SAMPLER.remove(cap)
+    frozen = (dict(cap.stacks), cap.samples)
+    time.sleep(0.05)
+    # A removed capture is never written to again.
+    assert (dict(cap.stacks), cap.samples) == frozen
+
+
+def test_admin_tools_are_refused_over_http(monkeypatch):
+    from mcp_server import admission
+
+    monkeypatch.setattr(config, "ADMIN_TOOLS", "auto")
+    monkeypatch.setattr(admission, "ADMIN_ENABLED", True)
+    admission.configure_for_transport("http")
+    try:
+        for result in (
+            mcp_app.configure_profiling(enabled=True),
+            mcp_app.list_profiles(),
+            mcp_app.get_profile("x"),
+            mcp_app.get_server_metrics(reset=True),
+        ):
+            assert "STORYWORLD_ADMIN_TOOLS" in result["error"]
+        assert "error" not in mcp_app.get_server_metrics()
+    finally:
+        admission.configure_for_transport("stdio")
+    assert "error" not in mcp_app.list_profiles()
+    # Argument values stay out of saved profiles unless opted in.
+    assert mcp_app.profiling._short_args({"query": "private"}) == {"query": "<redacted>"}
+
+
+def test_image_pool_encodes_caches_and_sheds_load(tmp_path, monkeypatch):
+    import base64
+    import threading
+    import time
+
+    from mcp_server import media_pool
+
+    monkeypatch.setattr(config, "IMAGE_POOL_MIN_BYTES", 0)
+    monkeypatch.setattr(config, "IMAGE_POOL_WORKERS", 1)
+    monkeypatch.setattr(media_pool, "_pool", None)
+    monkeypatch.setenv("PUBLIC_IMAGES_DIR", str(tmp_path / "public"))
+    config.CHARACTERS_IMAGE_DIR = tmp_path / "images"
+    img_dir = config.CHARACTERS_IMAGE_DIR / "0000i"
+    img_dir.mkdir(parents=True)
+    payload = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 64
+    (img_dir / "1.png").write_bytes(payload)
+    mcp_app.metrics.METRICS.reset()
+    try:
+        first = mcp_app.list_character_images("0000i")
+        second = mcp_app.list_character_images("0000i")
+        assert first[0].data == second[0].data == base64.b64encode(payload).decode()
+        assert first[0].mimeType == "image/png"
+        counters = mcp_app.metrics.METRICS.snapshot()["counters"]["none"]
+        assert counters["cache_miss:image_b64"] == 1 and counters["cache_hit:image_b64"] == 1
+
+        # One slot, occupied by a slow job: the next submission is rejected after the queue timeout.
+        busy = media_pool.ImagePool(workers=1, max_pending=1, queue_timeout=0.05)
+        holder = threading.Thread(target=busy.run, args=(time.sleep, 1.0))
+        holder.start()
+        time.sleep(0.2)
+        with pytest.raises(media_pool.PoolBusyError):
+            busy.run(time.sleep, 0)
+        holder.join()
+        assert busy.rejected == 1
+        busy.shutdown()
+    finally:
+        if media_pool._pool is not None:
+            media_pool._pool.shutdown()
+
+
+def test_admission_control_rate_limits_expensive_tools(tmp_path, monkeypatch):
+    from fastmcp import Client
+    from fastmcp.exceptions import ToolError
+
+    from mcp_server import admission
+
+    config.STORIES_DIR = tmp_path / "stories"
+    config.COMFY_OUTPUT_DIR = tmp_path / "comfy"
+    config.COMFY_OUTPUT_DIR.mkdir(parents=True)
+    controller = admission.AdmissionController(
+        limits={"disk": {"rate": 0.001, "burst": 2, "concurrency": 4}}, enabled=True
+    )
+    monkeypatch.setattr(admission, "CONTROLLER", controller)
+
+    async def _run():
+        async with Client(mcp_app.mcp) as client:
+            for _ in range(2):
+                await client.call_tool("build_story_page", {"story_id": "limited"})
+            with pytest.raises(ToolError, match=r"retry after \d+(\.\d)?s"):
+                await client.call_tool("build_story_page", {"story_id": "limited"})
+            with pytest.raises(ToolError, match="too large"):
+                await client.call_tool("ingest_comfy_outputs", {"code": "0000a", "limit": 1000})
+            # Tools outside the admission classes are never limited.
+            await client.call_tool("list_stories", {})
+            return (await client.call_tool("get_runtime_capabilities", {})).data
+
+    caps = asyncio.run(_run())
+    disk = caps["admission"]["classes"]["disk"]
+    assert disk["admitted"] == 2 and disk["rejected_rate"] == 2 and disk["in_flight"] == 0
+
+
+def test_admission_charges_character_reads_that_fetch(tmp_path, monkeypatch):
+    from fastmcp import Client
+    from fastmcp.exceptions import ToolError
+    from mcp.shared.exceptions import McpError
+
+    from mcp_server import admission
+
+    config.CHARACTERS_DESC_DIR = tmp_path / "descriptions"
+    config.CHARACTERS_IMAGE_DIR = tmp_path / "images"
+    config.CHARACTERS_DESC_DIR.mkdir(parents=True)
+    (config.CHARACTERS_DESC_DIR / "0001a.yaml").write_text("name: Local\n", encoding="utf-8")
+    fetched = []
+    monkeypatch.setattr(mcp_app, "_download_images_for_code", lambda code: fetched.append(code) or 0)
+    controller = admission.AdmissionController(
+        limits={"network": {"rate": 0.001, "burst": 6, "concurrency": 2}}, enabled=True
+    )
+    monkeypatch.setattr(admission, "CONTROLLER", controller)
+
+    assert admission.classify("get_character_context", {"code": "0001a"}) == ("network", 3.0)
+    assert admission.classify("get_character_context", {"code": "9999z"}) == ("network", 4.0)
+    assert admission.classify("resource:character://{id}/profile", {"code": "0001a"}) == ("image", 1.0)
+
+    async def _run():
+        async with Client(mcp_app.mcp) as client:
+            # YAML is local but the images are not: each call pays for the HF fetch.
+            for _ in range(2):
+                await client.call_tool("get_character_context", {"code": "0001a"})
+            with pytest.raises(ToolError, match=r"retry after"):
+                await client.call_tool("get_character_context", {"code": "0001a"})
+            # Local reads stay in the (unlimited here) image class.
+            await client.read_resource("character://0001a/profile")
+            # A resource read that would fetch the YAML is charged as network.
+            with pytest.raises(McpError, match=r"retry after"):
+                await client.read_resource("character://9999z/profile")
+
+    asyncio.run(_run())
+    assert fetched == ["0001a", "0001a"]
+
+
+def test_admission_trusts_forwarded_for_only_from_proxies(monkeypatch):
+    from mcp_server import admission
+
+    monkeypatch.setattr(config, "TRUSTED_PROXIES", ["10.0.0.0/8"])
+    # Direct clients cannot choose their key with a spoofed header.
+    assert admission.forwarded_client("203.0.113.7", "1.2.3.4") == "203.0.113.7"
+    # Via the proxy: the rightmost untrusted hop, not the client-supplied leftmost one.
+    assert admission.forwarded_client("10.0.0.2", "1.2.3.4, 198.51.100.9, 10.0.0.5") == "198.51.100.9"
+    assert admission.forwarded_client("10.0.0.2", "") == "10.0.0.2"
+
+
+def test_comfy_watch_ingests_files_once_fully_written(tmp_path, monkeypatch):
+    from fastmcp import Client
+
+    out = tmp_path / "comfy-output"
+    (out / "batch").mkdir(parents=True)
+    (out / "old.png").write_bytes(b"old")
+    monkeypatch.setattr(config, "COMFY_OUTPUT_DIR", out)
+    monkeypatch.setattr(config, "CHARACTERS_IMAGE_DIR", tmp_path / "images")
+    monkeypatch.setattr(config, "STORIES_DIR", tmp_path / "stories")
+    monkeypatch.setattr(config, "COMFY_WATCH_INTERVAL", 0.05)
+    monkeypatch.setattr(config, "COMFY_WATCH_STABLE_S", 0.4)
+    events = []
+
+    async def on_log(message):
+        events.append(message.data)
+
+    async def _run():
+        async with Client(mcp_app.mcp, log_handler=on_log) as client:
+            status = (await client.call_tool("start_comfy_watch", {"code": "6166r", "story_id": "live"})).data
+            assert status["running"] and status["pending"] == []
+            target = out / "batch" / "ComfyUI_00001_.png"
+            with target.open("wb") as fh:
+                fh.write(b"a" * 1000)
+                fh.flush()
+                await asyncio.sleep(0.2)
+                pending = (await client.call_tool("get_comfy_watch_status", {})).data
+                fh.write(b"b" * 1000)
+            for _ in range(100):
+                if events:
+                    break
+                await asyncio.sleep(0.05)
+            final = (await client.call_tool("stop_comfy_watch", {})).data
+            return pending, final
+
+    try:
+        pending, final = asyncio.run(_run())
+    finally:
+        if mcp_app._comfy_watcher is not None:
+            mcp_app._comfy_watcher.stop()
+        mcp_app._comfy_watcher = None
+
+    assert pending["ingested"] == 0 and pending["pending"] == [str(out / "batch" / "ComfyUI_00001_.png")]
+    assert final["ingested"] == 1 and not final["running"]
+    assert events and events[0]["event"] == "comfy_outputs_ingested" and events[0]["story_id"] == "live"
+    ingested = list((tmp_path / "images" / "6166r").iterdir())
+    assert len(ingested) == 1 and ingested[0].stat().st_size == 2000
+    assert not any(p.name.endswith("old.png") for p in ingested)
+    manifest = json.loads((tmp_path / "stories" / "live" / "story.json").read_text(encoding="utf-8"))
+    assert len(manifest["assets"]) == 1
+
+
+def test_comfy_watch_refuses_retarget_and_gives_up_on_failing_files(tmp_path):
+    from mcp_server import comfy_watch
+
+    calls = []
+
+    def failing_ingest(paths, code, story_id, mode):
+        calls.append(paths)
+        raise OSError("disk full")
+
+    out = tmp_path / "comfy-output"
+    out.mkdir()
+    watcher = comfy_watch.ComfyWatcher(out, failing_ingest, (".png",), interval=60, stable_s=1.0, max_failures=2)
+    try:
+        assert watcher.start("0000a", "one") is True
+        assert watcher.start("0000a", "one") is True
+        assert watcher.start("0000b", "other") is False
+        assert watcher.status()["target"]["code"] == "0000a"
+
+        (out / "bad.png").write_bytes(b"x")
+        watcher.poll(now=0.0)
+        with pytest.raises(OSError):
+            watcher.poll(now=1.0)
+        # Backing off: the next tick does not retry at once.
+        assert watcher.poll(now=1.5) is None and len(calls) == 1
+        assert watcher.status()["retrying"] == {str(out / "bad.png"): 1}
+        with pytest.raises(OSError):
+            watcher.poll(now=200.0)
+        status = watcher.status()
+        assert status["pending"] == [] and status["retrying"] == {}
+        assert status["failed"] == [{"path": str(out / "bad.png"), "error": "disk full"}]
+        assert watcher.poll(now=1000.0) is None and len(calls) == 2
+    finally:
+        watcher.stop()
+
+
+def test_character_store_rebuilds_incrementally(tmp_path, monkeypatch):
+    desc_dir = tmp_path / "descriptions"
+    desc_dir.mkdir()
+    for i, name in enumerate(("Alice", "Bob", "Cleo")):
+        (desc_dir / f"000{i}g.yaml").write_text(f"name: {name}\nage: 2{i}\n", encoding="utf-8")
+    monkeypatch.setattr(config, "CHARACTERS_DESC_DIR", desc_dir)
+    monkeypatch.setattr(config, "CHARACTER_STORE", True)
+    monkeypatch.setattr(config, "CHARACTER_STORE_PATH", str(tmp_path / "characters.sqlite3"))
+    parsed = []
+    real_parse = mcp_app._parse_character_text
+
+    def counting_parse(text):
+        parsed.append(text)
+        return real_parse(text)
+
+    monkeypatch.setattr(mcp_app, "_parse_character_text", counting_parse)
+
+    assert mcp_app.list_characters()["count"] == 3
+    assert len(parsed) == 3
+    assert mcp_app.list_characters()["count"] == 3
+    assert mcp_app._load_yaml_for("0001g")["name"] == "Bob"
+    assert len(parsed) == 3  # served from the store: no reads, no parses
+
+    (desc_dir / "0001g.yaml").write_text("name: Robert\nage: 30\n", encoding="utf-8")
+    (desc_dir / "0002g.yaml").unlink()
+    listing = mcp_app.list_characters()
+    assert len(parsed) == 4
+    assert [c["name"] for c in listing["characters"]] == ["Alice", "Robert"]
+    assert json.loads(mcp_app.character_profile_resource("0001g").contents[0].content)["age"] == 30
+    assert len(parsed) == 4
+
+
+def test_workspace_snapshot_round_trip_keeps_indexes_warm(tmp_path, monkeypatch):
+    import sys
+    from pathlib import Path
+
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+    from scripts import synthetic_workspace
+    from mcp_server import snapshot
+
+    for name in ("WORKSPACE_DIR", "CHARACTERS_DIR", "CHARACTERS_DESC_DIR", "CHARACTERS_IMAGE_DIR",
+                 "COMFY_OUTPUT_DIR", "STORIES_DIR", "STORY_REPOS_DIR", "DISABLE_AUTO_DOWNLOAD"):
+        monkeypatch.setattr(config, name, getattr(config, name))
+    monkeypatch.setattr(config, "CHARACTER_STORE", True)
+    monkeypatch.setattr(config, "CHARACTER_STORE_PATH", "")
+    monkeypatch.setattr(config, "SHARED_CACHE_PATH", "")
+    monkeypatch.setenv("PUBLIC_IMAGES_DIR", str(tmp_path / "public"))
+
+    src = tmp_path / "src-ws"
+    synthetic_workspace.build_workspace(src, characters=5, images=2, comfy_outputs=0, stories=1, assets_per_story=2)
+    synthetic_workspace.point_config_at(src)
+    assert mcp_app.list_characters()["count"] == 5
+    archive = tmp_path / "ws.tar.gz"
+    manifest = snapshot.export_snapshot(archive)
+    assert manifest["file_count"] == 5 + 10 + 3 + 1  # yamls, images, story files, character store
+    assert all(len(f["sha256"]) == 64 for f in manifest["files"])
+
+    dst = tmp_path / "replica"
+    synthetic_workspace.point_config_at(dst)
+    summary = snapshot.import_snapshot(archive)
+    assert summary["files"] == manifest["file_count"]
+    parsed = []
+    monkeypatch.setattr(mcp_app, "_parse_character_text", lambda text: parsed.append(text) or {})
+    assert mcp_app.list_characters()["count"] == 5
+    assert mcp_app._load_yaml_for(mcp_app.list_characters()["characters"][0]["code"])["name"]
+    assert parsed == []  # served from the restored store, nothing re-parsed
+    assert (dst / "stories" / "story-000" / "story.json").is_file()
+
+    with pytest.raises(snapshot.SnapshotError):
+        snapshot.import_snapshot(archive)  # refuses to clobber a populated workspace
+    raw = bytearray((src / "characters" / "descriptions" / "0000a.yaml").read_bytes())
+    tampered = tmp_path / "tampered.tar"
+    snapshot.export_snapshot(tampered, include_stories=False, include_caches=False)
+    data = tampered.read_bytes()
+    tampered.write_bytes(data.replace(bytes(raw[:40]), bytes(raw[:39]) + b"X", 1))
+    replica2 = tmp_path / "replica2"
+    synthetic_workspace.point_config_at(replica2)
+    with pytest.raises(snapshot.SnapshotError, match="sha256"):
+        snapshot.import_snapshot(tampered)
+    # Verification happens before anything is moved into place.
+    assert not [p for p in replica2.rglob("*") if p.is_file()]
+
+    # An import interrupted while renaming is detected and redone without --force.
+    real_replace, calls = snapshot.os.replace, []
+
+    def failing_replace(src_path, dst_path):
+        calls.append(dst_path)
+        if len(calls) == 3:
+            raise OSError("disk full")
+        real_replace(src_path, dst_path)
+
+    synthetic_workspace.point_config_at(tmp_path / "replica3")
+    monkeypatch.setattr(snapshot.os, "replace", failing_replace)
+    with pytest.raises(OSError):
+        snapshot.import_snapshot(archive)
+    monkeypatch.setattr(snapshot.os, "replace", real_replace)
+    assert snapshot.import_incomplete()
+    assert snapshot.import_snapshot(archive)["files"] == manifest["file_count"]
+    assert not snapshot.import_incomplete()
+
+
+def _mp4_box(kind: bytes, body: bytes) -> bytes:
+    import struct
+
+    return struct.pack(">I", 8 + len(body)) + kind + body
+
+
+def _ebml(element_id: int, body: bytes, unknown_size: bool = False) -> bytes:
+    raw_id = element_id.to_bytes((element_id.bit_length() + 7) // 8, "big")
+    size = b"\x01\xff\xff\xff\xff\xff\xff\xff" if unknown_size else (0x80 | len(body)).to_bytes(1, "big")
+    return raw_id + size + body
+
+
+def _riff_webp(chunk: bytes, body: bytes) -> bytes:
+    import struct
+
+    payload = b"WEBP" + chunk + struct.pack("<I", len(body)) + body
+    return b"RIFF" + struct.pack("<I", len(payload)) + payload
+
+
+def _animated_gif(width: int, height: int, frames: int, delay_cs: int) -> bytes:
+    import struct
+
+    out = b"GIF89a" + struct.pack("<HHBBB", width, height, 0, 0, 0)
+    for _ in range(frames):
+        out += b"\x21\xf9\x04\x00" + struct.pack("<H", delay_cs) + b"\x00\x00"  # graphic control
+        out += b"\x2c" + struct.pack("<HHHHB", 0, 0, width, height, 0) + b"\x02\x02\x4c\x01\x00"
+    return out + b"\x3b"
+
+
+def test_media_manifests_carry_header_metadata(tmp_path, monkeypatch):
+    import hashlib
+    import struct
+    import sys
+    from pathlib import Path
+
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+    from scripts.synthetic_workspace import png_bytes
+
+    from mcp_server import media_meta
+
+    monkeypatch.setattr(config, "CHARACTERS_DIR", tmp_path / "characters")
+    monkeypatch.setenv("PUBLIC_IMAGES_DIR", str(tmp_path / "public_images"))
+    monkeypatch.setattr(config, "CHARACTERS_IMAGE_DIR", tmp_path / "images")
+    monkeypatch.setattr(config, "STORIES_DIR", tmp_path / "stories")
+    monkeypatch.setattr(config, "COMFY_OUTPUT_DIR", tmp_path / "comfy-output")
+    monkeypatch.setattr(config, "SHARED_CACHE", True)
+    monkeypatch.setattr(config, "SHARED_CACHE_PATH", str(tmp_path / "cache.sqlite3"))
+    folder = config.CHARACTERS_IMAGE_DIR / "6166r"
+    folder.mkdir(parents=True)
+    config.COMFY_OUTPUT_DIR.mkdir()
+
+    # Header-only fixtures: the parsers never look past the fields they need.
+    sizes = {"a.png": (64, 48), "b.jpg": (33, 17), "c.webp": (20, 10), "d.bmp": (7, 5)}
+    (folder / "a.png").write_bytes(png_bytes(64, 48, 1))
+    app0 = b"\xff\xe0" + struct.pack(">H", 16) + b"JFIF\x00" + bytes(9)
+    sof0 = b"\xff\xc0" + struct.pack(">HBHHB", 11, 8, 17, 33, 1) + b"\x01\x11\x00"
+    (folder / "b.jpg").write_bytes(b"\xff\xd8" + app0 + sof0 + b"\xff\xd9")
+    (folder / "c.webp").write_bytes(_riff_webp(b"VP8 ", b"\x00" * 3 + b"\x9d\x01\x2a" + struct.pack("<HH", 20, 10) + bytes(8)))
+    (folder / "d.bmp").write_bytes(b"BM" + bytes(12) + struct.pack("<Iii", 40, 7, -5) + bytes(28))
+    (folder / "e.webp").write_bytes(_riff_webp(b"VP8X", bytes(4) + (29).to_bytes(3, "little") + (29).to_bytes(3, "little")))
+    (folder / "f.gif").write_bytes(_animated_gif(12, 9, frames=3, delay_cs=25))
+
+    tkhd = bytes(76) + struct.pack(">II", 640 << 16, 360 << 16)
+    mvhd = bytes(12) + struct.pack(">II", 1000, 2500) + bytes(80)
+    moov = _mp4_box(b"moov", _mp4_box(b"mvhd", mvhd) + _mp4_box(b"trak", _mp4_box(b"tkhd", tkhd)))
+    # moov after mdat (a non-faststart file): the parser must seek past the payload.
+    (folder / "g.mp4").write_bytes(_mp4_box(b"ftyp", b"isom" + bytes(4)) + _mp4_box(b"mdat", bytes(4096)) + moov)
+    info = _ebml(0x1549A966, _ebml(0x2AD7B1, (1_000_000).to_bytes(3, "big")) + _ebml(0x4489, struct.pack(">d", 4000.0)))
+    video = _ebml(0xE0, _ebml(0xB0, (320).to_bytes(2, "big")) + _ebml(0xBA, (240).to_bytes(2, "big")))
+    tracks = _ebml(0x1654AE6B, _ebml(0xAE, _ebml(0xD7, b"\x01") + video))
+    webm = _ebml(0x1A45DFA3, _ebml(0x4282, b"webm")) + _ebml(0x18538067, info + tracks + _ebml(0x1F43B675, bytes(64)), unknown_size=True)
+    (folder / "h.webm").write_bytes(webm)
+
+    entries = {a["filename"]: a for a in mcp_app.get_character_media_manifest("6166r")["assets"]}
+    for name, (width, height) in sizes.items():
+        assert (entries[name]["width"], entries[name]["height"]) == (width, height), name
+    assert (entries["e.webp"]["width"], entries["e.webp"]["height"]) == (30, 30)
+    assert entries["f.gif"]["duration_s"] == 0.75
+    assert entries["g.mp4"] == {**entries["g.mp4"], "width": 640, "height": 360, "duration_s": 2.5}
+    assert entries["h.webm"] == {**entries["h.webm"], "width": 320, "height": 240, "duration_s": 4.0}
+    assert entries["a.png"]["sha256"] == hashlib.sha256((folder / "a.png").read_bytes()).hexdigest()
+
+    # Repeat manifests are served from the per-version cache; a rewrite is re-probed.
+    calls = []
+    real_probe = media_meta.probe
+    monkeypatch.setattr(media_meta, "probe", lambda p: calls.append(p) or real_probe(p))
+    mcp_app.get_character_media_manifest("6166r")
+    assert calls == []
+    media_meta._memo.clear()
+    mcp_app.get_character_media_manifest("6166r")
+    assert calls == []  # shared SQLite cache survives a process-local miss
+    (folder / "a.png").write_bytes(png_bytes(8, 8, 2))
+    entries = {a["filename"]: a for a in mcp_app.get_character_media_manifest("6166r")["assets"]}
+    assert [p.name for p in calls] == ["a.png"] and entries["a.png"]["width"] == 8
+
+    # Story assets get the same fields at ingest time, stored in story.json.
+    (config.COMFY_OUTPUT_DIR / "clip.mp4").write_bytes((folder / "g.mp4").read_bytes())
+    mcp_app.ingest_comfy_outputs("6166r", story_id="meta", limit=5, mode="copy")
+    stored = json.loads((config.STORIES_DIR / "meta" / "story.json").read_text(encoding="utf-8"))
+    assert stored["assets"][0]["duration_s"] == 2.5 and stored["assets"][0]["width"] == 640
+
+
+def test_ingest_reports_dedupe_without_image_extra(tmp_path, monkeypatch):
+    from mcp_server import phash
+
+    monkeypatch.setattr(phash, "available", lambda: False)
+    monkeypatch.setattr(config, "CHARACTERS_IMAGE_DIR", tmp_path / "images")
+    monkeypatch.setattr(config, "COMFY_OUTPUT_DIR", tmp_path / "comfy-output")
+    config.COMFY_OUTPUT_DIR.mkdir()
+    (config.COMFY_OUTPUT_DIR / "render.png").write_bytes(b"png")
+
+    assert "numpy" in mcp_app.ingest_comfy_outputs("6166r", dedupe="skip")["error"]
+    monkeypatch.setattr(config, "DEDUPE_MODE", "skip")
+    result = mcp_app.ingest_comfy_outputs("6166r")
+    assert result["ingested"] == 1 and result["dedupe_unavailable"] is True
+
+
+def test_ingest_skips_or_flags_perceptual_near_duplicates(tmp_path, monkeypatch):
+    import os
+
+    np = pytest.importorskip("numpy")
+    Image = pytest.importorskip("PIL.Image")
+
+    from mcp_server import phash
+
+    monkeypatch.setattr(config, "WORKSPACE_DIR", tmp_path)
+    monkeypatch.setattr(config, "CHARACTERS_IMAGE_DIR", tmp_path / "images")
+    monkeypatch.setattr(config, "STORIES_DIR", tmp_path / "stories")
+    monkeypatch.setattr(config, "COMFY_OUTPUT_DIR", tmp_path / "comfy-output")
+    monkeypatch.setattr(config, "SHARED_CACHE_PATH", str(tmp_path / "cache.sqlite3"))
+    out = config.COMFY_OUTPUT_DIR
+    out.mkdir()
+    rng = np.random.default_rng(3)
+    base = (np.add.outer(np.arange(96), np.arange(128)) % 256).astype(np.uint8)
+    base = np.stack([base, base[::-1], np.full_like(base, 90)], axis=-1)
+    Image.fromarray(base).save(out / "render_000.png")
+    noisy = np.clip(base.astype(int) + rng.integers(-6, 7, base.shape), 0, 255).astype(np.uint8)
+    Image.fromarray(noisy).save(out / "render_001.jpg", quality=85)
+    Image.fromarray(rng.integers(0, 256, base.shape, dtype=np.uint8)).save(out / "render_002.png")
+    (out / "clip.mp4").write_bytes(b"mp4")
+    for age, name in enumerate(("clip.mp4", "render_000.png", "render_001.jpg", "render_002.png")):
+        os.utime(out / name, (1_700_000_000 - age, 1_700_000_000 - age))  # ingest order: newest first
+
+    first = mcp_app.ingest_comfy_outputs("6166r", dedupe="skip")
+    assert first["ingested"] == 3
+    assert [(d["source"].rsplit("/", 1)[-1], d["action"]) for d in first["duplicates"]] == [("render_001.jpg", "skipped")]
+    index = phash.index_for("6166r")
+    assert len(index) == 2 and (tmp_path / ".cache" / "phash" / "6166r.npz").is_file()
+
+    # Re-ingesting the same folder: every image now matches the index.
+    flagged = mcp_app.ingest_comfy_outputs("6166r", dedupe="flag")
+    assert flagged["ingested"] == 4
+    assert {a["filename"].split("_", 2)[-1]: a.get("duplicate_distance") for a in flagged["assets"]}["render_002.png"] == 0
+
+    # A fresh process reloads the persisted index instead of re-hashing the folder.
+    phash._indexes.clear()
+    calls = []
+    monkeypatch.setattr(phash, "dhash", lambda p: calls.append(p))
+    with phash.index_lock("6166r"):
+        assert phash.index_for("6166r").sync() == 0
+    assert calls == [] and len(phash.index_for("6166r")) == len(list((tmp_path / "images" / "6166r").glob("*_render_*")))
+
+    hashes = np.array([0, 0b1011, 2**64 - 1], dtype=np.uint64)
+    assert phash.hamming(hashes, 0b1).tolist() == [1, 2, 63]
+
+
+def test_get_character_context_respects_token_budget(tmp_path, monkeypatch):
+    from mcp_server import context_budget
+
+    desc_dir = tmp_path / "descriptions"
+    img_dir = tmp_path / "images" / "0000g"
+    desc_dir.mkdir(parents=True)
+    img_dir.mkdir(parents=True)
+    backstory = " ".join(f"Chapter {i} of a long life by the harbour." for i in range(200))
+    (desc_dir / "0000g.yaml").write_text(
+        f"name: Alice\nage: 31\nbackstory: {backstory}\nlikes:\n  - tea\n  - radios\nprofile_image: avatar.png\n",
+        encoding="utf-8",
+    )
+    (img_dir / "avatar.png").write_bytes(b"fake")
+    monkeypatch.setattr(config, "CHARACTERS_DESC_DIR", desc_dir)
+    monkeypatch.setattr(config, "CHARACTERS_IMAGE_DIR", tmp_path / "images")
+    monkeypatch.setattr(config, "SHARED_CACHE_PATH", str(tmp_path / "cache.sqlite3"))
+
+    full = asyncio.run(mcp_app.get_character_context("0000g", _DummyCtx()))
+    assert full[0]["backstory"] == backstory and "_context_budget" not in full[0]
+
+    bounded = asyncio.run(mcp_app.get_character_context("0000g", _DummyCtx(), max_tokens=120))
+    # The report itself counts toward the budget.
+    assert context_budget.estimate_tokens(bounded[0]) <= 120
+    profile = bounded[0]
+    budget = profile.pop("_context_budget")
+    assert len(bounded) == 1 and budget["image"]["omitted"]  # no room left for the image
+    assert profile["name"] == "Alice" and profile["age"] == 31 and profile["likes"] == ["tea", "radios"]
+    assert profile["backstory"].endswith("…") and budget["truncated"] == ["backstory"]
+    assert budget["max_tokens"] == 120 and budget["estimated_tokens"] <= 120
+    # Per-field estimates are dropped from a tight report and kept when there is room.
+    assert "field_tokens" not in budget
+    roomy = asyncio.run(mcp_app.get_character_context("0000g", _DummyCtx(), max_tokens=800))
+    assert context_budget.estimate_tokens(roomy[0]) <= 800
+    assert roomy[0]["_context_budget"]["field_tokens"]["backstory"] > 1000
+
+    picked = asyncio.run(mcp_app.get_character_context("0000g", _DummyCtx(), fields=["likes", "name", "nope"]))
+    assert list(picked[0]) == ["likes", "name", "_context_budget"]
+    assert picked[0]["_context_budget"]["missing"] == ["nope"]
+
+    # The same budget is served from the variant cache until the YAML changes.
+    mcp_app.metrics.METRICS.reset()
+    asyncio.run(mcp_app.get_character_context("0000g", _DummyCtx(), max_tokens=120))
+    assert mcp_app.metrics.METRICS.snapshot()["counters"]["none"]["cache_hit:context_budget"] == 1
+    (desc_dir / "0000g.yaml").write_text("name: Alicia\nbackstory: short\n", encoding="utf-8")
+    changed = asyncio.run(mcp_app.get_character_context("0000g", _DummyCtx(), max_tokens=120))
+    assert changed[0]["name"] == "Alicia" and changed[0]["_context_budget"]["truncated"] == []
+
+
+def test_find_similar_characters_uses_incremental_embedding_index(tmp_path, monkeypatch):
+    pytest.importorskip("numpy")
+    from mcp_server import semantic_index
+
+    desc_dir = tmp_path / "descriptions"
+    desc_dir.mkdir()
+    profiles = {
+        "0001a": "name: Mei\npersonality: cautious, careful, patient\nlikes:\n  - plays the erhu\n  - music festivals\n",
+        "0002b": "name: Ravi\npersonality: reckless, loud, brave\nlikes:\n  - motorbikes\n  - street racing\n",
+        "0003c": "name: Ana\npersonality: analytical, quiet\nlikes:\n  - chess\n  - repairs radios\n",
+        "0004d": "name: Tom\npersonality: careful, cautious\nlikes:\n  - musical theatre\n  - collects vinyl\n",
+    }
+    for code, text in profiles.items():
+        (desc_dir / f"{code}.yaml").write_text(text, encoding="utf-8")
+    monkeypatch.setattr(config, "CHARACTERS_DESC_DIR", desc_dir)
+    monkeypatch.setattr(config, "SEMANTIC_INDEX_DIR", str(tmp_path / "semantic"))
+    monkeypatch.setattr(config, "SHARED_CACHE_PATH", str(tmp_path / "cache.sqlite3"))
+
+    found = mcp_app.find_similar_characters(query="someone cautious who loves music", k=2)
+    assert {r["code"] for r in found["results"]} == {"0001a", "0004d"}
+    assert found["index"] == {"size": 4, "embedded": 4, "removed": 0} and found["model"] == "hashing-1024"
+    assert found["results"][0]["score"] >= found["results"][1]["score"] > 0
+
+    like_tom = mcp_app.find_similar_characters(code="0004d", k=1)
+    assert like_tom["results"][0]["code"] == "0001a" and like_tom["index"]["embedded"] == 0
+
+    # Edits re-embed just the changed file; deletions free their row for reuse.
+    (desc_dir / "0002b.yaml").write_text("name: Ravi\npersonality: cautious\nlikes:\n  - music\n", encoding="utf-8")
+    (desc_dir / "0003c.yaml").unlink()
+    (desc_dir / "0005e.yaml").write_text("name: Zed\nlikes:\n  - chess\n", encoding="utf-8")
+    again = mcp_app.find_similar_characters(query="chess", k=1)
+    assert again["index"] == {"size": 4, "embedded": 2, "removed": 1}
+    assert again["results"][0]["code"] == "0005e"
+
+    # Another process maps the same on-disk matrix without embedding anything.
+    semantic_index._indexes.clear()
+    fresh = semantic_index.get_index(lambda p: {})
+    assert fresh.sync(desc_dir)["embedded"] == 0
+    assert fresh.search(fresh.embed_query("cautious music"), 1)[0]["code"] in {"0001a", "0002b", "0004d"}
+    assert mcp_app.find_similar_characters(query="x", code="0001a")["error"]
+
+
+def test_single_process_keeps_caches_in_memory(tmp_path, monkeypatch):
+    from mcp_server import shared_cache
+
+    monkeypatch.setattr(config, "SHARED_CACHE", False)
+    desc_dir = tmp_path / "descriptions"
+    desc_dir.mkdir()
+    (desc_dir / "0000g.yaml").write_text("name: Alice\n", encoding="utf-8")
+    monkeypatch.setattr(config, "CHARACTERS_DESC_DIR", desc_dir)
+    parsed = []
+    real_parse = mcp_app._parse_character_text
+    monkeypatch.setattr(mcp_app, "_parse_character_text", lambda text: parsed.append(text) or real_parse(text))
+
+    assert mcp_app._load_yaml_for("0000g")["name"] == "Alice"
+    assert mcp_app._load_yaml_for("0000g")["name"] == "Alice"
+    assert len(parsed) == 1 and isinstance(shared_cache.get_cache(), shared_cache.MemoryCache)
+    assert not shared_cache.cache_path().exists()
+
+
+def test_story_variants_log_missing_pillow_once(monkeypatch, caplog):
+    import logging
+    import sys
+
+    from mcp_server import story_variants
+
+    monkeypatch.setitem(sys.modules, "PIL", None)
+    story_variants._pil.cache_clear()
+    try:
+        with caplog.at_level(logging.INFO, logger=story_variants.LOG.name):
+            assert story_variants._pil() is None and story_variants._pil() is None
+        assert [r.levelno for r in caplog.records if "Pillow" in r.message] == [logging.INFO]
+    finally:
+        story_variants._pil.cache_clear()
+
+
+def test_image_download_skips_only_files_with_matching_digest(tmp_path, monkeypatch):
+    import hashlib
+
+    import huggingface_hub
+    from huggingface_hub.hf_api import RepoFile
+
+    good, stale = b"good-bytes", b"same-size!"
+    sha = hashlib.sha256(good).hexdigest()
+    entries = [
+        RepoFile(path=f"0000h/{name}", size=len(good), oid="0" * 40, lfs={"oid": sha, "size": len(good), "pointerSize": 1})
+        for name in ("kept.png", "stale.png")
+    ]
+
+    class FakeApi:
+        def list_repo_tree(self, *_args, **_kwargs):
+            return entries
+
+    fetched = []
+
+    def fake_download(url, dest, **kwargs):
+        fetched.append(dest.name)
+        dest.write_bytes(good)
+        return {"checksum": f"sha256:{sha}"}
+
+    monkeypatch.setattr(huggingface_hub, "HfApi", FakeApi)
+    monkeypatch.setattr(mcp_app.transfers, "download", fake_download)
+    monkeypatch.setattr(config, "CHARACTERS_IMAGE_DIR", tmp_path / "images")
+    folder = tmp_path / "images" / "0000h"
+    folder.mkdir(parents=True)
+    (folder / "kept.png").write_bytes(good)
+    (folder / "stale.png").write_bytes(stale)  # right size, wrong content
+
+    mcp_app.metrics.METRICS.reset()
+    assert mcp_app._download_images_for_code_locked("0000h") == 1
+    assert fetched == ["stale.png"] and (folder / "stale.png").read_bytes() == good
+    # Both digests are now cached per file version: nothing is hashed or fetched again.
+    assert mcp_app._download_images_for_code_locked("0000h") == 0
+    counters = mcp_app.metrics.METRICS.snapshot()["counters"]["none"]
+    assert counters["cache_miss:file_digest"] == 2 and counters["cache_hit:file_digest"] == 2
@@ -0,0 +1,77 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def _env(tmp_path):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([str(ROOT / "src"), str(ROOT), env.get("PYTHONPATH", "")])
+    env["WORKSPACE_DIR"] = str(tmp_path / "default-ws")
+    return env
+
+
+def test_benchmark_emits_comparable_json(tmp_path):
+    out = tmp_path / "bench.json"
+    cmd = [
+        sys.executable, "-m", "scripts.benchmark",
+        "--scales", "5", "--iterations", "2", "--comfy-outputs", "4",
+        "--stories", "1", "--assets-per-story", "3", "--output", str(out),
+    ]
+    subprocess.run(cmd, cwd=ROOT, env=_env(tmp_path), check=True, timeout=300)
+    report = json.loads(out.read_text(encoding="utf-8"))
+    names = {row["name"] for row in report["results"]}
+    assert {"list_characters", "get_character_context", "character://{code}/profile"} <= names
+    assert all(row["warm"]["n"] == 2 for row in report["results"])
+
+    cmp = subprocess.run(
+        cmd[:-2] + ["--output", str(tmp_path / "again.json"), "--compare", str(out), "--threshold", "1000"],
+        cwd=ROOT, env=_env(tmp_path), timeout=300,
+    )
+    assert cmp.returncode == 0
+
+
+def test_loadtest_runs_offline_against_http_server(tmp_path):
+    out = tmp_path / "load.json"
+    cmd = [
+        sys.executable, "-m", "scripts.loadtest",
+        "--clients", "2", "--duration", "2", "--characters", "5",
+        "--remote-characters", "2", "--stories", "1", "--assets-per-story", "2",
+        "--output", str(out),
+    ]
+    subprocess.run(cmd, cwd=ROOT, env=_env(tmp_path), check=True, timeout=300)
+    report = json.loads(out.read_text(encoding="utf-8"))
+    assert report["overall"]["n"] > 0
+    assert report["errors_total"] == 0
+    assert report["memory"]["rss_start_bytes"] > 0
+
+
+def test_yaml_bench_reports_fallback_cache_gain(monkeypatch):
+    import yaml
+
+    sys.path.insert(0, str(ROOT))
+    from scripts import yaml_bench
+    from mcp_server import mcp_app
+
+    malformed = "name: Alice\npersonality: Positive: kind, curious\n"
+    strict_calls = []
+    real_load = yaml.load
+
+    def counting_load(*args, **kwargs):
+        strict_calls.append(kwargs.get("Loader"))
+        return real_load(*args, **kwargs)
+
+    monkeypatch.setattr(yaml, "load", counting_load)
+    mcp_app._yaml_fallback_digests.clear()
+    assert mcp_app._parse_character_text(malformed)["personality"] == "Positive: kind, curious"
+    assert mcp_app._parse_character_text(malformed)["name"] == "Alice"
+    assert len(strict_calls) == 1  # the second parse skips the strict attempt
+    assert strict_calls[0] is getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    monkeypatch.undo()
+
+    report = yaml_bench.run(files=20, rounds=2)
+    assert report["malformed_files"] == 4
+    assert set(report["results"]["malformed"]) == {"safe_load+fallback", "csafe+fallback", "csafe+fallback_cache"}
@@ -0,0 +1,64 @@
+import asyncio
+
+import anyio
+from fastmcp import Client, FastMCP
+
+from mcp_server import comfy_proxy
+
+
+def _fake_comfy():
+    calls = {"list_workflows": 0, "generate": 0}
+    upstream = FastMCP("fake-comfy")
+
+    @upstream.tool
+    def list_workflows() -> list[str]:
+        calls["list_workflows"] += 1
+        return ["txt2img", "img2img"]
+
+    @upstream.tool
+    def generate(prompt: str) -> dict:
+        calls["generate"] += 1
+        return {"prompt": prompt, "job": calls["generate"]}
+
+    return upstream, calls
+
+
+def test_managed_comfy_proxy_keeps_alive_caches_and_restarts():
+    upstream, calls = _fake_comfy()
+    proxy = comfy_proxy.ManagedComfyProxy(upstream, cache_ttl=60, cache_patterns=["list_*"], health_interval=3600)
+    host = FastMCP("host")
+    host.mount(proxy.server, namespace="comfy")
+
+    async def _run():
+        async with Client(host) as client:
+            first = (await client.call_tool("comfy_list_workflows", {})).data
+            for _ in range(4):
+                assert (await client.call_tool("comfy_list_workflows", {})).data == first
+            jobs = [(await client.call_tool("comfy_generate", {"prompt": "cat"})).data["job"] for _ in range(3)]
+            session = proxy._client
+
+            # A broken upstream transport drops the session; read-only calls retry on a fresh one.
+            proxy._cache.clear()
+            original = session.call_tool_mcp
+
+            async def broken(*args, **kwargs):
+                raise anyio.ClosedResourceError()
+
+            session.call_tool_mcp = broken
+            recovered = (await client.call_tool("comfy_list_workflows", {})).data
+            session.call_tool_mcp = original
+            healthy = await proxy.check_health()
+            return first, jobs, session, recovered, healthy
+
+    first, jobs, session, recovered, healthy = asyncio.run(_run())
+
+    assert first == ["txt2img", "img2img"]
+    assert calls["list_workflows"] == 2  # one miss before the fault, one after the restart
+    assert jobs == [1, 2, 3]  # non-read-only tools always reach the upstream
+    assert recovered == first and healthy
+    status = proxy.status()
+    assert status["connects"] == 2 and status["restarts"] == 1
+    assert proxy._client is not session
+    assert status["cache"]["hits"] == 4
+    assert "upstream:comfy:generate" in status["upstream"]
+    assert status["upstream"]["upstream:comfy:generate"]["count"] == 3
@@ -0,0 +1,88 @@
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def test_stdio_shim_shares_one_daemon(tmp_path):
+    from fastmcp import Client
+    from fastmcp.client.transports import StdioTransport
+
+    sock = Path("/tmp") / f"storyworld-test-{os.getpid()}.sock"
+    env = dict(os.environ)
+    env.update(
+        {
+            "PYTHONPATH": os.pathsep.join([str(ROOT / "src"), env.get("PYTHONPATH", "")]),
+            "WORKSPACE_DIR": str(tmp_path / "ws"),
+            "STORYWORLD_DAEMON": "1",
+            "STORYWORLD_DAEMON_SOCKET": str(sock),
+            "STORYWORLD_DAEMON_IDLE_TIMEOUT": "2",
+            "COMFY_MCP_AUTO_SPAWN": "0",
+        }
+    )
+    desc = tmp_path / "ws" / "characters" / "descriptions"
+    desc.mkdir(parents=True)
+    (desc / "0000d.yaml").write_text("name: Dana\n", encoding="utf-8")
+
+    async def session():
+        async with Client(StdioTransport(sys.executable, ["-m", "mcp_server.cli"], env=env, cwd=str(tmp_path))) as client:
+            caps = (await client.call_tool("get_runtime_capabilities", {})).data
+            listing = (await client.call_tool("list_characters", {})).data
+            return caps, listing
+
+    async def _run():
+        first = await session()
+        rest = await asyncio.gather(session(), session())
+        return [first, *rest]
+
+    try:
+        results = asyncio.run(_run())
+        pids = {caps["process_id"] for caps, _ in results}
+        assert len(pids) == 1 and os.getpid() not in pids
+        assert all(caps["transport"] == "daemon" for caps, _ in results)
+        assert all(listing["count"] == 1 for _, listing in results)
+
+        # The daemon exits on its own once idle and removes its socket.
+        deadline = time.monotonic() + 20
+        while sock.exists() and time.monotonic() < deadline:
+            time.sleep(0.2)
+        assert not sock.exists()
+    finally:
+        pid_file = sock.with_suffix(".pid")
+        if pid_file.exists():
+            os.kill(int(pid_file.read_text()), 15)
+        for suffix in (".lock", ".log", ".env"):
+            sock.with_suffix(suffix).unlink(missing_ok=True)
+
+
+def test_shim_keeps_daemons_apart_by_environment(tmp_path, monkeypatch):
+    import socket
+
+    import pytest
+
+    from mcp_server import config, shim
+
+    base = {"WORKSPACE_DIR": "/ws", "GITHUB_TOKEN": "a", "PATH": "/bin"}
+    assert shim.env_fingerprint(base) != shim.env_fingerprint({**base, "GITHUB_TOKEN": "b"})
+    assert shim.env_fingerprint(base) != shim.env_fingerprint({**base, "COMFY_MCP_URL": "http://x"})
+    # Per-launch noise and daemon knobs do not split daemons.
+    assert shim.env_fingerprint(base) == shim.env_fingerprint({**base, "PATH": "/usr/bin", "STORYWORLD_DAEMON_IDLE_TIMEOUT": "5"})
+
+    sock_path = Path("/tmp") / f"storyworld-fp-{os.getpid()}.sock"
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(str(sock_path))
+    server.listen(1)
+    monkeypatch.setattr(config, "DAEMON_SOCKET", str(sock_path))
+    try:
+        sock_path.with_suffix(".env").write_text("started-elsewhere", encoding="utf-8")
+        with pytest.raises(RuntimeError, match="different environment"):
+            shim.connect_or_spawn([])
+        sock_path.with_suffix(".env").write_text(shim.env_fingerprint(), encoding="utf-8")
+        shim.connect_or_spawn([]).close()
+    finally:
+        server.close()
+        for suffix in (".sock", ".env"):
+            sock_path.with_suffix(suffix).unlink(missing_ok=True)
@@ -0,0 +1,38 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+# Time `import mcp_server.mcp_app` may add on top of importing fastmcp itself.
+# Measured ~60-100ms locally; override on slow CI with STORYWORLD_IMPORT_BUDGET_MS.
+IMPORT_BUDGET_MS = float(os.getenv("STORYWORLD_IMPORT_BUDGET_MS", "500"))
+LAZY_MODULES = ("yaml", "huggingface_hub")
+
+_PROBE = """
+import json, sys, time
+import fastmcp, fastmcp.server, fastmcp.server.context, fastmcp.server.transforms, fastmcp.resources
+t0 = time.perf_counter()
+import mcp_server.mcp_app
+elapsed_ms = (time.perf_counter() - t0) * 1000
+print(json.dumps({"ms": elapsed_ms, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (LAZY_MODULES,)
+
+
+def test_import_is_lazy_and_within_budget(tmp_path):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([str(ROOT / "src"), env.get("PYTHONPATH", "")])
+    env["WORKSPACE_DIR"] = str(tmp_path / "ws")
+    runs = []
+    for _ in range(3):
+        out = subprocess.run(
+            [sys.executable, "-c", _PROBE], cwd=tmp_path, env=env, capture_output=True, text=True, check=True, timeout=120
+        )
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    assert all(r["loaded"] == [] for r in runs), runs
+    # Directories are created at server startup, not on import.
+    assert not (tmp_path / "ws").exists()
+    best = min(r["ms"] for r in runs)
+    assert best < IMPORT_BUDGET_MS, f"mcp_app import took {best:.0f}ms (budget {IMPORT_BUDGET_MS:.0f}ms)"
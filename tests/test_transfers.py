@@ -0,0 +1,119 @@
+import hashlib
+import os
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from mcp_server import transfers
+
+
+def _serve(files: dict, cut_after: list[int], misrange: set | None = None):
+    """Range-capable file server; the next `cut_after` entries drop a response after N bytes.
+
+    Paths in `misrange` answer every Range request from byte 0 (a broken proxy).
+    """
+    seen = []
+    misrange = misrange if misrange is not None else set()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *_args):
+            return None
+
+        def do_GET(self):
+            body, etag = files[self.path]
+            seen.append((self.headers.get("Range"), self.headers.get("If-Range")))
+            start = 0
+            rng = self.headers.get("Range")
+            if rng and self.headers.get("If-Range") in (None, etag):
+                start = 0 if self.path in misrange else int(rng.split("=")[1].split("-")[0])
+                if start >= len(body):
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{len(body)}")
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+            else:
+                self.send_response(200)
+            payload = body[start:]
+            self.send_header("Content-Length", str(len(payload)))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            if cut_after:
+                self.wfile.write(payload[: cut_after.pop(0)])
+                self.wfile.flush()
+                self.connection.shutdown(socket.SHUT_RDWR)
+                return
+            self.wfile.write(payload)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}", seen
+
+
+def test_download_resumes_verifies_and_renames_atomically(tmp_path):
+    body = os.urandom(3 * 1024 * 1024 + 123)
+    files = {"/video.mp4": (body, '"v1"')}
+    cuts: list[int] = []
+    misrange: set = set()
+    server, base, seen = _serve(files, cuts, misrange)
+    sha = ("sha256", hashlib.sha256(body).hexdigest())
+    dest = tmp_path / "out" / "video.mp4"
+    try:
+        # Dropped mid-stream: the retry inside the same call asks only for the rest.
+        cuts.append(1536 * 1024)
+        result = transfers.download(f"{base}/video.mp4", dest, checksum=sha, backoff=0)
+        assert dest.read_bytes() == body
+        assert result["resumed_from"] == transfers.CHUNK_SIZE
+        assert seen[-1] == (f"bytes={transfers.CHUNK_SIZE}-", '"v1"')
+        assert not list(dest.parent.glob(".*"))
+
+        # Interrupted with no retries left: the .part survives and the next call resumes it.
+        dest.unlink()
+        cuts.append(1536 * 1024)
+        with pytest.raises(transfers.DownloadError):
+            transfers.download(f"{base}/video.mp4", dest, checksum=sha, retries=0)
+        assert not dest.exists() and (dest.parent / ".video.mp4.part").stat().st_size == transfers.CHUNK_SIZE
+        again = transfers.download(f"{base}/video.mp4", dest, checksum=sha)
+        assert again["resumed_from"] == transfers.CHUNK_SIZE and again["fetched_bytes"] == len(body) - transfers.CHUNK_SIZE
+
+        # The file changed upstream: If-Range no longer matches, so the transfer restarts.
+        dest.unlink()
+        cuts.append(1536 * 1024)
+        with pytest.raises(transfers.DownloadError):
+            transfers.download(f"{base}/video.mp4", dest, retries=0)
+        changed = os.urandom(2 * 1024 * 1024)
+        files["/video.mp4"] = (changed, '"v2"')
+        restarted = transfers.download(f"{base}/video.mp4", dest, checksum=("sha256", hashlib.sha256(changed).hexdigest()))
+        assert restarted["resumed_from"] == 0 and dest.read_bytes() == changed
+
+        # A 206 that does not start at the part's offset restarts from 0 instead of failing.
+        dest.unlink()
+        cuts.append(1536 * 1024)
+        with pytest.raises(transfers.DownloadError):
+            transfers.download(f"{base}/video.mp4", dest, retries=0)
+        misrange.add("/video.mp4")
+        realigned = transfers.download(f"{base}/video.mp4", dest, checksum=("sha256", hashlib.sha256(changed).hexdigest()), backoff=0)
+        assert realigned["resumed_from"] == 0 and dest.read_bytes() == changed
+        assert seen[-1][0] is None and not list(dest.parent.glob(".*"))
+        misrange.clear()
+
+        # A checksum mismatch never replaces the destination.
+        bad = tmp_path / "bad.mp4"
+        with pytest.raises(transfers.DownloadError, match="mismatch"):
+            transfers.download(f"{base}/video.mp4", bad, checksum=("sha256", "0" * 64))
+        assert not bad.exists() and not list(tmp_path.glob(".bad.mp4*"))
+
+        # GitHub contents entries verify against their git blob sha.
+        blob = b"name: Alice\n"
+        files["/raw/0000g.yaml"] = (blob, '"y"')
+        git_sha = hashlib.sha1(b"blob %d\0" % len(blob) + blob).hexdigest()
+        transfers.download(f"{base}/raw/0000g.yaml", tmp_path / "0000g.yaml", checksum=("git-sha1", git_sha))
+    finally:
+        server.shutdown()
+
+    stats = transfers.stats()
+    assert stats["resumed"] >= 2 and stats["restarted"] >= 1 and stats["checksum_failures"] >= 1
+    assert stats["bytes"] > 0 and stats["bytes_per_s"] > 0
@@ -0,0 +1,54 @@
+import asyncio
+import sqlite3
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from scripts import loadtest, synthetic_workspace  # noqa: E402
+
+
+def test_multi_worker_http_shares_cache_and_story_locks(tmp_path):
+    from fastmcp import Client
+
+    workspace = tmp_path / "ws"
+    ws = synthetic_workspace.build_workspace(workspace, characters=6, images=1, comfy_outputs=6, stories=1, assets_per_story=2)
+    standin, base = loadtest.start_standins({})
+    port = loadtest._free_port()
+    proc = loadtest.start_server(workspace, base, port, tmp_path / "server.log", workers=2)
+
+    async def _run():
+        async def ingest(code):
+            async with Client(f"http://127.0.0.1:{port}/mcp", timeout=60) as client:
+                return (await client.call_tool("ingest_comfy_outputs", {"code": code, "story_id": "story-000", "limit": 3})).data
+
+        async with Client(f"http://127.0.0.1:{port}/mcp", timeout=60) as client:
+            listing = (await client.call_tool("list_characters", {})).data
+        ingests = await asyncio.gather(*(ingest(code) for code in ws["codes"][:4]))
+        async with Client(f"http://127.0.0.1:{port}/mcp", timeout=60) as client:
+            manifest = (await client.call_tool("build_story_page", {"story_id": "story-000"})).data
+        return listing, ingests, manifest
+
+    try:
+        loadtest.wait_for_port(port, proc)
+        listing, ingests, manifest = asyncio.run(_run())
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        standin.shutdown()
+
+    assert listing["count"] == 6
+    # Story writes from concurrent requests (possibly on different workers) all land.
+    story_paths = {a["story_path"] for r in ingests for a in r["assets"]}
+    assert len(story_paths) == 12
+    assert manifest["assets_count"] == 2 + 12
+
+    db = workspace / ".cache" / "storyworld.sqlite3"
+    with sqlite3.connect(db) as conn:
+        rows = conn.execute("SELECT COUNT(*) FROM entries WHERE ns = 'character_yaml'").fetchone()[0]
+    assert rows == 6